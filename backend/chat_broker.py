@@ -0,0 +1,254 @@
+"""
+Chat pub/sub brokers. Chat rooms span worker processes and hosts: the node that receives
+a message translates it once and publishes it to the room's channel; every node that has
+participants of that room connected delivers it to its own local sockets.
+"""
+import asyncio
+import json
+import logging
+import time
+import urllib.parse
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger("volkovoice")
+
+
+class ChatBroker:
+    """Pub/sub transport plus room presence shared by every node serving chat."""
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def publish(self, channel: str, message: str):
+        raise NotImplementedError
+
+    async def subscribe(self, channel: str, handler):
+        """Registers an async handler(message: str) for a channel on this node."""
+        raise NotImplementedError
+
+    async def unsubscribe(self, channel: str):
+        raise NotImplementedError
+
+    async def add_presence(self, room: str, member: str, info: Dict[str, Any]):
+        raise NotImplementedError
+
+    async def remove_presence(self, room: str, member: str):
+        raise NotImplementedError
+
+    async def presence(self, room: str) -> Dict[str, Dict[str, Any]]:
+        raise NotImplementedError
+
+
+class InMemoryChatBroker(ChatBroker):
+    """Single-process broker, used when CHAT_BROKER_URL is not configured."""
+
+    def __init__(self):
+        self._handlers: Dict[str, Any] = {}
+        self._presence: Dict[str, Dict[str, Dict[str, Any]]] = {}
+
+    async def publish(self, channel: str, message: str):
+        handler = self._handlers.get(channel)
+        if handler:
+            await handler(message)
+
+    async def subscribe(self, channel: str, handler):
+        self._handlers[channel] = handler
+
+    async def unsubscribe(self, channel: str):
+        self._handlers.pop(channel, None)
+
+    async def add_presence(self, room: str, member: str, info: Dict[str, Any]):
+        self._presence.setdefault(room, {})[member] = {**info, "seen": time.time()}
+
+    async def remove_presence(self, room: str, member: str):
+        members = self._presence.get(room)
+        if members is not None:
+            members.pop(member, None)
+            if not members: del self._presence[room]
+
+    async def presence(self, room: str) -> Dict[str, Dict[str, Any]]:
+        return dict(self._presence.get(room, {}))
+
+
+class RedisProtocolError(Exception):
+    pass
+
+
+class RedisCommandError(RedisProtocolError):
+    """An error reply (-ERR ...) to a single command."""
+
+
+class RespConnection:
+    """Minimal asyncio client for the Redis serialization protocol (RESP2)."""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.closed = False
+        self._lock = asyncio.Lock()
+
+    @classmethod
+    async def open(cls, url: str) -> "RespConnection":
+        parsed = urllib.parse.urlparse(url)
+        reader, writer = await asyncio.open_connection(parsed.hostname or "localhost", parsed.port or 6379)
+        connection = cls(reader, writer)
+        if parsed.password:
+            auth_args = [parsed.username, parsed.password] if parsed.username else [parsed.password]
+            await connection.execute("AUTH", *auth_args)
+        if parsed.path.strip("/"):
+            await connection.execute("SELECT", parsed.path.strip("/"))
+        return connection
+
+    @staticmethod
+    def encode_command(*args) -> bytes:
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(parts)
+
+    async def read_reply(self) -> Any:
+        line = await self.reader.readline()
+        if not line:
+            raise ConnectionError("Redis connection closed.")
+        kind, body = line[:1], line[1:-2]
+        if kind == b"+":
+            return body.decode()
+        if kind == b"-":
+            raise RedisCommandError(body.decode())
+        if kind == b":":
+            return int(body)
+        if kind == b"$":
+            length = int(body)
+            if length == -1: return None
+            return (await self.reader.readexactly(length + 2))[:-2]
+        if kind == b"*":
+            count = int(body)
+            if count == -1: return None
+            return [await self.read_reply() for _ in range(count)]
+        raise RedisProtocolError(f"Unexpected RESP reply type {kind!r}")
+
+    async def send(self, *args):
+        """Writes a command without waiting for its reply (used on subscriber connections)."""
+        async with self._lock:
+            self.writer.write(self.encode_command(*args))
+            await self.writer.drain()
+
+    async def execute(self, *args) -> Any:
+        """
+        Sends a command and reads its reply. If that is interrupted (cancellation, a broken
+        connection, an unparseable reply), the reply may still be in flight and would be read
+        by the next command, so the connection is closed; later calls raise ConnectionError.
+        """
+        async with self._lock:
+            if self.closed:
+                raise ConnectionError("Redis connection closed.")
+            try:
+                self.writer.write(self.encode_command(*args))
+                await self.writer.drain()
+                return await self.read_reply()
+            except RedisCommandError:
+                raise  # The server answered with an error reply; the connection is still in step
+            except BaseException:
+                self.close()
+                raise
+
+    def close(self):
+        self.closed = True
+        self.writer.close()
+
+
+class RedisChatBroker(ChatBroker):
+    """
+    Broker backed by any server speaking the Redis protocol (Redis, Valkey, KeyDB or a
+    local stand-in). Uses one connection for commands and one for subscriptions.
+    Presence lives in a hash per room; entries carry a 'seen' timestamp refreshed by
+    the owning node, so members of a crashed node age out.
+    """
+
+    RECONNECT_DELAY_SECONDS = 1.0
+
+    def __init__(self, url: str, presence_ttl_seconds: float):
+        self.url = url
+        self.presence_ttl_seconds = presence_ttl_seconds
+        self._handlers: Dict[str, Any] = {}
+        self._commands: Optional[RespConnection] = None
+        self._subscriber: Optional[RespConnection] = None
+        self._listener: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._commands = await RespConnection.open(self.url)
+        self._subscriber = await RespConnection.open(self.url)
+        self._listener = asyncio.create_task(self._listen())
+        logger.info("Connected to Redis chat broker.")
+
+    async def close(self):
+        if self._listener: self._listener.cancel()
+        for connection in (self._commands, self._subscriber):
+            if connection: connection.close()
+
+    async def _execute(self, *args) -> Any:
+        try:
+            return await self._commands.execute(*args)
+        except ConnectionError:
+            logger.warning("Redis command connection lost; reconnecting.")
+            self._commands = await RespConnection.open(self.url)
+            return await self._commands.execute(*args)
+
+    async def _listen(self):
+        while True:
+            try:
+                reply = await self._subscriber.read_reply()
+            except (ConnectionError, asyncio.IncompleteReadError) as e:
+                logger.error(f"Redis subscriber connection lost: {e}. Reconnecting...")
+                await asyncio.sleep(self.RECONNECT_DELAY_SECONDS)
+                try:
+                    self._subscriber = await RespConnection.open(self.url)
+                    if self._handlers:
+                        await self._subscriber.send("SUBSCRIBE", *self._handlers)
+                except OSError as reconnect_error:
+                    logger.error(f"Redis reconnect failed: {reconnect_error}")
+                continue
+            if isinstance(reply, list) and reply and reply[0] == b"message":
+                handler = self._handlers.get(reply[1].decode())
+                if handler:
+                    try:
+                        await handler(reply[2].decode())
+                    except Exception as e:
+                        logger.error(f"Chat broker handler failed: {e}", exc_info=True)
+
+    async def publish(self, channel: str, message: str):
+        await self._execute("PUBLISH", channel, message)
+
+    async def subscribe(self, channel: str, handler):
+        self._handlers[channel] = handler
+        await self._subscriber.send("SUBSCRIBE", channel)
+
+    async def unsubscribe(self, channel: str):
+        if self._handlers.pop(channel, None) is not None:
+            await self._subscriber.send("UNSUBSCRIBE", channel)
+
+    @staticmethod
+    def _presence_key(room: str) -> str:
+        return f"volkovoice:chat:presence:{room}"
+
+    async def add_presence(self, room: str, member: str, info: Dict[str, Any]):
+        key = self._presence_key(room)
+        await self._execute("HSET", key, member, json.dumps({**info, "seen": time.time()}))
+        await self._execute("EXPIRE", key, int(self.presence_ttl_seconds * 2))
+
+    async def remove_presence(self, room: str, member: str):
+        await self._execute("HDEL", self._presence_key(room), member)
+
+    async def presence(self, room: str) -> Dict[str, Dict[str, Any]]:
+        reply = await self._execute("HGETALL", self._presence_key(room)) or []
+        cutoff = time.time() - self.presence_ttl_seconds
+        members = {}
+        for member, raw in zip(reply[::2], reply[1::2]):
+            info = json.loads(raw)
+            if info.get("seen", 0) >= cutoff:
+                members[member.decode()] = info
+        return members
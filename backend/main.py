@@ -11,6 +11,10 @@ import os
 import asyncio
 import logging
 import logging.config
+import logging.handlers
+import queue
+import contextvars
+import atexit
 import json
 import datetime
 import shutil
@@ -18,6 +22,25 @@ import gc
 import re
 import time
 import uuid
+import functools
+import itertools
+import struct
+import threading
+import hashlib
+import sys
+import cProfile
+import secrets
+import fcntl
+import heapq
+import collections
+import csv
+import socket
+import urllib.parse
+import array
+import wave
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape as xml_escape
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from contextlib import asynccontextmanager
 from typing import List, Optional, AsyncGenerator, Dict, Any, Union
 from uuid import uuid4
@@ -26,16 +49,17 @@ from uuid import uuid4
 import fastapi
 from fastapi import (
     FastAPI, Depends, HTTPException, status, WebSocket, WebSocketDisconnect,
-    UploadFile, File, Header, Query, Body, Request, BackgroundTasks
+    UploadFile, File, Form, Header, Query, Body, Request, BackgroundTasks
 )
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.responses import JSONResponse, StreamingResponse, FileResponse
 from fastapi.security import OAuth2PasswordBearer
 
 import databases
 import sqlalchemy
 from sqlalchemy import (
-    create_engine, MetaData, Table, Column, Integer, String, DateTime, Boolean, ForeignKey, JSON
+    create_engine, MetaData, Table, Column, Integer, String, DateTime, Boolean, ForeignKey, JSON, Index, bindparam,
+    Date, Float, UniqueConstraint
 )
 
 from pydantic import BaseModel, Field, EmailStr
@@ -49,7 +73,6 @@ import torch
 from transformers import pipeline as hf_pipeline
 from TTS.api import TTS
 from pyannote.audio import Pipeline as DiarizationPipeline
-import tempfile
 import numpy as np
 from TTS.tts.configs.xtts_config import XttsConfig
 from TTS.tts.models.xtts import Xtts
@@ -61,31 +84,102 @@ import io
 from keybert import KeyBERT
 from sentence_transformers import SentenceTransformer
 from openai import AsyncOpenAI
+import httpx
+
+# Local Imports
+from chat_broker import ChatBroker, InMemoryChatBroker, RedisChatBroker
+from quota import QuotaManager
 # ==============================================================================
 # II. ADVANCED LOGGING CONFIGURATION
 # ==============================================================================
+# Loggers only enqueue records (QueueHandler); a listener thread formats them and does
+# the console/file I/O, so JSON formatting and disk writes never run on the event loop.
+LOG_QUEUE: "queue.SimpleQueue" = queue.SimpleQueue()
+
+# Structured ids attached to every record logged inside a voice/chat session or utterance
+log_session_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("log_session_id", default=None)
+log_utterance_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("log_utterance_id", default=None)
+
+
+class LogContextFilter(logging.Filter):
+    """Copies the current session/utterance ids onto the record (runs in the logging thread of origin)."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.session_id = log_session_id.get()
+        record.utterance_id = log_utterance_id.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Per-call-site rate sampling for hot-path logs: at most `burst` records per logging call
+    (source file and line) and interval pass; the rest are counted and reported on the next
+    one let through. Warnings and errors are never sampled.
+    """
+
+    def __init__(self, burst: int, interval_seconds: float):
+        super().__init__()
+        self.burst = burst
+        self.interval_seconds = interval_seconds
+        self._windows: Dict[tuple, list] = {}  # (pathname, lineno) -> [window start, passed, suppressed]
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        key = (record.pathname, record.lineno)
+        now = record.created
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.interval_seconds:
+                suppressed = window[2] if window else 0
+                self._windows[key] = [now, 1, 0]
+                if suppressed:
+                    record.msg = f"{record.msg} [%d similar messages suppressed]"
+                    record.args = (*(record.args or ()), suppressed)
+                return True
+            if window[1] < self.burst:
+                window[1] += 1
+                return True
+            window[2] += 1
+            return False
+
+
 LOGGING_CONFIG = {
     "version": 1, "disable_existing_loggers": False,
     "formatters": {
         "default": {"()": "uvicorn.logging.DefaultFormatter",
                     "fmt": "%(levelprefix)s %(asctime)s - %(name)s - %(message)s", "use_colors": True},
         "json": {"()": "pythonjsonlogger.jsonlogger.JsonFormatter",
-                 "format": "%(asctime)s %(name)s %(levelname)s %(module)s %(funcName)s %(lineno)d %(message)s"}
+                 "format": "%(asctime)s %(name)s %(levelname)s %(module)s %(funcName)s %(lineno)d "
+                           "%(session_id)s %(utterance_id)s %(message)s"}
+    },
+    "filters": {
+        "context": {"()": LogContextFilter}
     },
     "handlers": {
         "default": {"formatter": "default", "class": "logging.StreamHandler", "stream": "ext://sys.stderr"},
         "file_json": {"formatter": "json", "class": "logging.handlers.RotatingFileHandler",
-                      "filename": "logs/volkovoice_app.log", "maxBytes": 10485760, "backupCount": 3}
+                      "filename": "logs/volkovoice_app.log", "maxBytes": 10485760, "backupCount": 3},
+        "queue": {"()": lambda: logging.handlers.QueueHandler(LOG_QUEUE), "filters": ["context"]}
     },
     "loggers": {
-        "volkovoice": {"handlers": ["default", "file_json"], "level": "INFO", "propagate": False},
-        "uvicorn.error": {"handlers": ["default", "file_json"], "level": "INFO", "propagate": False},
-        "uvicorn.access": {"handlers": ["default", "file_json"], "level": "INFO", "propagate": False},
+        "volkovoice": {"handlers": ["queue"], "level": "INFO", "propagate": False},
+        "uvicorn.error": {"handlers": ["queue"], "level": "INFO", "propagate": False},
+        "uvicorn.access": {"handlers": ["queue"], "level": "INFO", "propagate": False},
+        # Never logged to; only owns the output handlers driven by log_listener
+        "volkovoice.sink": {"handlers": ["default", "file_json"], "level": "DEBUG", "propagate": False},
     },
 }
 if not os.path.exists("logs"): os.makedirs("logs")
 logging.config.dictConfig(LOGGING_CONFIG)
+log_listener = logging.handlers.QueueListener(LOG_QUEUE, *logging.getLogger("volkovoice.sink").handlers,
+                                              respect_handler_level=True)
+log_listener.start()
+atexit.register(log_listener.stop)
 logger = logging.getLogger("volkovoice")
+# Per-utterance and per-message logs; sampled once settings are loaded (see LOG_SAMPLE_*)
+pipeline_logger = logging.getLogger("volkovoice.pipeline")
 
 
 # ==============================================================================
@@ -107,7 +201,123 @@ class AppSettings(BaseSettings):
     HUGGINGFACE_ACCESS_TOKEN: Optional[str] = None
     VOICE_CLONE_SAMPLES_DIR: str = "voice_clone_samples"
     VOICE_CLONE_MODELS_DIR: str = "voice_clone_models"
+    # Voice sample ingest: uploads are streamed to disk, then stored as trimmed, loudness-normalized
+    # mono WAV at the XTTS reference rate
+    VOICE_SAMPLE_MAX_BYTES: int = 50 * 1024 * 1024
+    VOICE_SAMPLE_CHUNK_BYTES: int = 1024 * 1024
+    VOICE_SAMPLE_MIN_SECONDS: float = 3.0
+    VOICE_SAMPLE_MAX_SECONDS: float = 60.0
+    VOICE_SAMPLE_TARGET_DBFS: float = -20.0
     OPENAI_API_KEY: Optional[str] = None  # NEW: For summarization
+    OPENAI_BASE_URL: Optional[str] = None  # Any OpenAI-compatible server, e.g. a local stand-in
+    SUMMARY_MODEL: str = "gpt-4-turbo-preview"
+    SUMMARY_CHUNK_TOKENS: int = 3000
+    SUMMARY_MAX_CONCURRENCY: int = 4
+    SUMMARY_CACHE_SIZE: int = 256
+    SUMMARY_REQUEST_TIMEOUT_SECONDS: float = 60.0
+    SUMMARY_MODE: str = "auto"  # "llm", "extractive" or "auto" (LLM with extractive fallback)
+    SUMMARY_LLM_DEADLINE_SECONDS: float = 20.0  # In auto mode, fall back to extractive after this long
+    SUMMARY_EXTRACTIVE_SENTENCES: int = 5
+    TOPIC_TOP_N: int = 5
+    TOPIC_HALF_LIFE_SECONDS: float = 120.0
+    TOPIC_MAX_CANDIDATES: int = 200
+    HISTORY_INDEX_DIR: str = "history_index"
+    HISTORY_INDEX_BATCH_SIZE: int = 256
+    HISTORY_INDEX_INTERVAL_SECONDS: float = 30.0
+    USAGE_FLUSH_INTERVAL_SECONDS: float = 10.0
+    TM_FUZZY_THRESHOLD: float = 0.7  # Minimum trigram Dice similarity for a fuzzy suggestion
+    TM_MAX_SUGGESTIONS: int = 3
+    TM_REFRESH_INTERVAL_SECONDS: float = 60.0
+    TM_MAX_IMPORT_BYTES: int = 50 * 1024 * 1024
+    TRANSLATE_BATCH_MAX_ITEMS: int = 500
+    DOCUMENT_MAX_CHARS: int = 1_000_000
+    DOCUMENT_MAX_PARALLEL_BATCHES: int = 4
+    AUDIO_JOBS_DIR: str = "audio_jobs"
+    # Set when AUDIO_JOBS_DIR is storage every host mounts at the same path; otherwise a job only
+    # runs on the host that received its upload (the one holding its files)
+    AUDIO_JOBS_DIR_SHARED: bool = False
+    AUDIO_JOB_MAX_UPLOAD_BYTES: int = 500 * 1024 * 1024
+    AUDIO_JOB_CHUNK_SECONDS: float = 120.0  # Unit of parallelism and of resumption
+    AUDIO_JOB_PARALLEL_CHUNKS: int = 4
+    AUDIO_JOB_DECODE_PROCESSES: Optional[int] = None  # Defaults to the CPU count
+    AUDIO_JOB_SCHEDULER_WEIGHT: float = 0.25  # Fair-share weight relative to a live session (1.0)
+    AUDIO_JOB_POLL_SECONDS: float = 10.0
+    AUDIO_JOB_STALE_SECONDS: int = 600
+    AUDIO_JOB_HEARTBEAT_SECONDS: float = 30.0  # Must stay well below AUDIO_JOB_STALE_SECONDS
+    QUOTA_STORE_URL: Optional[str] = None  # Redis-protocol server; falls back to CHAT_BROKER_URL, then in-process
+    QUOTA_COST_WEIGHTS: Dict[str, float] = {"audio_seconds": 1.0, "characters_translated": 0.01,
+                                            "tts_seconds": 1.0, "clones_trained": 120.0}
+    # Token bucket per tier in cost units; a tier with no limits is unlimited
+    QUOTA_TIERS: Dict[str, Dict[str, float]] = {"standard": {"capacity": 3600, "refill_per_second": 1.0},
+                                                "premium": {"capacity": 36000, "refill_per_second": 10.0},
+                                                "unlimited": {}}
+    QUOTA_DEFAULT_TIER: str = "standard"
+    QUOTA_SUPERUSER_TIER: str = "unlimited"
+    QUOTA_TIER_CACHE_SECONDS: float = 60.0
+    # Inference & live voice cloning
+    INFERENCE_WORKERS: int = 2
+    LIVE_CLONE_LATENTS_DIR: str = "live_clone_latents"
+    LIVE_CLONE_TTL_SECONDS: int = 7 * 24 * 3600
+    LIVE_CLONE_MIN_SECONDS: float = 5.0
+    LIVE_CLONE_REFINE_STEP_SECONDS: float = 10.0
+    LIVE_CLONE_MAX_REFERENCE_SECONDS: float = 30.0
+    LIVE_CLONE_MAX_ATTEMPTS: int = 3  # Consecutive failed clone attempts before a session stops trying
+    # 'in_process' loads every model in each worker (development); 'remote' uses the shared model server
+    INFERENCE_MODE: str = Field("in_process", pattern="^(in_process|remote)$")
+    MODEL_SERVER_SOCKET: str = "/tmp/volkovoice_model_server.sock"
+    INFERENCE_MAX_BATCH_SIZE: int = 16
+    INFERENCE_BATCH_WINDOW_MS: float = 10.0
+    # Opus-MT directions to load as translator_<src>_<tgt>; missing pairs pivot through English
+    TRANSLATION_DIRECTIONS: List[str] = ["ru-en", "en-ru"]
+    # Live translation admission control; capacity defaults to 4 sessions per inference worker
+    MAX_CONCURRENT_VOICE_SESSIONS: Optional[int] = None
+    MAX_VOICE_SESSIONS_PER_USER: int = 3
+    VOICE_QUEUE_MAX_LENGTH: int = 20
+    VOICE_QUEUE_TIMEOUT_SECONDS: float = 120.0
+    # Chat pub/sub: unset uses an in-process broker (single worker); e.g. redis://localhost:6379/0 spans workers
+    CHAT_BROKER_URL: Optional[str] = None
+    CHAT_PRESENCE_TTL_SECONDS: int = 60
+    NODE_ID: str = Field(default_factory=lambda: f"{socket.gethostname()}-{os.getpid()}")
+    NODE_HOST: str = Field(default_factory=socket.gethostname)  # Workers on one host share its local files
+    CHAT_OUTBOUND_QUEUE_SIZE: int = 256
+    # What to do when a participant's outbound queue is full: 'drop' new messages, 'coalesce'
+    # (shed the oldest queued ones) or 'disconnect' the slow participant
+    CHAT_SLOW_CONSUMER_POLICY: str = Field("coalesce", pattern="^(drop|coalesce|disconnect)$")
+    CHAT_REPLAY_MESSAGES: int = 50  # Messages replayed to a participant on connect
+    CHAT_LOG_FLUSH_INTERVAL_SECONDS: float = 0.25
+    CHAT_LOG_MAX_BATCH: int = 200
+    # Chat room lifecycle & resource caps
+    CHAT_ROOM_TTL_SECONDS: int = 24 * 3600
+    CHAT_ROOM_IDLE_TIMEOUT_SECONDS: int = 3600
+    CHAT_MAX_PARTICIPANTS_PER_ROOM: int = 50
+    CHAT_MAX_ROOMS_PER_USER: int = 20
+    CHAT_PING_INTERVAL_SECONDS: float = 20.0
+    CHAT_PING_TIMEOUT_SECONDS: float = 60.0
+    CHAT_GC_INTERVAL_SECONDS: float = 60.0
+    LOG_SAMPLE_BURST: int = 5  # Hot-path log records let through per call site and interval
+    LOG_SAMPLE_INTERVAL_SECONDS: float = 10.0
+    # Binary /ws/translate clients get at most one status update per window
+    WS_STATUS_COALESCE_SECONDS: float = 0.15
+    # Resumable voice sessions: how long a dropped session is kept, and what it may retain meanwhile
+    VOICE_RESUME_GRACE_SECONDS: float = 30.0
+    VOICE_MAX_DETACHED_SESSIONS: int = 200
+    VOICE_REPLAY_MAX_FRAMES: int = 512
+    VOICE_REPLAY_MAX_BYTES: int = 4 * 1024 * 1024
+    # Load-adaptive live quality (full -> reduced -> fast -> text); floors are per quota tier
+    QUALITY_LATENCY_SLO_SECONDS: float = 3.0
+    QUALITY_LATENCY_WINDOW_SECONDS: float = 30.0
+    QUALITY_EVAL_INTERVAL_SECONDS: float = 2.0
+    QUALITY_DEGRADE_PRESSURE: float = 1.0
+    QUALITY_RECOVER_PRESSURE: float = 0.6
+    QUALITY_MIN_DWELL_SECONDS: float = 15.0
+    QUALITY_TIER_FLOORS: Dict[str, str] = {"premium": "reduced", "unlimited": "full"}
+    STT_FAST_MODEL: Optional[str] = "openai/whisper-tiny"  # Used by the 'fast' and 'text' tiers; empty disables
+    # Admin profiling captures and opt-in per-utterance traces (WS config {"trace": true})
+    PROFILE_DIR: str = "profiles"
+    PROFILE_MAX_CAPTURES: int = 10
+    PROFILE_SAMPLE_INTERVAL_MS: float = 10.0
+    TRACE_MAX_SESSIONS: int = 200
+    TRACE_PER_SESSION: int = 100
 
     model_config = SettingsConfigDict(env_file=".env", env_file_encoding='utf-8', extra='ignore')
 
@@ -128,6 +338,7 @@ try:
 except Exception as e:
     print(f"FATAL: Could not load application settings. Error: {e}")
     exit(1)
+pipeline_logger.addFilter(SamplingFilter(settings.LOG_SAMPLE_BURST, settings.LOG_SAMPLE_INTERVAL_SECONDS))
 
 limiter = Limiter(key_func=get_remote_address, default_limits=["1000/hour", "50/minute"])
 
@@ -154,7 +365,8 @@ translation_history = Table("translation_history", metadata,
                             Column("source_language", String(10)), Column("target_language", String(10)),
                             Column("source_text", String), Column("translated_text", String),
                             Column("session_id", String(255), index=True),
-                            Column("timestamp", DateTime, default=datetime.datetime.utcnow)
+                            Column("timestamp", DateTime, default=datetime.datetime.utcnow),
+                            Index("ix_translation_history_user_id_timestamp", "user_id", "timestamp", "id")
                             )
 voice_clones = Table("voice_clones", metadata,
                      Column("id", Integer, primary_key=True),
@@ -166,8 +378,88 @@ voice_clones = Table("voice_clones", metadata,
                      Column("source_audio_path", String(512), nullable=False),
                      Column("created_at", DateTime, default=datetime.datetime.utcnow)
                      )
+# Latents computed per distinct (normalized) voice sample, so re-uploads skip training
+voice_latents = Table("voice_latents", metadata,
+                      Column("id", Integer, primary_key=True),
+                      Column("user_id", Integer, ForeignKey("users.id"), nullable=False),
+                      Column("content_hash", String(64), nullable=False),  # sha256 of the normalized PCM
+                      Column("model_path", String(512), nullable=False),
+                      Column("source_audio_path", String(512), nullable=False),
+                      Column("reference_seconds", Float, nullable=False),
+                      Column("created_at", DateTime, default=datetime.datetime.utcnow),
+                      UniqueConstraint("user_id", "content_hash")
+                      )
+chat_sessions = Table("chat_sessions", metadata,
+                      Column("id", String(36), primary_key=True),
+                      Column("created_by", Integer, ForeignKey("users.id"), nullable=False, index=True),
+                      Column("created_at", DateTime, default=datetime.datetime.utcnow),
+                      Column("expires_at", DateTime, nullable=False, index=True),
+                      Column("last_activity_at", DateTime, nullable=False, index=True)
+                      )
+chat_messages = Table("chat_messages", metadata,
+                      Column("id", Integer, primary_key=True),  # Keyset pagination cursor
+                      Column("message_id", String(36), unique=True, nullable=False),
+                      Column("session_id", String(36), nullable=False),
+                      Column("sender_uid", String(255), nullable=False),
+                      Column("original_text", String, nullable=False),
+                      Column("original_lang", String(10), nullable=False),
+                      Column("translations", JSON, nullable=False),  # {lang: text}, includes the original
+                      Column("timestamp", DateTime, nullable=False),
+                      Index("ix_chat_messages_session_id_id", "session_id", "id")
+                      )
+user_quota_tiers = Table("user_quota_tiers", metadata,
+                         Column("user_id", Integer, ForeignKey("users.id"), primary_key=True),
+                         Column("tier", String(50), nullable=False)
+                         )
+audio_jobs = Table("audio_jobs", metadata,
+                   Column("id", String(36), primary_key=True),
+                   Column("user_id", Integer, ForeignKey("users.id"), nullable=False, index=True),
+                   Column("status", String(20), nullable=False, index=True),  # queued, running, completed, failed
+                   Column("worker", String(255), nullable=True),  # NODE_ID of the worker running it
+                   Column("host", String(255), nullable=True),  # NODE_HOST that received the upload
+                   Column("source_path", String(512), nullable=False),
+                   Column("source_lang", String(10), nullable=False),
+                   Column("target_lang", String(10), nullable=False),
+                   Column("dub", Boolean, default=False, nullable=False),
+                   Column("voice_clone_id", Integer, ForeignKey("voice_clones.id"), nullable=True),
+                   Column("emotion", String(20), default="neutral", nullable=False),
+                   Column("duration_seconds", Float, nullable=True),
+                   Column("total_chunks", Integer, nullable=True),
+                   Column("completed_chunks", Integer, default=0, nullable=False),
+                   Column("error", String(500), nullable=True),
+                   Column("created_at", DateTime, default=datetime.datetime.utcnow),
+                   Column("updated_at", DateTime, default=datetime.datetime.utcnow)
+                   )
+tm_segments = Table("tm_segments", metadata,
+                    Column("id", Integer, primary_key=True),
+                    Column("source_lang", String(10), nullable=False),
+                    Column("target_lang", String(10), nullable=False),
+                    Column("source_text", String, nullable=False),
+                    Column("target_text", String, nullable=False),
+                    Column("created_by", Integer, ForeignKey("users.id"), nullable=True),
+                    Column("created_at", DateTime, default=datetime.datetime.utcnow),
+                    Index("ix_tm_segments_direction_id", "source_lang", "target_lang", "id")
+                    )
+# Usage rollups, maintained incrementally by UsageRecorder. user_id 0 is the all-users rollup.
+USAGE_METRICS = ("characters_translated", "audio_seconds", "tts_seconds", "chat_messages", "clones_trained")
+usage_daily = Table("usage_daily", metadata,
+                    Column("user_id", Integer, primary_key=True),
+                    Column("day", Date, primary_key=True, index=True),
+                    *(Column(metric, Float, nullable=False, default=0) for metric in USAGE_METRICS)
+                    )
+usage_totals = Table("usage_totals", metadata,
+                     Column("user_id", Integer, primary_key=True),
+                     *(Column(metric, Float, nullable=False, default=0, index=True) for metric in USAGE_METRICS)
+                     )
 engine = create_engine(settings.DATABASE_URL.replace("+aiosqlite", "").replace("+asyncpg", ""))
 metadata.create_all(engine)
+# create_all skips the indexes of tables that already exist, so add new ones explicitly
+for index in translation_history.indexes:
+    index.create(engine, checkfirst=True)
+# ...and skips new columns of existing tables
+if "host" not in {column["name"] for column in sqlalchemy.inspect(engine).get_columns("audio_jobs")}:
+    with engine.begin() as connection:
+        connection.execute(sqlalchemy.text("ALTER TABLE audio_jobs ADD COLUMN host VARCHAR(255)"))
 
 # ==============================================================================
 # V. FIREBASE AUTHENTICATION SETUP
@@ -251,6 +543,10 @@ class ChatMessageBroadcast(BaseModel):
     translated_lang: str
     timestamp: datetime.datetime = Field(default_factory=datetime.datetime.utcnow)
 
+class ChatHistoryResponse(BaseModel):
+    messages: List[ChatMessageBroadcast]  # Oldest first
+    next_cursor: Optional[int] = None  # Pass as before_id to fetch older messages
+
 # NEW: Models for Voice Clone Management
 class VoiceCloneUpdateRequest(BaseModel):
     clone_name: str = Field(..., min_length=1, max_length=100)
@@ -258,6 +554,7 @@ class VoiceCloneUpdateRequest(BaseModel):
 class VoiceClonePreviewRequest(BaseModel):
     text: str = Field("Hello, this is a test of my cloned voice.", min_length=5, max_length=250)
     language: str = "en"
+    emotion: str = "neutral"
 
 class ConversationTurn(BaseModel):
     id: Union[str, int]
@@ -269,11 +566,83 @@ class SummarizationRequest(BaseModel):
     conversation: List[ConversationTurn]
     source_lang: str
     target_lang: str
+    mode: Optional[str] = Field(None, pattern="^(llm|extractive|auto)$")  # Defaults to SUMMARY_MODE
 
 class SummarizationResponse(BaseModel):
     summary: str
     action_items: List[str]
     full_transcript: str
+    mode: str = "llm"  # Which summarizer produced the result
+
+class HistoryEntry(BaseModel):
+    id: int
+    source_language: Optional[str] = None
+    target_language: Optional[str] = None
+    source_text: Optional[str] = None
+    translated_text: Optional[str] = None
+    session_id: Optional[str] = None
+    timestamp: Optional[datetime.datetime] = None
+    score: Optional[float] = None  # Cosine similarity, for semantic matches
+
+class HistoryPage(BaseModel):
+    entries: List[HistoryEntry]
+    next_cursor: Optional[str] = None  # Pass as ?cursor= to get the next (older) page
+
+class UserPage(BaseModel):
+    users: List[UserInDB]
+    next_cursor: Optional[int] = None  # Pass as ?after_id= to get the next page
+
+class QuotaTierUpdate(BaseModel):
+    tier: str
+
+class QuotaStatus(BaseModel):
+    tier: str
+    remaining: Optional[float] = None  # Cost units left; None when unlimited
+    capacity: Optional[float] = None
+    retry_after_seconds: float = 0
+
+class AudioJobResponse(BaseModel):
+    id: str
+    status: str
+    source_lang: str
+    target_lang: str
+    dub: bool
+    duration_seconds: Optional[float] = None
+    total_chunks: Optional[int] = None
+    completed_chunks: int = 0
+    error: Optional[str] = None
+    created_at: datetime.datetime
+
+class TMSuggestion(BaseModel):
+    source_text: str
+    target_text: str
+    score: float  # Trigram Dice similarity to the looked-up text
+
+class TMLookupResponse(BaseModel):
+    exact: Optional[str] = None
+    suggestions: List[TMSuggestion] = []
+
+class ProfileCaptureRequest(BaseModel):
+    mode: str = Field("sampling", pattern="^(sampling|cprofile)$")
+    seconds: float = Field(30.0, gt=0, le=300)
+
+class ProfileCaptureResponse(BaseModel):
+    id: str
+    mode: str
+    seconds: float
+    status: str  # running, completed, failed
+    started_at: datetime.datetime
+    finished_at: Optional[datetime.datetime] = None
+    error: Optional[str] = None
+
+class UsageRollup(BaseModel):
+    user_id: int  # 0 for all users
+    day: Optional[datetime.date] = None  # Set on daily rollups
+    characters_translated: float = 0
+    audio_seconds: float = 0
+    tts_seconds: float = 0
+    chat_messages: float = 0
+    clones_trained: float = 0
 
 class HealthCheckResponse(BaseModel):
     status: str = "ok";
@@ -330,6 +699,9 @@ class AIModelManager:
     def __init__(self):
         self.models = {};
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        # Blocking model calls run here so they never stall the event loop.
+        self.executor = ThreadPoolExecutor(max_workers=settings.INFERENCE_WORKERS,
+                                           thread_name_prefix="volkovoice-inference")
         logger.info(f"AI models will be loaded on device: '{self.device}'")
 
     def load_all_models(self):
@@ -367,16 +739,24 @@ class AIModelManager:
         try:
             self.models['stt'] = hf_pipeline("automatic-speech-recognition", model="openai/whisper-base",
                                              device=self.device)
-            self.models['translator_ru_en'] = hf_pipeline("translation", model="Helsinki-NLP/opus-mt-ru-en",
-                                                          device=self.device)
-            self.models['translator_en_ru'] = hf_pipeline("translation", model="Helsinki-NLP/opus-mt-en-ru",
-                                                          device=self.device)
+            for direction in settings.TRANSLATION_DIRECTIONS:
+                source_lang, target_lang = direction.split("-")
+                self.models[f'translator_{source_lang}_{target_lang}'] = hf_pipeline(
+                    "translation", model=f"Helsinki-NLP/opus-mt-{source_lang}-{target_lang}", device=self.device)
             sentence_model = SentenceTransformer('all-MiniLM-L6-v2')
+            self.models['sentence_encoder'] = sentence_model
             self.models['keyword_extractor'] = KeyBERT(model=sentence_model)
             logger.info("KeyBERT model for Topic Recognition loaded successfully.")
         except Exception as e:
             logger.error(f"Could not load one or more Hugging Face pipeline models: {e}", exc_info=True)
 
+        if settings.STT_FAST_MODEL:
+            try:
+                self.models['stt_fast'] = hf_pipeline("automatic-speech-recognition", model=settings.STT_FAST_MODEL,
+                                                      device=self.device)
+            except Exception as e:
+                logger.error(f"Could not load the fast STT model '{settings.STT_FAST_MODEL}': {e}")
+
         logger.info("AI model loading sequence complete.")
 
 
@@ -386,7 +766,13 @@ class AIModelManager:
             logger.error(f"Attempted to access model '{name}', but it was not loaded.")
         return model
 
+    async def run_in_executor(self, func, *args, **kwargs):
+        """Runs a blocking inference call on the inference executor and awaits its result."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
     def cleanup(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
         self.models.clear();
         gc.collect()
         if self.device == "cuda": torch.cuda.empty_cache()
@@ -404,32 +790,802 @@ def extract_keywords_from_text(text: str, extractor: KeyBERT) -> List[str]:
         logger.error(f"Keyword extraction failed: {e}", exc_info=True)
         return []
 
-async def run_true_voice_training_task(clone_id: int, source_audio_path: str, model_save_path: str):
+def compute_conditioning_latents_from_pcm(xtts_model: Xtts, pcm: bytes, sample_rate: int = 16000) -> Dict[str, Any]:
+    """
+    Computes XTTS speaker latents straight from in-memory 16-bit mono PCM.
+    Mirrors Xtts.get_conditioning_latents without the temp WAV round-trip.
+    """
+    load_sr = 22050  # Reference sample rate expected by get_conditioning_latents
+    audio_np = np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0
+    audio = torch.from_numpy(audio_np).unsqueeze(0)
+    audio = torchaudio.functional.resample(audio, sample_rate, load_sr)
+    audio = audio[:, : int(load_sr * settings.LIVE_CLONE_MAX_REFERENCE_SECONDS)].to(xtts_model.device)
+    gpt_cond_len = getattr(xtts_model.config, "gpt_cond_len", 6)
+    gpt_cond_chunk_len = getattr(xtts_model.config, "gpt_cond_chunk_len", 6)
+    with torch.inference_mode():
+        speaker_embedding = xtts_model.get_speaker_embedding(audio, load_sr)
+        gpt_cond_latent = xtts_model.get_gpt_cond_latents(audio, load_sr, length=gpt_cond_len,
+                                                          chunk_length=gpt_cond_chunk_len)
+    return {'gpt_cond_latent': gpt_cond_latent, 'speaker_embedding': speaker_embedding}
+
+
+class LiveCloneStore:
+    """
+    Per-user store of live-cloned speaker latents. Entries are kept in memory and
+    persisted to disk so a reconnecting session starts with the user's voice; both
+    expire after LIVE_CLONE_TTL_SECONDS.
+    """
+
+    def __init__(self, directory: str, ttl_seconds: int):
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self._cache: Dict[int, Dict[str, Any]] = {}
+        if not os.path.exists(directory): os.makedirs(directory)
+
+    def _path(self, user_id: int) -> str:
+        return os.path.join(self.directory, f"user_{user_id}_live_latents.pth")
+
+    def _is_expired(self, saved_at: float) -> bool:
+        return time.time() - saved_at > self.ttl_seconds
+
+    async def load(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """Returns {'latents', 'reference_seconds', 'saved_at'} for the user, or None if absent or expired."""
+        entry = self._cache.get(user_id)
+        if entry:
+            if not self._is_expired(entry['saved_at']):
+                return entry
+            self.forget(user_id)
+            return None
+
+        path = self._path(user_id)
+        if not os.path.exists(path):
+            return None
+        try:
+            entry = await asyncio.to_thread(torch.load, path, map_location="cpu")
+        except Exception as e:
+            logger.error(f"Could not load persisted live clone for user {user_id}: {e}")
+            return None
+        if self._is_expired(entry.get('saved_at', 0)):
+            self.forget(user_id)
+            return None
+        self._cache[user_id] = entry
+        return entry
+
+    async def save(self, user_id: int, latents: Dict[str, Any], reference_seconds: float):
+        entry = {'latents': latents, 'reference_seconds': reference_seconds, 'saved_at': time.time()}
+        self._cache[user_id] = entry
+        cpu_entry = {**entry, 'latents': {k: v.detach().cpu() for k, v in latents.items()}}
+        try:
+            await asyncio.to_thread(torch.save, cpu_entry, self._path(user_id))
+        except Exception as e:
+            logger.error(f"Could not persist live clone for user {user_id}: {e}")
+
+    def forget(self, user_id: int):
+        self._cache.pop(user_id, None)
+        path = self._path(user_id)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def purge_expired(self):
+        """Drops expired entries from memory and disk. Called at startup."""
+        for user_id in [uid for uid, e in self._cache.items() if self._is_expired(e['saved_at'])]:
+            self._cache.pop(user_id, None)
+        for filename in os.listdir(self.directory):
+            path = os.path.join(self.directory, filename)
+            if filename.endswith("_live_latents.pth") and self._is_expired(os.path.getmtime(path)):
+                os.remove(path)
+
+
+# ==============================================================================
+# ### INFERENCE BACKENDS & SHARED MODEL SERVER ###
+# ==============================================================================
+# Every model call made by the API and the WebSocket pipelines goes through an
+# InferenceBackend. In development the models live in-process; with several
+# uvicorn workers, INFERENCE_MODE='remote' points every worker at one model
+# server process (`python main.py model-server`) over a Unix socket, so XTTS,
+# Whisper, Marian and MiniLM are loaded exactly once per host.
+PCM_SAMPLE_RATE = 16000
+TTS_SAMPLE_RATE = 24000  # XTTS output; synthesized chunks are 16-bit mono PCM at this rate
+
+
+def pcm16_to_float32(pcm: Union[bytes, bytearray]) -> np.ndarray:
+    """Converts 16-bit little-endian mono PCM into float32 samples in [-1, 1]."""
+    return np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0
+
+
+def serialize_latents(latents: Dict[str, Any]) -> bytes:
+    buffer = io.BytesIO()
+    torch.save({k: v.detach().cpu() for k, v in latents.items()}, buffer)
+    return buffer.getvalue()
+
+
+def deserialize_latents(data: bytes) -> Dict[str, Any]:
+    return torch.load(io.BytesIO(data), map_location="cpu")
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent single-item requests sharing a key (e.g. a translation
+    direction) into one batched model call. A batch is dispatched once it holds
+    max_batch_size items or its oldest item has waited window_ms.
+    """
+
+    def __init__(self, batch_fn, model_manager: "AIModelManager", max_batch_size: int, window_ms: float):
+        self.batch_fn = batch_fn  # Blocking: (key, items) -> results, run on the inference executor
+        self.model_manager = model_manager
+        self.max_batch_size = max_batch_size
+        self.window = window_ms / 1000
+        self._pending: Dict[Any, List[tuple]] = {}
+        self._timers: Dict[Any, asyncio.TimerHandle] = {}
+
+    async def submit(self, key: Any, item: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        batch = self._pending.setdefault(key, [])
+        batch.append((item, future))
+        if len(batch) >= self.max_batch_size:
+            self._dispatch(key)
+        elif key not in self._timers:
+            self._timers[key] = loop.call_later(self.window, self._dispatch, key)
+        return await future
+
+    def _dispatch(self, key: Any):
+        timer = self._timers.pop(key, None)
+        if timer: timer.cancel()
+        batch = self._pending.pop(key, None)
+        if batch:
+            asyncio.ensure_future(self._run(key, batch))
+
+    async def _run(self, key: Any, batch: List[tuple]):
+        items = [item for item, _ in batch]
+        try:
+            results = await self.model_manager.run_in_executor(self.batch_fn, key, items)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done(): future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done(): future.set_result(result)
+
+
+async def iterate_in_executor(executor: ThreadPoolExecutor, make_iterator) -> AsyncGenerator[Any, None]:
+    """
+    Drives a blocking iterator (e.g. XTTS tts_stream) on the executor and yields its
+    items on the event loop as they are produced. Stops the producer if the consumer
+    goes away early.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for item in make_iterator():
+                if stop.is_set(): return
+                loop.call_soon_threadsafe(queue.put_nowait, ("item", item))
+            loop.call_soon_threadsafe(queue.put_nowait, ("done", None))
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, ("error", e))
+
+    producer = loop.run_in_executor(executor, produce)
+    try:
+        while True:
+            kind, value = await queue.get()
+            if kind == "done": break
+            if kind == "error": raise value
+            yield value
+    finally:
+        stop.set()
+        if producer.done(): producer.result()
+
+
+class InferenceBackend:
+    """Interface shared by the in-process and the remote (model server) inference backends."""
+
+    def has_model(self, name: str) -> bool:
+        raise NotImplementedError
+
+    async def transcribe(self, audio: np.ndarray, language: str, fast: bool = False) -> str:
+        """`fast` uses the smaller STT model when one is loaded."""
+        raise NotImplementedError
+
+    async def translate(self, texts: List[str], source_lang: str, target_lang: str) -> List[str]:
+        raise NotImplementedError
+
+    async def extract_keywords(self, text: str) -> List[str]:
+        raise NotImplementedError
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        """L2-normalized float32 sentence embeddings, one row per text."""
+        raise NotImplementedError
+
+    async def conditioning_latents(self, pcm: Optional[bytes] = None, audio_path: Optional[str] = None) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    async def diarize(self, audio: np.ndarray) -> List[tuple]:
+        raise NotImplementedError
+
+    def synthesize_stream(self, text: str, language: str, params: Dict[str, float],
+                          latents: Optional[Dict[str, Any]] = None,
+                          latents_path: Optional[str] = None) -> AsyncGenerator[bytes, None]:
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class LocalInferenceBackend(InferenceBackend):
+    """Runs inference on models held by an AIModelManager in this process."""
+
+    DEFAULT_SPEAKER_WAV = "models/default_reference.wav"
+
+    def __init__(self, model_manager: AIModelManager):
+        self.model_manager = model_manager
+        self._translation_batcher = MicroBatcher(self._translate_batch, model_manager,
+                                                 settings.INFERENCE_MAX_BATCH_SIZE, settings.INFERENCE_BATCH_WINDOW_MS)
+        self._stt_batcher = MicroBatcher(self._transcribe_batch, model_manager,
+                                         settings.INFERENCE_MAX_BATCH_SIZE, settings.INFERENCE_BATCH_WINDOW_MS)
+        self._embed_batcher = MicroBatcher(self._embed_batch, model_manager,
+                                           settings.INFERENCE_MAX_BATCH_SIZE * 4, settings.INFERENCE_BATCH_WINDOW_MS)
+        self._latents_cache: Dict[tuple, Dict[str, Any]] = {}
+
+    def has_model(self, name: str) -> bool:
+        return name in self.model_manager.models
+
+    def _require(self, name: str):
+        model = self.model_manager.get_model(name)
+        if model is None:
+            raise RuntimeError(f"Model '{name}' is not available.")
+        return model
+
+    # --- Blocking batch functions (run on the inference executor) ---
+    def _translate_batch(self, direction: tuple, texts: List[str]) -> List[str]:
+        translator = self._require(f"translator_{direction[0]}_{direction[1]}")
+        results = translator(texts, batch_size=len(texts))
+        return [r['translation_text'] for r in results]
+
+    def _transcribe_batch(self, key: tuple, audios: List[np.ndarray]) -> List[str]:
+        language, model = key
+        stt = self._require(model)
+        inputs = [{"raw": audio, "sampling_rate": PCM_SAMPLE_RATE} for audio in audios]
+        results = stt(inputs, batch_size=len(inputs), generate_kwargs={"language": language})
+        return [r["text"].strip() for r in results]
+
+    def _embed_batch(self, _key: Any, texts: List[str]) -> List[np.ndarray]:
+        encoder = self._require('sentence_encoder')
+        embeddings = encoder.encode(texts, batch_size=64, convert_to_numpy=True, normalize_embeddings=True)
+        return list(embeddings.astype(np.float32, copy=False))
+
+    def _load_latents(self, path: str) -> Dict[str, Any]:
+        key = (path, os.path.getmtime(path))
+        latents = self._latents_cache.get(key)
+        if latents is None:
+            latents = torch.load(path, map_location=self.model_manager.device)
+            if len(self._latents_cache) >= 64: self._latents_cache.clear()
+            self._latents_cache[key] = latents
+        return latents
+
+    # --- Async API ---
+    async def transcribe(self, audio: np.ndarray, language: str, fast: bool = False) -> str:
+        model = 'stt_fast' if fast and self.has_model('stt_fast') else 'stt'
+        return await self._stt_batcher.submit((language, model), audio)
+
+    async def translate(self, texts: List[str], source_lang: str, target_lang: str) -> List[str]:
+        self._require(f"translator_{source_lang}_{target_lang}")
+        return list(await asyncio.gather(
+            *(self._translation_batcher.submit((source_lang, target_lang), text) for text in texts)))
+
+    async def extract_keywords(self, text: str) -> List[str]:
+        return await self.model_manager.run_in_executor(extract_keywords_from_text, text,
+                                                        self._require('keyword_extractor'))
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        self._require('sentence_encoder')
+        if len(texts) >= self._embed_batcher.max_batch_size:  # Already a full batch on its own
+            return np.stack(await self.model_manager.run_in_executor(self._embed_batch, None, texts))
+        # Small requests (e.g. topic tracking) from concurrent sessions share one encoder call
+        return np.stack(await asyncio.gather(*(self._embed_batcher.submit(None, text) for text in texts)))
+
+    async def conditioning_latents(self, pcm: Optional[bytes] = None, audio_path: Optional[str] = None) -> Dict[str, Any]:
+        xtts_model = self._require('xtts')
+        if pcm is not None:
+            return await self.model_manager.run_in_executor(compute_conditioning_latents_from_pcm, xtts_model, pcm)
+        gpt_cond_latent, speaker_embedding = await self.model_manager.run_in_executor(
+            xtts_model.get_conditioning_latents, audio_path=audio_path)
+        return {'gpt_cond_latent': gpt_cond_latent, 'speaker_embedding': speaker_embedding}
+
+    async def diarize(self, audio: np.ndarray) -> List[tuple]:
+        diarization_pipeline = self._require('diarization')
+
+        def run():
+            waveform = torch.from_numpy(audio).unsqueeze(0)
+            diarization = diarization_pipeline({"waveform": waveform, "sample_rate": PCM_SAMPLE_RATE})
+            return [(turn.start, turn.end, speaker) for turn, _, speaker in diarization.itertracks(yield_label=True)]
+
+        return await self.model_manager.run_in_executor(run)
+
+    async def synthesize_stream(self, text: str, language: str, params: Dict[str, float],
+                                latents: Optional[Dict[str, Any]] = None,
+                                latents_path: Optional[str] = None) -> AsyncGenerator[bytes, None]:
+        xtts_model = self._require('xtts')
+        tts_kwargs = {"text": text, "language": language, **params}
+        if latents_path:
+            latents = await self.model_manager.run_in_executor(self._load_latents, latents_path)
+        if latents:
+            tts_kwargs['gpt_cond_latent'] = latents['gpt_cond_latent'].to(xtts_model.device)
+            tts_kwargs['speaker_embedding'] = latents['speaker_embedding'].to(xtts_model.device)
+        elif os.path.exists(self.DEFAULT_SPEAKER_WAV):
+            # Fallback to a default speaker wav if no clone is used
+            tts_kwargs['speaker_wav'] = self.DEFAULT_SPEAKER_WAV
+
+        async for chunk in iterate_in_executor(self.model_manager.executor,
+                                               lambda: ((c.clamp(-1, 1) * 32767).to(torch.int16).cpu().numpy().tobytes()
+                                                        for c in xtts_model.tts_stream(**tts_kwargs))):
+            yield chunk
+
+    async def close(self):
+        self.model_manager.cleanup()
+
+
+# --- Model server wire format ---
+# Each frame is [u32 header length][u32 payload length][JSON header][raw payload].
+# Audio buffers and serialized latents travel as raw payload bytes, never as JSON.
+_FRAME_PREFIX = struct.Struct("!II")
+
+
+async def read_frame(reader: asyncio.StreamReader) -> tuple:
+    header_len, payload_len = _FRAME_PREFIX.unpack(await reader.readexactly(_FRAME_PREFIX.size))
+    header = json.loads(await reader.readexactly(header_len))
+    payload = await reader.readexactly(payload_len) if payload_len else b""
+    return header, payload
+
+
+def write_frame(writer: asyncio.StreamWriter, header: Dict[str, Any], payload: bytes = b""):
+    encoded = json.dumps(header).encode()
+    writer.write(_FRAME_PREFIX.pack(len(encoded), len(payload)) + encoded)
+    if payload: writer.write(payload)
+
+
+class RemoteInferenceBackend(InferenceBackend):
+    """
+    Client for the shared model server. Requests from all coroutines of this worker
+    are multiplexed over one Unix socket connection and matched by request id.
+    """
+
+    def __init__(self, socket_path: str):
+        self.socket_path = socket_path
+        self.models: set = set()
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._reader_task: Optional[asyncio.Task] = None
+        self._pending: Dict[int, asyncio.Queue] = {}
+        self._request_ids = itertools.count(1)
+        self._connect_lock = asyncio.Lock()
+        self._write_lock = asyncio.Lock()
+
+    async def connect(self):
+        async with self._connect_lock:
+            if self._writer and not self._writer.is_closing():
+                return
+            self._reader, self._writer = await asyncio.open_unix_connection(self.socket_path)
+            self._reader_task = asyncio.create_task(self._read_responses())
+            logger.info(f"Connected to model server at '{self.socket_path}'.")
+        header, _ = await self._call("capabilities")
+        self.models = set(header["result"])
+
+    async def _read_responses(self):
+        try:
+            while True:
+                header, payload = await read_frame(self._reader)
+                queue = self._pending.get(header["id"])
+                if queue: queue.put_nowait((header, payload))
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            logger.error(f"Lost connection to the model server: {e}")
+        finally:
+            for queue in self._pending.values():
+                queue.put_nowait(({"error": "Model server connection lost."}, b""))
+            self._writer.close()
+
+    async def _stream(self, op: str, args: Optional[Dict[str, Any]] = None,
+                      payload: bytes = b"") -> AsyncGenerator[tuple, None]:
+        await self.connect()
+        request_id = next(self._request_ids)
+        queue: asyncio.Queue = asyncio.Queue()
+        self._pending[request_id] = queue
+        try:
+            async with self._write_lock:
+                write_frame(self._writer, {"id": request_id, "op": op, "args": args or {}}, payload)
+                await self._writer.drain()
+            while True:
+                header, data = await queue.get()
+                if header.get("error"):
+                    raise RuntimeError(f"Model server error during '{op}': {header['error']}")
+                yield header, data
+                if not header.get("more"): break
+        finally:
+            self._pending.pop(request_id, None)
+
+    async def _call(self, op: str, args: Optional[Dict[str, Any]] = None, payload: bytes = b"") -> tuple:
+        response = None
+        async for response in self._stream(op, args, payload):
+            pass
+        return response
+
+    def has_model(self, name: str) -> bool:
+        return name in self.models
+
+    async def transcribe(self, audio: np.ndarray, language: str, fast: bool = False) -> str:
+        header, _ = await self._call("transcribe", {"language": language, "fast": fast},
+                                     audio.astype(np.float32).tobytes())
+        return header["result"]
+
+    async def translate(self, texts: List[str], source_lang: str, target_lang: str) -> List[str]:
+        header, _ = await self._call("translate", {"texts": texts, "source_lang": source_lang,
+                                                   "target_lang": target_lang})
+        return header["result"]
+
+    async def extract_keywords(self, text: str) -> List[str]:
+        header, _ = await self._call("keywords", {"text": text})
+        return header["result"]
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        header, data = await self._call("embed", {"texts": texts})
+        return np.frombuffer(data, dtype=np.float32).reshape(header["result"])
+
+    async def conditioning_latents(self, pcm: Optional[bytes] = None, audio_path: Optional[str] = None) -> Dict[str, Any]:
+        _, data = await self._call("latents", {"audio_path": audio_path}, pcm or b"")
+        return deserialize_latents(data)
+
+    async def diarize(self, audio: np.ndarray) -> List[tuple]:
+        header, _ = await self._call("diarize", {}, audio.astype(np.float32).tobytes())
+        return [tuple(track) for track in header["result"]]
+
+    async def synthesize_stream(self, text: str, language: str, params: Dict[str, float],
+                                latents: Optional[Dict[str, Any]] = None,
+                                latents_path: Optional[str] = None) -> AsyncGenerator[bytes, None]:
+        args = {"text": text, "language": language, "params": params, "latents_path": latents_path}
+        async for header, data in self._stream("synthesize", args, serialize_latents(latents) if latents else b""):
+            if data: yield data
+
+    async def close(self):
+        if self._writer:
+            self._writer.close()
+        if self._reader_task:
+            self._reader_task.cancel()
+
+
+class ModelServer:
+    """
+    Owns the AI models and serves inference requests from any number of web workers.
+    Requests from all workers share the LocalInferenceBackend micro-batchers, so
+    concurrent translations and transcriptions are batched across workers.
+    """
+
+    def __init__(self, socket_path: str):
+        self.socket_path = socket_path
+        self.model_manager = AIModelManager()
+        self.backend = LocalInferenceBackend(self.model_manager)
+
+    async def serve_forever(self):
+        self.model_manager.load_all_models()
+        if os.path.exists(self.socket_path): os.remove(self.socket_path)
+        server = await asyncio.start_unix_server(self._handle_client, path=self.socket_path)
+        os.chmod(self.socket_path, 0o660)
+        logger.info(f"Model server listening on '{self.socket_path}' with models: {sorted(self.model_manager.models)}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await self.backend.close()
+            if os.path.exists(self.socket_path): os.remove(self.socket_path)
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        write_lock = asyncio.Lock()
+        tasks = set()
+        try:
+            while True:
+                header, payload = await read_frame(reader)
+                task = asyncio.create_task(self._dispatch(header, payload, writer, write_lock))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            logger.info("Model server client disconnected.")
+        finally:
+            for task in tasks: task.cancel()
+            writer.close()
+
+    async def _dispatch(self, header: Dict[str, Any], payload: bytes,
+                        writer: asyncio.StreamWriter, write_lock: asyncio.Lock):
+        request_id, op, args = header["id"], header["op"], header.get("args", {})
+
+        async def reply(result: Any = None, data: bytes = b"", more: bool = False, error: Optional[str] = None):
+            async with write_lock:
+                write_frame(writer, {"id": request_id, "result": result, "more": more, "error": error}, data)
+                await writer.drain()
+
+        try:
+            if op == "capabilities":
+                await reply(sorted(self.model_manager.models))
+            elif op == "transcribe":
+                audio = np.frombuffer(payload, dtype=np.float32).copy()
+                await reply(await self.backend.transcribe(audio, args["language"], fast=args.get("fast", False)))
+            elif op == "translate":
+                await reply(await self.backend.translate(args["texts"], args["source_lang"], args["target_lang"]))
+            elif op == "keywords":
+                await reply(await self.backend.extract_keywords(args["text"]))
+            elif op == "embed":
+                embeddings = await self.backend.embed(args["texts"])
+                await reply(list(embeddings.shape), data=embeddings.tobytes())
+            elif op == "latents":
+                latents = await self.backend.conditioning_latents(pcm=payload or None, audio_path=args.get("audio_path"))
+                await reply(data=serialize_latents(latents))
+            elif op == "diarize":
+                audio = np.frombuffer(payload, dtype=np.float32).copy()
+                await reply([list(track) for track in await self.backend.diarize(audio)])
+            elif op == "synthesize":
+                latents = deserialize_latents(payload) if payload else None
+                async for chunk in self.backend.synthesize_stream(args["text"], args["language"], args["params"],
+                                                                  latents=latents,
+                                                                  latents_path=args.get("latents_path")):
+                    await reply(data=chunk, more=True)
+                await reply()
+            else:
+                raise ValueError(f"Unknown operation '{op}'")
+        except ConnectionError:
+            raise
+        except Exception as e:
+            logger.error(f"Model server request '{op}' failed: {e}", exc_info=True)
+            await reply(error=str(e))
+
+
+PIVOT_LANGUAGE = "en"
+
+
+def translation_route(inference: InferenceBackend, source_lang: str, target_lang: str) -> Optional[List[str]]:
+    """Languages a text passes through from source to target, pivoting through English when needed."""
+    if source_lang == target_lang:
+        return [source_lang]
+    if inference.has_model(f"translator_{source_lang}_{target_lang}"):
+        return [source_lang, target_lang]
+    if (PIVOT_LANGUAGE not in (source_lang, target_lang)
+            and inference.has_model(f"translator_{source_lang}_{PIVOT_LANGUAGE}")
+            and inference.has_model(f"translator_{PIVOT_LANGUAGE}_{target_lang}")):
+        return [source_lang, PIVOT_LANGUAGE, target_lang]
+    return None
+
+
+# ### TRANSLATION MEMORY ###
+class TranslationMemoryDirection:
+    """Exact and trigram-indexed segments for one source -> target language pair."""
+
+    def __init__(self):
+        self.exact: Dict[str, int] = {}  # normalized source -> segment index
+        self.sources: List[str] = []
+        self.targets: List[str] = []
+        self.sizes = array.array("I")  # Trigram count per segment
+        self.postings: Dict[str, array.array] = collections.defaultdict(lambda: array.array("I"))
+
+    def add(self, normalized: str, source_text: str, target_text: str):
+        index = self.exact.get(normalized)
+        if index is not None:  # Re-imported segment: the newest translation wins
+            self.targets[index] = target_text
+            return
+        index = len(self.sources)
+        self.exact[normalized] = index
+        self.sources.append(source_text)
+        self.targets.append(target_text)
+        grams = TranslationMemory.trigrams(normalized)
+        self.sizes.append(len(grams))
+        for gram in grams:
+            self.postings[gram].append(index)
+
+
+class TranslationMemory:
+    """
+    Curated human translations consulted before machine translation. Exact matches
+    (after case and whitespace normalization) replace the translator call; fuzzy
+    matches are ranked by trigram Dice similarity via an inverted index and returned
+    as suggestions. Segments live in tm_segments; every worker keeps an in-memory
+    index and picks up rows added elsewhere every TM_REFRESH_INTERVAL_SECONDS.
+    """
+
+    MAX_POSTINGS_SCANNED = 50000  # Trigrams this common barely discriminate; skip them when counting
+    MAX_RESCORED = 200
+
+    def __init__(self, fuzzy_threshold: float, max_suggestions: int):
+        self.fuzzy_threshold = fuzzy_threshold
+        self.max_suggestions = max_suggestions
+        self.directions: Dict[tuple, TranslationMemoryDirection] = collections.defaultdict(TranslationMemoryDirection)
+        self._last_id = 0
+        self._refresh_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return " ".join(text.casefold().split())
+
+    @staticmethod
+    def trigrams(normalized: str) -> set:
+        padded = f"  {normalized} "
+        return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+    async def start(self):
+        await self.refresh()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task: self._task.cancel()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(settings.TM_REFRESH_INTERVAL_SECONDS)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Translation memory refresh failed: {e}", exc_info=True)
+
+    async def refresh(self):
+        """Indexes segments added since the last refresh (by this or any other worker)."""
+        async with self._refresh_lock:
+            query = tm_segments.select().where(tm_segments.c.id > self._last_id).order_by(tm_segments.c.id)
+            added = 0
+            async for row in database.iterate(query):
+                self.directions[(row['source_lang'], row['target_lang'])].add(
+                    self.normalize(row['source_text']), row['source_text'], row['target_text'])
+                self._last_id = row['id']
+                added += 1
+            if added:
+                logger.info(f"Translation memory indexed {added} new segments.")
+
+    def exact(self, text: str, source_lang: str, target_lang: str) -> Optional[str]:
+        direction = self.directions.get((source_lang, target_lang))
+        if direction is None:
+            return None
+        index = direction.exact.get(self.normalize(text))
+        return direction.targets[index] if index is not None else None
+
+    def fuzzy(self, text: str, source_lang: str, target_lang: str) -> List["TMSuggestion"]:
+        """CPU-bound on large memories; call it through asyncio.to_thread. Segments are only ever appended."""
+        direction = self.directions.get((source_lang, target_lang))
+        if direction is None:
+            return []
+        query = self.trigrams(self.normalize(text))
+        size = len(query)
+        threshold = self.fuzzy_threshold
+        # Dice >= t is impossible unless the candidate's trigram count is within these bounds
+        min_size, max_size = size * threshold / (2 - threshold), size * (2 - threshold) / threshold
+
+        counts: collections.Counter = collections.Counter()
+        for gram in query:
+            postings = direction.postings.get(gram)
+            if postings and len(postings) <= self.MAX_POSTINGS_SCANNED:
+                counts.update(postings)
+
+        # Length-bound first and rank by estimated Dice rather than raw shared count, so long segments
+        # sharing many trigrams can't crowd short near-exact matches out of the rescored set
+        sizes = direction.sizes
+        candidates = heapq.nlargest(self.MAX_RESCORED,
+                                    (index for index in counts if min_size <= sizes[index] <= max_size),
+                                    key=lambda index: counts[index] / (size + sizes[index]))
+        suggestions = []
+        for index in candidates:
+            common = len(query & self.trigrams(self.normalize(direction.sources[index])))
+            score = 2 * common / (size + direction.sizes[index])
+            if score >= threshold:
+                suggestions.append(TMSuggestion(source_text=direction.sources[index],
+                                                target_text=direction.targets[index], score=round(score, 3)))
+        suggestions.sort(key=lambda s: s.score, reverse=True)
+        return suggestions[:self.max_suggestions]
+
+    async def add_segments(self, segments: List[Dict[str, Any]], user_id: Optional[int] = None) -> int:
+        """Stores segments ({source_lang, target_lang, source_text, target_text}) and indexes them."""
+        now = datetime.datetime.utcnow()
+        rows = [{**segment, "created_by": user_id, "created_at": now} for segment in segments]
+        for start in range(0, len(rows), 1000):
+            await database.execute_many(tm_segments.insert(), rows[start:start + 1000])
+        await self.refresh()
+        return len(rows)
+
+translation_memory = TranslationMemory(settings.TM_FUZZY_THRESHOLD, settings.TM_MAX_SUGGESTIONS)
+
+
+def parse_tmx(data: bytes) -> List[Dict[str, Any]]:
+    """
+    Reads translation units from a TMX document. Every ordered language pair within a
+    unit becomes a segment, so a two-language TMX feeds both directions. Language tags
+    are reduced to their primary subtag (en-US -> en).
+    """
+    xml_lang = "{http://www.w3.org/XML/1998/namespace}lang"
+    segments = []
+    for _, element in ElementTree.iterparse(io.BytesIO(data)):
+        if element.tag != "tu":
+            continue
+        variants = {}
+        for tuv in element.iter("tuv"):
+            lang = (tuv.get(xml_lang) or tuv.get("lang") or "").split("-")[0].lower()
+            seg = tuv.find("seg")
+            text = "".join(seg.itertext()).strip() if seg is not None else ""
+            if lang and text:
+                variants[lang] = text
+        for source_lang, source_text in variants.items():
+            for target_lang, target_text in variants.items():
+                if source_lang != target_lang:
+                    segments.append({"source_lang": source_lang, "target_lang": target_lang,
+                                     "source_text": source_text, "target_text": target_text})
+        element.clear()
+    return segments
+
+
+async def translate_with_memory(inference: InferenceBackend, text: str, source_lang: str, target_lang: str) -> str:
+    """Translation memory exact hit if there is one, otherwise the machine translation."""
+    return (translation_memory.exact(text, source_lang, target_lang)
+            or (await inference.translate([text], source_lang, target_lang))[0])
+
+
+async def translate_to_languages(inference: InferenceBackend, text: str, source_lang: str,
+                                 target_langs) -> Dict[str, str]:
+    """
+    Translates one text into every distinct target language, running each direction once.
+    Translation memory exact hits skip the translator. Pivot legs share a single English
+    translation. The result always includes the source text under source_lang;
+    unreachable targets are omitted.
+    """
+    results = {source_lang: text}
+    for lang in set(target_langs) - {source_lang}:
+        remembered = translation_memory.exact(text, source_lang, lang)
+        if remembered: results[lang] = remembered
+    routes = {lang: translation_route(inference, source_lang, lang) for lang in set(target_langs) - set(results)}
+    for lang, route in routes.items():
+        if route is None:
+            logger.warning(f"No translation route from '{source_lang}' to '{lang}'")
+
+    first_hop = sorted({route[1] for route in routes.values() if route} - set(results))
+    first_results = await asyncio.gather(*(inference.translate([text], source_lang, lang) for lang in first_hop))
+    results.update({lang: translated[0] for lang, translated in zip(first_hop, first_results)})
+
+    second_hop = sorted(lang for lang, route in routes.items() if route and len(route) == 3)
+    second_results = await asyncio.gather(
+        *(inference.translate([results[PIVOT_LANGUAGE]], PIVOT_LANGUAGE, lang) for lang in second_hop))
+    results.update({lang: translated[0] for lang, translated in zip(second_hop, second_results)})
+    return results
+
+
+async def run_true_voice_training_task(clone_id: int, user_id: int, source_audio_path: str, model_save_path: str,
+                                       content_hash: Optional[str] = None, reference_seconds: float = 0.0):
     """
     This is the real, non-simulated voice cloning process. It computes the
-    speaker conditioning latents from an audio file and saves them.
+    speaker conditioning latents from an audio file and saves them. With a
+    content_hash the latents are registered for reuse by identical uploads.
     """
     try:
         logger.info(f"STARTING TRUE VOICE CLONING for clone_id: {clone_id}")
         await database.execute(voice_clones.update().where(voice_clones.c.id == clone_id).values(status="training"))
 
-        xtts_model = app.state.ai_model_manager.get_model('xtts')
-        if not xtts_model:
+        inference: InferenceBackend = app.state.inference
+        if not inference.has_model('xtts'):
             raise RuntimeError("XTTS model is not available for voice cloning.")
 
         # --- The Core Machine Learning Step ---
         # This function computes the unique vocal characteristics from the audio file.
-        gpt_cond_latent, speaker_embedding = xtts_model.get_conditioning_latents(audio_path=source_audio_path)
+        latents = await inference.conditioning_latents(audio_path=source_audio_path)
 
         # Save the computed tensors to the specified model_path.
-        torch.save({
-            'gpt_cond_latent': gpt_cond_latent,
-            'speaker_embedding': speaker_embedding
+        await asyncio.to_thread(torch.save, {
+            'gpt_cond_latent': latents['gpt_cond_latent'].cpu(),
+            'speaker_embedding': latents['speaker_embedding'].cpu()
         }, model_save_path)
 
         logger.info(f"SUCCESS: Voice cloning for clone_id {clone_id} completed. Latents saved to {model_save_path}")
         await database.execute(voice_clones.update().where(voice_clones.c.id == clone_id).values(status="completed",
                                                                                                  model_path=model_save_path))
+        usage_recorder.record(user_id, clones_trained=1)
+        if content_hash:
+            try:
+                await database.execute(voice_latents.insert().values(
+                    user_id=user_id, content_hash=content_hash, model_path=model_save_path,
+                    source_audio_path=source_audio_path, reference_seconds=reference_seconds))
+            except Exception as e:  # An identical sample trained concurrently already registered its latents
+                logger.warning(f"Could not register latents of clone {clone_id} for reuse: {e}")
 
     except Exception as e:
         logger.error(f"FAILURE: Voice cloning for clone_id {clone_id} failed. Error: {e}", exc_info=True)
@@ -450,20 +1606,17 @@ def format_transcript_for_llm(conversation: List[ConversationTurn], source_lang:
             transcript += f"  └ [Translation for {speaker} ({target_lang})]: {turn.text}\n"
     return transcript
 
-async def generate_summary_with_llm(full_transcript: str) -> Dict[str, Any]:
+class SummarizationEngine:
     """
-    Generates a summary and action items from a transcript using the OpenAI API.
-    This is the final, production-ready implementation.
+    Map-reduce conversation summarization over one pooled OpenAI-compatible client.
+    Transcripts that exceed SUMMARY_CHUNK_TOKENS are split on turn boundaries, the
+    chunks are summarized concurrently (at most SUMMARY_MAX_CONCURRENCY calls in
+    flight) and the partial results are reduced, hierarchically if needed. Results
+    are cached by transcript hash. Point OPENAI_BASE_URL at a local OpenAI-compatible
+    server for tests and benchmarks.
     """
-    if not settings.OPENAI_API_KEY:
-        logger.warning("OPENAI_API_KEY not set. Summarization will be disabled.")
-        return {
-            "summary": "Summary feature is not configured. An administrator needs to provide an API key.",
-            "action_items": []
-        }
 
-    client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
-    system_prompt = """
+    SYSTEM_PROMPT = """
     You are a highly skilled assistant that analyzes conversation transcripts.
     Your task is to provide a concise, neutral summary of the key topics discussed
     and to extract a clear, bulleted list of actionable items.
@@ -471,27 +1624,888 @@ async def generate_summary_with_llm(full_transcript: str) -> Dict[str, Any]:
     and "action_items" (a list of strings).
     If no action items are found, return an empty list.
     """
+    MAP_PROMPT = SYSTEM_PROMPT + """
+    The text is one consecutive part of a longer conversation. Summarize only this part.
+    """
+    REDUCE_PROMPT = """
+    You are given partial summaries and action items of consecutive parts of one conversation.
+    Merge them into a single concise, neutral summary of the whole conversation and one
+    de-duplicated list of action items.
+    Your response MUST be a valid JSON object with two keys: "summary" (a string)
+    and "action_items" (a list of strings).
+    """
 
-    try:
-        logger.info("Making API call to OpenAI for summarization...")
-        response = await client.chat.completions.create(
-            model="gpt-4-turbo-preview", # Or another suitable model like gpt-3.5-turbo
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": full_transcript}
-            ],
-            response_format={"type": "json_object"},
-            temperature=0.5,
-        )
-        content = response.choices[0].message.content
-        return json.loads(content)
+    def __init__(self):
+        self._client: Optional[AsyncOpenAI] = None
+        self._semaphore = asyncio.Semaphore(settings.SUMMARY_MAX_CONCURRENCY)
+        self._cache: "collections.OrderedDict[str, Dict[str, Any]]" = collections.OrderedDict()
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+    def start(self):
+        if not settings.OPENAI_API_KEY:
+            logger.warning("OPENAI_API_KEY not set. LLM summarization will be disabled.")
+            return
+        # One keep-alive connection pool shared by every summarization request
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=settings.SUMMARY_MAX_CONCURRENCY * 2,
+                                max_keepalive_connections=settings.SUMMARY_MAX_CONCURRENCY),
+            timeout=settings.SUMMARY_REQUEST_TIMEOUT_SECONDS)
+        self._client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY, base_url=settings.OPENAI_BASE_URL,
+                                   http_client=http_client)
+
+    async def close(self):
+        for task in self._inflight.values():
+            task.cancel()
+        if self._client:
+            await self._client.close()
+
+    @property
+    def available(self) -> bool:
+        return self._client is not None
+
+    @staticmethod
+    def estimate_tokens(text: str) -> int:
+        return len(text) // 4 + 1  # ~4 characters per token for English/Russian prose
+
+    def split_into_chunks(self, transcript: str) -> List[str]:
+        """Splits on line (turn) boundaries so each chunk, with the header repeated, fits the budget."""
+        header, _, body = transcript.partition("\n\n")
+        budget = settings.SUMMARY_CHUNK_TOKENS - self.estimate_tokens(header)
+        chunks, current, current_tokens = [], [], 0
+        for line in body.splitlines():
+            pieces = [line]
+            if self.estimate_tokens(line) > budget:  # A single very long turn
+                width = budget * 4
+                pieces = [line[i:i + width] for i in range(0, len(line), width)]
+            for piece in pieces:
+                tokens = self.estimate_tokens(piece)
+                if current and current_tokens + tokens > budget:
+                    chunks.append(current)
+                    current, current_tokens = [], 0
+                current.append(piece)
+                current_tokens += tokens
+        if current:
+            chunks.append(current)
+        return [f"{header}\n\n" + "\n".join(chunk) for chunk in chunks] or [transcript]
+
+    async def summarize(self, transcript: str) -> Dict[str, Any]:
+        if not self.available:
+            return {
+                "summary": "Summary feature is not configured. An administrator needs to provide an API key.",
+                "action_items": []
+            }
+        try:
+            return await self.summarize_or_raise(transcript)
+        except Exception as e:
+            logger.error(f"OpenAI API call for summarization failed: {e}", exc_info=True)
+            return {"summary": "An error occurred while generating the summary.", "action_items": []}
+
+    async def summarize_or_raise(self, transcript: str) -> Dict[str, Any]:
+        key = hashlib.sha256(f"{settings.SUMMARY_MODEL}\0{transcript}".encode()).hexdigest()
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        task = self._inflight.get(key)
+        if task is None:  # Otherwise an identical transcript is already being summarized
+            task = asyncio.create_task(self._summarize_shared(key, transcript))
+            # Waiters re-raise a failure; don't log it as never retrieved if they all went away
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self._inflight[key] = task
+        # The work is shared: a waiter that is cancelled (e.g. its client left) only stops waiting
+        return await asyncio.shield(task)
+
+    async def _summarize_shared(self, key: str, transcript: str) -> Dict[str, Any]:
+        try:
+            result = await self._map_reduce(transcript)
+            self._cache[key] = result
+            if len(self._cache) > settings.SUMMARY_CACHE_SIZE:
+                self._cache.popitem(last=False)
+            return result
+        finally:
+            self._inflight.pop(key, None)
+
+    async def _complete(self, system_prompt: str, content: str) -> Dict[str, Any]:
+        async with self._semaphore:
+            response = await self._client.chat.completions.create(
+                model=settings.SUMMARY_MODEL,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": content}
+                ],
+                response_format={"type": "json_object"},
+                temperature=0.5,
+            )
+        return json.loads(response.choices[0].message.content)
+
+    async def _map_reduce(self, transcript: str) -> Dict[str, Any]:
+        chunks = self.split_into_chunks(transcript)
+        if len(chunks) == 1:
+            return await self._complete(self.SYSTEM_PROMPT, transcript)
+        logger.info(f"Summarizing long transcript in {len(chunks)} chunks...")
+        partials = await asyncio.gather(*(self._complete(self.MAP_PROMPT, chunk) for chunk in chunks))
+        return await self._reduce(list(partials))
+
+    async def _reduce(self, partials: List[Dict[str, Any]]) -> Dict[str, Any]:
+        rendered = [
+            f"Part {i}:\nSummary: {p.get('summary', '')}\nAction items:\n"
+            + "\n".join(f"- {item}" for item in p.get('action_items', []))
+            for i, p in enumerate(partials, start=1)
+        ]
+        if len(partials) <= 2 or self.estimate_tokens("\n\n".join(rendered)) <= settings.SUMMARY_CHUNK_TOKENS:
+            return await self._complete(self.REDUCE_PROMPT, "\n\n".join(rendered))
+
+        # Too many partials for one call: reduce budget-sized groups concurrently, then recurse
+        groups, current, current_tokens = [], [], 0
+        for text in rendered:
+            tokens = self.estimate_tokens(text)
+            if current and current_tokens + tokens > settings.SUMMARY_CHUNK_TOKENS:
+                groups.append(current)
+                current, current_tokens = [], 0
+            current.append(text)
+            current_tokens += tokens
+        groups.append(current)
+        reduced = await asyncio.gather(*(self._complete(self.REDUCE_PROMPT, "\n\n".join(g)) for g in groups))
+        return await self._reduce(list(reduced))
+
+summarization_engine = SummarizationEngine()
+
+class ExtractiveSummarizer:
+    """
+    Offline summarization with the MiniLM sentence encoder already loaded for KeyBERT.
+    Sentences are embedded in one batched call and picked by maximal marginal relevance
+    against the transcript centroid; action items come from lightweight ru/en patterns.
+    """
 
-    except Exception as e:
-        logger.error(f"OpenAI API call for summarization failed: {e}", exc_info=True)
-        return {
-            "summary": "An error occurred while generating the summary.",
-            "action_items": []
-        }
+    SENTENCE_SPLIT = re.compile(r"(?<=[.!?…])\s+")
+    ACTION_PATTERNS = [
+        # English
+        re.compile(r"\b(i|we|you|they|he|she)\s*('ll|\s+will|\s+need to|\s+have to|\s+must|\s+should|\s+are going to|\s+am going to)\s+\w+", re.IGNORECASE),
+        re.compile(r"\b(let's|let us|please|make sure|don't forget|remember to|action item|follow up|todo|to-do)\b", re.IGNORECASE),
+        re.compile(r"\b(by|before|until)\s+(monday|tuesday|wednesday|thursday|friday|tomorrow|tonight|next week|end of (the )?(day|week|month))\b", re.IGNORECASE),
+        # Russian
+        re.compile(r"\b(надо|нужно|необходимо|должен|должна|должны|давайте|давай|договорились|не забудь|не забудьте|обязательно)\b", re.IGNORECASE),
+        re.compile(r"\b(сделаю|сделаем|отправлю|отправим|подготовлю|подготовим|позвоню|напишу|проверю|проверим|пришлю|пришлем|займусь|обсудим)\b", re.IGNORECASE),
+        re.compile(r"\bк\s+(понедельнику|вторнику|среде|четвергу|пятнице|завтрашнему дню|концу (дня|недели|месяца))\b|\bдо\s+(завтра|понедельника|пятницы|конца (дня|недели|месяца))\b", re.IGNORECASE),
+    ]
+
+    def __init__(self, max_sentences: int = 5, diversity: float = 0.3, max_action_items: int = 10):
+        self.max_sentences = max_sentences
+        self.diversity = diversity
+        self.max_action_items = max_action_items
+
+    def split_sentences(self, conversation: List[ConversationTurn]) -> List[str]:
+        turns = [t for t in conversation if t.type == "transcript"] or conversation
+        return [s.strip() for turn in turns for s in self.SENTENCE_SPLIT.split(turn.text) if s.strip()]
+
+    def extract_action_items(self, sentences: List[str]) -> List[str]:
+        items, seen = [], set()
+        for sentence in sentences:
+            if len(sentence.split()) < 3 or sentence.lower() in seen: continue
+            if any(pattern.search(sentence) for pattern in self.ACTION_PATTERNS):
+                seen.add(sentence.lower())
+                items.append(sentence)
+                if len(items) >= self.max_action_items: break
+        return items
+
+    def select_sentences(self, embeddings: np.ndarray) -> List[int]:
+        """MMR over L2-normalized embeddings; returns selected indices in transcript order."""
+        centroid = embeddings.mean(axis=0)
+        centroid /= np.linalg.norm(centroid) or 1.0
+        relevance = embeddings @ centroid
+        max_redundancy = np.full(len(embeddings), -1.0, dtype=np.float32)
+        selected: List[int] = []
+        for _ in range(min(self.max_sentences, len(embeddings))):
+            scores = (1 - self.diversity) * relevance - self.diversity * np.maximum(max_redundancy, 0)
+            scores[selected] = -np.inf
+            best = int(np.argmax(scores))
+            selected.append(best)
+            max_redundancy = np.maximum(max_redundancy, embeddings @ embeddings[best])
+        return sorted(selected)
+
+    async def summarize(self, conversation: List[ConversationTurn], inference: InferenceBackend) -> Dict[str, Any]:
+        sentences = self.split_sentences(conversation)
+        action_items = self.extract_action_items(sentences)
+        # Very short fragments ("Yes.", "Okay.") make poor summary sentences
+        candidates = [s for s in sentences if len(s.split()) >= 4] or sentences
+        if len(candidates) <= self.max_sentences:
+            return {"summary": " ".join(candidates), "action_items": action_items}
+        embeddings = await inference.embed(candidates)
+        summary = " ".join(candidates[i] for i in self.select_sentences(embeddings))
+        return {"summary": summary, "action_items": action_items}
+
+extractive_summarizer = ExtractiveSummarizer(max_sentences=settings.SUMMARY_EXTRACTIVE_SENTENCES)
+
+
+class HistorySearchIndex:
+    """
+    Per-user semantic index over translation_history. Row embeddings are appended in
+    background batches to a float16 matrix file (user_<id>.f16, behind a small header that
+    records the embedding dimension) with a parallel file of row ids (user_<id>.ids);
+    searches memory-map both and score them with chunked brute-force dot products. The
+    ids file is the row count of record: appends write vectors first and ids last under
+    an exclusive flock, and readers map the files under a shared one, so several web
+    workers can share the directory.
+    """
+
+    SEARCH_CHUNK_ROWS = 65536
+    HEADER = struct.Struct("<8sI4x")  # magic, embedding dimension; pads vectors to a 16-byte offset
+    MAGIC = b"VVHIDX01"
+
+    def __init__(self, directory: str, batch_size: int, interval_seconds: float):
+        self.directory = directory
+        self.batch_size = batch_size
+        self.interval_seconds = interval_seconds
+        self.inference: Optional[InferenceBackend] = None
+        self._dirty: set = set()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._maps: Dict[int, tuple] = {}  # user_id -> (rows, vectors memmap, ids memmap)
+        if not os.path.exists(directory): os.makedirs(directory)
+
+    def _paths(self, user_id: int) -> tuple:
+        base = os.path.join(self.directory, f"user_{user_id}")
+        return f"{base}.f16", f"{base}.ids", f"{base}.lock"
+
+    async def start(self, inference: InferenceBackend):
+        self.inference = inference
+        if not inference.has_model('sentence_encoder'):
+            logger.warning("Sentence encoder not loaded. Semantic history search is disabled.")
+            return
+        rows = await database.fetch_all(sqlalchemy.select(translation_history.c.user_id).distinct())
+        self._dirty.update(row['user_id'] for row in rows)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task: self._task.cancel()
+
+    @property
+    def available(self) -> bool:
+        return self._task is not None
+
+    def notify(self, user_id: int):
+        """Marks a user's history as having rows that still need embedding."""
+        self._dirty.add(user_id)
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            for user_id in list(self._dirty):
+                self._dirty.discard(user_id)
+                try:
+                    while await self._index_batch(user_id):
+                        pass
+                except Exception as e:
+                    logger.error(f"History indexing failed for user {user_id}: {e}", exc_info=True)
+
+    def _last_indexed_id(self, user_id: int) -> int:
+        _, ids_path, _ = self._paths(user_id)
+        if not os.path.exists(ids_path) or os.path.getsize(ids_path) < 8:
+            return 0
+        with open(ids_path, "rb") as f:
+            f.seek((os.path.getsize(ids_path) // 8 - 1) * 8)
+            return int(np.frombuffer(f.read(8), dtype=np.int64)[0])
+
+    async def _index_batch(self, user_id: int) -> bool:
+        """Embeds and appends the next batch of unindexed rows. Returns False once caught up."""
+        after_id = await asyncio.to_thread(self._last_indexed_id, user_id)
+        rows = await database.fetch_all(
+            translation_history.select()
+            .where(translation_history.c.user_id == user_id, translation_history.c.id > after_id)
+            .order_by(translation_history.c.id).limit(self.batch_size))
+        if not rows:
+            return False
+        texts = [f"{row['source_text'] or ''}\n{row['translated_text'] or ''}" for row in rows]
+        embeddings = await self.inference.embed(texts)
+        ids = np.array([row['id'] for row in rows], dtype=np.int64)
+        appended = await asyncio.to_thread(self._append, user_id, after_id, embeddings.astype(np.float16), ids)
+        return appended and len(rows) == self.batch_size
+
+    def _append(self, user_id: int, after_id: int, vectors: np.ndarray, ids: np.ndarray) -> bool:
+        vectors_path, ids_path, lock_path = self._paths(user_id)
+        with open(lock_path, "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if self._last_indexed_id(user_id) != after_id:
+                return False  # Another worker indexed these rows first
+            count = os.path.getsize(ids_path) // 8 if os.path.exists(ids_path) else 0
+            dim = vectors.shape[1]
+            stored_dim = self._read_dim(vectors_path) if count else dim
+            if stored_dim != dim:
+                raise ValueError(f"History index for user {user_id} holds {stored_dim}-d vectors, got {dim}-d; "
+                                 f"delete it to rebuild")
+            with open(vectors_path, "ab") as f:
+                # Drop vectors left behind by an append that never wrote its ids
+                f.truncate(self.HEADER.size + count * dim * 2 if count else 0)
+                if not count:
+                    f.write(self.HEADER.pack(self.MAGIC, dim))
+                f.write(vectors.tobytes())
+            with open(ids_path, "ab") as f:
+                f.write(ids.tobytes())
+        return True
+
+    def _read_dim(self, vectors_path: str) -> int:
+        with open(vectors_path, "rb") as f:
+            magic, dim = self.HEADER.unpack(f.read(self.HEADER.size))
+        if magic != self.MAGIC:
+            raise ValueError(f"{vectors_path} is not a history index file; delete it to rebuild")
+        return dim
+
+    def _open(self, user_id: int) -> Optional[tuple]:
+        vectors_path, ids_path, lock_path = self._paths(user_id)
+        if not os.path.exists(ids_path):
+            return None
+        with open(lock_path, "w") as lock:
+            # An append in progress may already have written vectors its ids don't count yet
+            fcntl.flock(lock, fcntl.LOCK_SH)
+            rows = os.path.getsize(ids_path) // 8
+            cached = self._maps.get(user_id)
+            if cached and cached[0] == rows:
+                return cached
+            if rows == 0:
+                return None
+            dim = self._read_dim(vectors_path)
+            vectors = np.memmap(vectors_path, dtype=np.float16, mode="r", offset=self.HEADER.size, shape=(rows, dim))
+            ids = np.memmap(ids_path, dtype=np.int64, mode="r", shape=(rows,))
+        self._maps[user_id] = (rows, vectors, ids)
+        return self._maps[user_id]
+
+    def _top_k(self, user_id: int, query: np.ndarray, k: int) -> List[tuple]:
+        index = self._open(user_id)
+        if index is None:
+            return []
+        rows, vectors, ids = index
+        best_scores, best_ids = np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+        for start in range(0, rows, self.SEARCH_CHUNK_ROWS):
+            scores = vectors[start:start + self.SEARCH_CHUNK_ROWS].astype(np.float32) @ query
+            take = min(k, len(scores))
+            top = np.argpartition(-scores, take - 1)[:take]
+            best_scores = np.concatenate([best_scores, scores[top]])
+            best_ids = np.concatenate([best_ids, ids[start + top]])
+        order = np.argsort(-best_scores)[:k]
+        return [(int(best_ids[i]), float(best_scores[i])) for i in order]
+
+    async def search(self, user_id: int, query: str, k: int) -> List[tuple]:
+        """Returns up to k (row_id, cosine score) pairs, best first."""
+        self.notify(user_id)  # Pick up rows written since the last indexing pass
+        query_embedding = (await self.inference.embed([query]))[0].astype(np.float32)
+        return await asyncio.to_thread(self._top_k, user_id, query_embedding, k)
+
+history_search_index = HistorySearchIndex(settings.HISTORY_INDEX_DIR, settings.HISTORY_INDEX_BATCH_SIZE,
+                                          settings.HISTORY_INDEX_INTERVAL_SECONDS)
+
+
+# ### USAGE ROLLUPS ###
+class UsageRecorder:
+    """
+    Incrementally maintained usage rollups. Events only bump in-memory counters; a
+    background task folds them into usage_daily and usage_totals with one upsert per
+    key and flush. user_id 0 carries the all-users rollup, so admin totals, daily
+    series and top-N queries are single indexed reads instead of history scans.
+    """
+
+    def __init__(self):
+        self._pending: Dict[tuple, collections.Counter] = collections.defaultdict(collections.Counter)
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task: self._task.cancel()
+        await self.flush()
+
+    def record(self, user_id: int, **amounts: float):
+        """Adds amounts of USAGE_METRICS to the user's rollup for today (UTC)."""
+        amounts = {metric: amount for metric, amount in amounts.items() if amount}
+        if amounts:
+            self._pending[(user_id, datetime.datetime.utcnow().date())].update(amounts)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(settings.USAGE_FLUSH_INTERVAL_SECONDS)
+            await self.flush()
+
+    @staticmethod
+    def _increment(table: Table, key: Dict[str, Any], amounts: Dict[str, float]):
+        row = {**key, **{metric: 0 for metric in USAGE_METRICS}, **amounts}
+        if engine.dialect.name == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        statement = insert(table).values(**row)
+        return statement.on_conflict_do_update(
+            index_elements=list(key),
+            set_={metric: table.c[metric] + statement.excluded[metric] for metric in amounts})
+
+    async def flush(self):
+        async with self._flush_lock:
+            pending, self._pending = self._pending, collections.defaultdict(collections.Counter)
+            if not pending:
+                return
+            daily: Dict[tuple, collections.Counter] = collections.defaultdict(collections.Counter)
+            totals: Dict[int, collections.Counter] = collections.defaultdict(collections.Counter)
+            for (user_id, day), amounts in pending.items():
+                for rollup_user in (user_id, 0):
+                    daily[(rollup_user, day)].update(amounts)
+                    totals[rollup_user].update(amounts)
+            try:
+                async with database.transaction():
+                    for (user_id, day), amounts in daily.items():
+                        await database.execute(self._increment(usage_daily, {"user_id": user_id, "day": day}, amounts))
+                    for user_id, amounts in totals.items():
+                        await database.execute(self._increment(usage_totals, {"user_id": user_id}, amounts))
+            except Exception as e:
+                logger.error(f"Failed to flush usage rollups for {len(pending)} user-days: {e}", exc_info=True)
+                for key, amounts in pending.items():  # Retry with the next flush
+                    self._pending[key].update(amounts)
+
+usage_recorder = UsageRecorder()
+
+
+class VoiceIngestStats:
+    """Voice sample ingest counters for this worker: bytes received, receive and normalization time."""
+
+    def __init__(self):
+        self.uploads = 0
+        self.reused = 0  # Uploads that matched previously trained audio
+        self.bytes = 0
+        self.receive_seconds = 0.0
+        self.process_seconds = 0.0
+
+    def record(self, size: int, receive_seconds: float, process_seconds: float):
+        self.uploads += 1
+        self.bytes += size
+        self.receive_seconds += receive_seconds
+        self.process_seconds += process_seconds
+
+    def snapshot(self) -> Dict[str, float]:
+        return {"uploads": self.uploads, "reused_latents": self.reused, "bytes": self.bytes,
+                "receive_mb_per_second": round(self.bytes / 1e6 / self.receive_seconds, 2) if self.receive_seconds else 0.0,
+                "avg_process_seconds": round(self.process_seconds / self.uploads, 3) if self.uploads else 0.0}
+
+voice_ingest_stats = VoiceIngestStats()
+
+
+# ### OFFLINE AUDIO JOBS ###
+def decode_audio_for_job(source_path: str, decoded_path: str) -> float:
+    """Process-pool worker: decodes a recording to 16 kHz mono float32 (.npy). Returns its duration."""
+    waveform, sample_rate = torchaudio.load(source_path)
+    waveform = waveform.mean(dim=0)
+    if sample_rate != PCM_SAMPLE_RATE:
+        waveform = torchaudio.functional.resample(waveform, sample_rate, PCM_SAMPLE_RATE)
+    audio = waveform.numpy().astype(np.float32)
+    with open(f"{decoded_path}.tmp", "wb") as f:
+        np.save(f, audio)
+    os.replace(f"{decoded_path}.tmp", decoded_path)  # Resume trusts an existing decoded.npy
+    return len(audio) / PCM_SAMPLE_RATE
+
+
+VOICE_REFERENCE_SAMPLE_RATE = 22050  # Rate XTTS resamples reference audio to
+
+
+def prepare_voice_sample(raw_path: str, out_path: str, min_seconds: float, max_seconds: float,
+                         target_dbfs: float) -> tuple:
+    """
+    Process-pool worker: decodes an uploaded voice sample once into the reference format (mono
+    16-bit WAV at VOICE_REFERENCE_SAMPLE_RATE), trims leading/trailing silence, caps its length and
+    normalizes its RMS loudness to target_dbfs (peak-limited to -1 dBFS).
+    Returns (duration seconds, sha256 of the normalized PCM); raises ValueError on unusable audio.
+    """
+    waveform, sample_rate = torchaudio.load(raw_path)
+    waveform = waveform.mean(dim=0)
+    if sample_rate != VOICE_REFERENCE_SAMPLE_RATE:
+        waveform = torchaudio.functional.resample(waveform, sample_rate, VOICE_REFERENCE_SAMPLE_RATE)
+    audio = waveform.numpy().astype(np.float32)
+
+    frame = VOICE_REFERENCE_SAMPLE_RATE // 50  # 20 ms
+    count = len(audio) // frame
+    if count:
+        energy_db = 10 * np.log10(np.mean(audio[:count * frame].reshape(-1, frame) ** 2, axis=1) + 1e-10)
+        voiced = np.flatnonzero(energy_db > max(float(energy_db.max()) - 40, -60.0))
+        if voiced.size:
+            audio = audio[voiced[0] * frame:(voiced[-1] + 1) * frame]
+    audio = audio[:int(max_seconds * VOICE_REFERENCE_SAMPLE_RATE)]
+    duration = len(audio) / VOICE_REFERENCE_SAMPLE_RATE
+    if duration < min_seconds:
+        raise ValueError(f"The sample contains less than {min_seconds:g} seconds of speech.")
+
+    rms = float(np.sqrt(np.mean(audio ** 2)))
+    peak = float(np.abs(audio).max())
+    if rms > 0:
+        audio *= min(10 ** (target_dbfs / 20) / rms, 0.891 / peak)
+    pcm = (np.clip(audio, -1.0, 1.0) * 32767).astype("<i2").tobytes()
+    with wave.open(out_path, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(VOICE_REFERENCE_SAMPLE_RATE)
+        wav.writeframes(pcm)
+    return duration, hashlib.sha256(pcm).hexdigest()
+
+
+def detect_speech_segments(decoded_path: str, frame_ms: int = 30, min_silence: float = 0.5,
+                           min_speech: float = 0.3, max_segment: float = 30.0, pad: float = 0.2) -> List[List[float]]:
+    """
+    Process-pool worker: energy-based VAD. Frames louder than the recording's noise floor
+    by 10 dB are speech; gaps under min_silence are bridged, and segments longer than
+    max_segment (Whisper's window) are split at their quietest frame. Returns [start, end] seconds.
+    """
+    audio = np.load(decoded_path, mmap_mode="r")
+    frame = PCM_SAMPLE_RATE * frame_ms // 1000
+    count = len(audio) // frame
+    if count == 0:
+        return []
+    energy_db = np.empty(count, dtype=np.float32)
+    for start in range(0, count, 100000):  # Bounded memory on very long recordings
+        frames = np.asarray(audio[start * frame:min(count, start + 100000) * frame], dtype=np.float32)
+        energy_db[start:start + len(frames) // frame] = 10 * np.log10(
+            np.mean(frames.reshape(-1, frame) ** 2, axis=1) + 1e-10)
+    threshold = max(float(np.percentile(energy_db, 10)) + 10, -60.0)
+    speech = energy_db > threshold
+
+    gap_frames = int(min_silence * 1000 / frame_ms)
+    spans, start, last = [], None, 0
+    for i in np.flatnonzero(speech):
+        if start is not None and i - last > gap_frames:
+            spans.append((start, last + 1))
+            start = None
+        if start is None: start = i
+        last = i
+    if start is not None: spans.append((start, last + 1))
+
+    max_frames = int(max_segment * 1000 / frame_ms)
+    pending, bounded = list(spans), []
+    while pending:
+        span_start, span_end = pending.pop(0)
+        if span_end - span_start <= max_frames:
+            bounded.append((span_start, span_end))
+            continue
+        inner = energy_db[span_start + max_frames // 4:span_start + max_frames]
+        cut = span_start + max_frames // 4 + int(np.argmin(inner))
+        pending[:0] = [(span_start, cut), (cut, span_end)]
+
+    seconds = frame_ms / 1000
+    duration = len(audio) / PCM_SAMPLE_RATE
+    return [[max(0.0, s * seconds - pad), min(duration, e * seconds + pad)]
+            for s, e in bounded if (e - s) * seconds >= min_speech]
+
+
+def format_subtitle_timestamp(seconds: float, separator: str) -> str:
+    millis = int(round(seconds * 1000))
+    hours, millis = divmod(millis, 3600000)
+    minutes, millis = divmod(millis, 60000)
+    secs, millis = divmod(millis, 1000)
+    return f"{hours:02d}:{minutes:02d}:{secs:02d}{separator}{millis:03d}"
+
+
+def render_subtitles(segments: List[Dict[str, Any]], track: str, subtitle_format: str) -> str:
+    """SRT or WebVTT cues for the 'text' (source) or 'translation' track of a job's segments."""
+    separator = "," if subtitle_format == "srt" else "."
+    cues = []
+    for number, segment in enumerate((s for s in segments if s.get(track)), start=1):
+        timing = (f"{format_subtitle_timestamp(segment['start'], separator)} --> "
+                  f"{format_subtitle_timestamp(segment['end'], separator)}")
+        speaker = f"[{segment['speaker']}] " if segment.get('speaker') else ""
+        cues.append(f"{number}\n{timing}\n{speaker}{segment[track]}\n" if subtitle_format == "srt"
+                    else f"{timing}\n{speaker}{segment[track]}\n")
+    body = "\n".join(cues)
+    return body if subtitle_format == "srt" else f"WEBVTT\n\n{body}"
+
+
+class AudioJobRunner:
+    """
+    Translates uploaded recordings in the background. Decoding and VAD run on a process
+    pool; the speech segments are grouped into chunks of ~AUDIO_JOB_CHUNK_SECONDS that are
+    transcribed, diarized, translated (and optionally dubbed) several at a time through
+    the shared inference backend, whose micro-batchers coalesce the concurrent segments.
+    Every finished chunk is written to the job directory, so a restarted job resumes at
+    the first missing chunk. Job inference is scheduled at a low weight next to live
+    sessions. Jobs are claimed through the database by any worker on the host that holds
+    the job directory, or by any worker at all when AUDIO_JOBS_DIR_SHARED is set.
+    Diarization also runs per chunk, and its labels only tell speakers apart within one
+    chunk, so segment speakers are qualified by chunk ("chunk3/SPEAKER_01"); the same
+    label in two chunks is not known to be the same person.
+    """
+
+    def __init__(self):
+        self.inference: Optional[InferenceBackend] = None
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def start(self, inference: InferenceBackend):
+        self.inference = inference
+        if not os.path.exists(settings.AUDIO_JOBS_DIR): os.makedirs(settings.AUDIO_JOBS_DIR)
+        self._pool = ProcessPoolExecutor(max_workers=settings.AUDIO_JOB_DECODE_PROCESSES)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task: self._task.cancel()
+        if self._pool: self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self):
+        self._wakeup.set()
+
+    async def run_in_pool(self, func, *args):
+        """Runs a CPU-bound audio function on the decode process pool."""
+        return await asyncio.get_running_loop().run_in_executor(self._pool, func, *args)
+
+    @staticmethod
+    def job_dir(job_id: str) -> str:
+        return os.path.join(settings.AUDIO_JOBS_DIR, job_id)
+
+    async def _run(self):
+        while True:
+            try:
+                await self._requeue_stale()
+                job = await self._claim_next()
+                if job is None:
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=settings.AUDIO_JOB_POLL_SECONDS)
+                    except asyncio.TimeoutError:
+                        pass
+                    self._wakeup.clear()
+                    continue
+                await self._process(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Audio job runner error: {e}", exc_info=True)
+                await asyncio.sleep(settings.AUDIO_JOB_POLL_SECONDS)
+
+    async def _requeue_stale(self):
+        """Jobs whose worker stopped heartbeating go back to the queue and resume from their chunks."""
+        stale_before = datetime.datetime.utcnow() - datetime.timedelta(seconds=settings.AUDIO_JOB_STALE_SECONDS)
+        await database.execute(audio_jobs.update().where(
+            audio_jobs.c.status == "running", audio_jobs.c.updated_at < stale_before).values(status="queued"))
+
+    async def _claim_next(self) -> Optional[Any]:
+        query = audio_jobs.select().where(audio_jobs.c.status == "queued")
+        if not settings.AUDIO_JOBS_DIR_SHARED:
+            query = query.where(audio_jobs.c.host == settings.NODE_HOST)
+        candidate = await database.fetch_one(query.order_by(audio_jobs.c.created_at).limit(1))
+        if candidate is None:
+            return None
+        await database.execute(audio_jobs.update().where(
+            audio_jobs.c.id == candidate['id'], audio_jobs.c.status == "queued").values(
+            status="running", worker=settings.NODE_ID, updated_at=datetime.datetime.utcnow()))
+        job = await database.fetch_one(audio_jobs.select().where(audio_jobs.c.id == candidate['id']))
+        return job if job['status'] == "running" and job['worker'] == settings.NODE_ID else None
+
+    async def _owns(self, job_id: str) -> bool:
+        row = await database.fetch_one(sqlalchemy.select(audio_jobs.c.status, audio_jobs.c.worker)
+                                       .where(audio_jobs.c.id == job_id))
+        return bool(row) and row['status'] == "running" and row['worker'] == settings.NODE_ID
+
+    async def _update(self, job_id: str, **values):
+        # Only the claimant writes: once a job is requeued, it belongs to whoever claims it next
+        await database.execute(audio_jobs.update().where(
+            audio_jobs.c.id == job_id, audio_jobs.c.status == "running", audio_jobs.c.worker == settings.NODE_ID
+        ).values(updated_at=datetime.datetime.utcnow(), **values))
+
+    async def _heartbeat(self, job_id: str):
+        """Keeps a claimed job from going stale; returns once this worker no longer owns it."""
+        while True:
+            await asyncio.sleep(settings.AUDIO_JOB_HEARTBEAT_SECONDS)
+            try:
+                if not await self._owns(job_id):
+                    return
+                await self._update(job_id)
+            except Exception as e:
+                logger.warning(f"Audio job {job_id} heartbeat failed: {e}")
+
+    async def _process(self, job: Any):
+        work = asyncio.create_task(self._execute(job))
+        heartbeat = asyncio.create_task(self._heartbeat(job['id']))
+        try:
+            await asyncio.wait({work, heartbeat}, return_when=asyncio.FIRST_COMPLETED)
+            if not work.done():
+                logger.warning(f"Audio job {job['id']} was requeued and claimed elsewhere; abandoning it here.")
+        finally:
+            work.cancel()
+            heartbeat.cancel()
+            await asyncio.gather(work, heartbeat, return_exceptions=True)
+
+    async def _execute(self, job: Any):
+        job_id = job['id']
+        owner = await database.fetch_one(users.select().where(users.c.id == job['user_id']))
+        job = {**dict(job), 'owner_is_superuser': bool(owner and owner['is_superuser'])}
+        directory = self.job_dir(job_id)
+        loop = asyncio.get_running_loop()
+        inference_scheduler.register(job_id, weight=settings.AUDIO_JOB_SCHEDULER_WEIGHT)
+        try:
+            decoded_path = os.path.join(directory, "decoded.npy")
+            if not os.path.exists(decoded_path):
+                duration = await loop.run_in_executor(self._pool, decode_audio_for_job, job['source_path'],
+                                                      decoded_path)
+                await self._update(job_id, duration_seconds=duration)
+            segments_path = os.path.join(directory, "segments.json")
+            if not os.path.exists(segments_path):
+                spans = await loop.run_in_executor(self._pool, detect_speech_segments, decoded_path)
+                await asyncio.to_thread(self._write_json, segments_path, spans)
+            spans = await asyncio.to_thread(self._read_json, segments_path)
+
+            chunks, current = [], []
+            for span in spans:
+                if current and span[1] - current[0][0] > settings.AUDIO_JOB_CHUNK_SECONDS:
+                    chunks.append(current)
+                    current = []
+                current.append(span)
+            if current: chunks.append(current)
+
+            latents_path = None
+            if job['dub'] and job['voice_clone_id']:
+                clone = await database.fetch_one(voice_clones.select().where(
+                    voice_clones.c.id == job['voice_clone_id'], voice_clones.c.user_id == job['user_id']))
+                if clone and clone['status'] == 'completed': latents_path = clone['model_path']
+
+            pending = [i for i in range(len(chunks)) if not os.path.exists(self._chunk_path(job_id, i))]
+            await self._update(job_id, total_chunks=len(chunks), completed_chunks=len(chunks) - len(pending))
+            logger.info(f"Audio job {job_id}: {len(spans)} speech segments in {len(chunks)} chunks, "
+                        f"{len(chunks) - len(pending)} already done")
+
+            audio = np.load(decoded_path, mmap_mode="r")
+            semaphore = asyncio.Semaphore(settings.AUDIO_JOB_PARALLEL_CHUNKS)
+            completed = len(chunks) - len(pending)
+
+            async def run_chunk(index: int):
+                nonlocal completed
+                async with semaphore:
+                    await self._process_chunk(job, index, chunks[index], audio, latents_path)
+                completed += 1
+                await self._update(job_id, completed_chunks=completed)
+
+            await asyncio.gather(*(run_chunk(i) for i in pending))
+            if not await self._owns(job_id):
+                return
+            await asyncio.to_thread(self._assemble, job, len(chunks))
+            await self._update(job_id, status="completed")
+            usage_recorder.record(job['user_id'], audio_seconds=sum(end - start for start, end in spans))
+            logger.info(f"Audio job {job_id} completed.")
+        except asyncio.CancelledError:
+            raise  # Shutdown: the job is requeued once its heartbeat goes stale
+        except Exception as e:
+            logger.error(f"Audio job {job_id} failed: {e}", exc_info=True)
+            await self._update(job_id, status="failed", error=str(e)[:500])
+        finally:
+            inference_scheduler.unregister(job_id)
+
+    def _chunk_path(self, job_id: str, index: int) -> str:
+        return os.path.join(self.job_dir(job_id), f"chunk_{index:05d}.json")
+
+    @staticmethod
+    def _write_json(path: str, data: Any):
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(f"{path}.tmp", path)  # Never leave a half-written chunk behind
+
+    @staticmethod
+    def _write_bytes(path: str, data: bytes):
+        with open(f"{path}.tmp", "wb") as f:
+            f.write(data)
+        os.replace(f"{path}.tmp", path)
+
+    @staticmethod
+    def _read_json(path: str) -> Any:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+
+    async def _process_chunk(self, job: Any, index: int, spans: List[List[float]], audio: np.ndarray,
+                             latents_path: Optional[str]):
+        job_id, inference = job['id'], self.inference
+        source_lang, target_lang = job['source_lang'], job['target_lang']
+        chunk_start = spans[0][0]
+        chunk_audio = np.asarray(audio[int(chunk_start * PCM_SAMPLE_RATE):int(spans[-1][1] * PCM_SAMPLE_RATE)],
+                                 dtype=np.float32)
+
+        speaker_turns = []
+        if inference.has_model('diarization'):
+            async with inference_scheduler.slot(job_id, FairInferenceScheduler.transcription_cost(
+                    len(chunk_audio) / PCM_SAMPLE_RATE)):
+                speaker_turns = await inference.diarize(chunk_audio)
+
+        def speaker_for(start: float, end: float) -> Optional[str]:
+            overlaps = collections.Counter()
+            for turn_start, turn_end, speaker in speaker_turns:
+                overlap = min(end, chunk_start + turn_end) - max(start, chunk_start + turn_start)
+                if overlap > 0: overlaps[speaker] += overlap
+            # Labels are only consistent within this chunk's diarization run
+            return f"chunk{index}/{overlaps.most_common(1)[0][0]}" if overlaps else None
+
+        async def transcribe(start: float, end: float) -> str:
+            segment = np.asarray(audio[int(start * PCM_SAMPLE_RATE):int(end * PCM_SAMPLE_RATE)], dtype=np.float32)
+            async with inference_scheduler.slot(job_id, FairInferenceScheduler.transcription_cost(end - start)):
+                return await inference.transcribe(segment, source_lang)
+
+        texts = await asyncio.gather(*(transcribe(start, end) for start, end in spans))
+        translations = await asyncio.gather(*(translate_with_memory(inference, text, source_lang, target_lang)
+                                              if text else asyncio.sleep(0, result="") for text in texts))
+
+        records = [{"start": round(start, 3), "end": round(end, 3), "speaker": speaker_for(start, end),
+                    "text": text, "translation": translation}
+                   for (start, end), text, translation in zip(spans, texts, translations)]
+
+        dub_pcm = bytearray()
+        if job['dub'] and inference.has_model('xtts'):
+            emotion_params = get_emotion_params(job['emotion'])
+            for record in records:
+                record["dub_offset"], record["dub_length"] = len(dub_pcm), 0
+                if not record["translation"]: continue
+                async with inference_scheduler.slot(job_id, FairInferenceScheduler.synthesis_cost(
+                        record["translation"])):
+                    async for chunk in inference.synthesize_stream(record["translation"], target_lang,
+                                                                   emotion_params, latents_path=latents_path):
+                        dub_pcm.extend(chunk)
+                record["dub_length"] = len(dub_pcm) - record["dub_offset"]
+
+        # A chunk finished after the job was requeued is left to the new claimant, which bills it
+        if not await self._owns(job_id):
+            raise asyncio.CancelledError()
+        if job['dub']:
+            await asyncio.to_thread(self._write_bytes, os.path.join(self.job_dir(job_id), f"chunk_{index:05d}.pcm"),
+                                    bytes(dub_pcm))
+        await asyncio.to_thread(self._write_json, self._chunk_path(job_id, index), records)
+        await quota_manager.charge(
+            job['user_id'], job['owner_is_superuser'],
+            audio_seconds=sum(end - start for start, end in spans),
+            characters_translated=sum(len(text) for text in texts),
+            tts_seconds=sum(r.get("dub_length", 0) for r in records) / (2 * TTS_SAMPLE_RATE))
+
+    def _assemble(self, job: Any, chunk_count: int):
+        """Merges chunk results into segments.json outputs and, for dubbed jobs, one dub.wav."""
+        directory = self.job_dir(job['id'])
+        results = []
+        for index in range(chunk_count):
+            for record in self._read_json(self._chunk_path(job['id'], index)):
+                results.append({**record, "chunk": index})
+        self._write_json(os.path.join(directory, "result.json"),
+                         [{k: v for k, v in r.items() if not k.startswith("dub_") and k != "chunk"} for r in results])
+        if not job['dub']:
+            return
+
+        # Each dubbed line starts at its source timestamp, or right after the previous line if that ran long
+        with wave.open(os.path.join(directory, "dub.wav"), "wb") as out:
+            out.setnchannels(1)
+            out.setsampwidth(2)
+            out.setframerate(TTS_SAMPLE_RATE)
+            written = 0
+            for record in results:
+                if not record.get("dub_length"): continue
+                start_frame = int(record["start"] * TTS_SAMPLE_RATE)
+                if start_frame > written:
+                    out.writeframes(b"\x00\x00" * (start_frame - written))
+                    written = start_frame
+                with open(os.path.join(directory, f"chunk_{record['chunk']:05d}.pcm"), "rb") as pcm:
+                    pcm.seek(record["dub_offset"])
+                    data = pcm.read(record["dub_length"])
+                out.writeframes(data)
+                written += len(data) // 2
+
+audio_job_runner = AudioJobRunner()
 # ==============================================================================
 # VIII. LIFESPAN MANAGEMENT & MIDDLEWARE
 # ==============================================================================
@@ -503,10 +2517,28 @@ async def lifespan(app: FastAPI):
     if not os.path.exists(settings.VOICE_CLONE_SAMPLES_DIR): os.makedirs(settings.VOICE_CLONE_SAMPLES_DIR)
     if not os.path.exists(settings.VOICE_CLONE_MODELS_DIR): os.makedirs(settings.VOICE_CLONE_MODELS_DIR)
 
-    app.state.ai_model_manager = AIModelManager()
-    logger.info("Loading AI Models...")
-    # Load all models at once for simplicity and to ensure they are ready
-    app.state.ai_model_manager.load_all_models()
+    if settings.INFERENCE_MODE == "remote":
+        # Models live in the shared model server process; this worker only holds a client.
+        app.state.inference = RemoteInferenceBackend(settings.MODEL_SERVER_SOCKET)
+        await app.state.inference.connect()
+    else:
+        app.state.ai_model_manager = AIModelManager()
+        logger.info("Loading AI Models...")
+        # Load all models at once for simplicity and to ensure they are ready
+        app.state.ai_model_manager.load_all_models()
+        app.state.inference = LocalInferenceBackend(app.state.ai_model_manager)
+    app.state.live_clone_store = LiveCloneStore(settings.LIVE_CLONE_LATENTS_DIR, settings.LIVE_CLONE_TTL_SECONDS)
+    app.state.live_clone_store.purge_expired()
+
+    await chat_manager.start(create_chat_broker())
+    chat_message_log.start()
+    summarization_engine.start()
+    await history_search_index.start(app.state.inference)
+    usage_recorder.start()
+    await translation_memory.start()
+    audio_job_runner.start(app.state.inference)
+    quota_manager.start(settings.QUOTA_STORE_URL or settings.CHAT_BROKER_URL)
+    quality_controller.start()
 
     app.state.limiter = limiter
     app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
@@ -514,8 +2546,18 @@ async def lifespan(app: FastAPI):
     yield
     # Shutdown
     logger.info("Application shutdown sequence initiated.")
+    await chat_manager.stop()
+    await chat_message_log.stop()
+    await summarization_engine.close()
+    await history_search_index.stop()
+    await usage_recorder.stop()
+    await translation_memory.stop()
+    await audio_job_runner.stop()
+    await quota_manager.close()
+    await quality_controller.stop()
+    await profiler_service.close()
     await database.disconnect()
-    app.state.ai_model_manager.cleanup()
+    await app.state.inference.close()
 
 
 app = FastAPI(title=settings.APP_NAME, version=settings.APP_VERSION, lifespan=lifespan, docs_url="/api/docs",
@@ -694,6 +2736,15 @@ async def update_my_profile(update_data: UserUpdate, user: UserInDB = Depends(ge
     return updated_user_record
 
 
+@user_router.get("/me/quota", response_model=QuotaStatus)
+async def get_my_quota(user: UserInDB = Depends(get_current_active_user)):
+    """The caller's quota tier and remaining cost units."""
+    tier = await quota_manager.tier_for(user.id, user.is_superuser)
+    _, remaining, retry_after = await quota_manager.check(user.id, user.is_superuser)
+    return QuotaStatus(tier=tier, remaining=remaining, retry_after_seconds=retry_after,
+                       capacity=(settings.QUOTA_TIERS.get(tier) or {}).get("capacity"))
+
+
 # --- Translation Router ---
 translation_router = fastapi.APIRouter(prefix="/api/translate", tags=["Translation"])
 
@@ -713,6 +2764,19 @@ class AdvancedTextTranslationResponse(BaseModel):
     source_lang: str
     target_lang: str
     detected_idioms: List[IdiomDetails] = []
+    from_translation_memory: bool = False  # translated_text is a curated translation memory entry
+    tm_suggestions: List[TMSuggestion] = []  # Fuzzy translation memory matches
+
+
+def replace_idioms(text: str) -> tuple:
+    """Returns (text with known Russian idioms swapped for English equivalents, detected IdiomDetails)."""
+    detected: List[IdiomDetails] = []
+    text_lower = text.lower()
+    for idiom, details in RUSSIAN_IDIOMS_DATABASE.items():
+        if idiom in text_lower:
+            detected.append(IdiomDetails(**details, idiom=idiom))
+            text = re.sub(idiom, details['english_equivalent'], text, flags=re.IGNORECASE)
+    return text, detected
 
 
 @translation_router.post("/text", response_model=AdvancedTextTranslationResponse)
@@ -731,30 +2795,33 @@ async def translate_text_advanced(
 
     enable_idiom_replacement = payload.enable_idiom_replacement and source_lang == 'ru' and target_lang == 'en'
 
-    translator = req.app.state.ai_model_manager.get_model(f"translator_{source_lang}_{target_lang}")
-    if not translator:
+    inference: InferenceBackend = req.app.state.inference
+    remembered = translation_memory.exact(source_text, source_lang, target_lang)
+    if not remembered and not inference.has_model(f"translator_{source_lang}_{target_lang}"):
         raise HTTPException(501, "Translation direction not supported.")
+    await quota_manager.require(user, characters_translated=len(source_text))
 
     # --- Step 1: Standard Translation ---
-    # Get the direct, literal translation first.
-    direct_translation_result = translator(text_to_translate)
-    direct_translation = direct_translation_result[0]['translation_text'] if direct_translation_result else ""
+    # A curated translation memory entry wins over the literal machine translation.
+    tm_suggestions: List[TMSuggestion] = []
+    if remembered:
+        direct_translation = remembered
+        enable_idiom_replacement = False
+    else:
+        translated, tm_suggestions = await asyncio.gather(
+            inference.translate([text_to_translate], source_lang, target_lang),
+            asyncio.to_thread(translation_memory.fuzzy, source_text, source_lang, target_lang))
+        direct_translation = translated[0]
 
     detected_idioms: List[IdiomDetails] = []
     text_for_natural_translation = text_to_translate
 
     if enable_idiom_replacement:
-        text_lower = text_to_translate.lower()
-        for idiom, details in RUSSIAN_IDIOMS_DATABASE.items():
-            if idiom in text_lower:
-                detected_idioms.append(IdiomDetails(**details, idiom=idiom))
-                text_for_natural_translation = re.sub(idiom, details['english_equivalent'],
-                                                      text_for_natural_translation, flags=re.IGNORECASE)
+        text_for_natural_translation, detected_idioms = replace_idioms(text_to_translate)
 
     natural_translation = None
     if detected_idioms and enable_idiom_replacement:
-        natural_translation_result = translator(text_for_natural_translation)
-        natural_translation = natural_translation_result[0]['translation_text'] if natural_translation_result else ""
+        natural_translation = (await inference.translate([text_for_natural_translation], source_lang, target_lang))[0]
 
     # Final cleanup of any hint tokens that might have slipped through
     if target_lang == 'ru':
@@ -771,6 +2838,8 @@ async def translate_text_advanced(
             session_id=str(uuid.uuid4())
         )
     )
+    history_search_index.notify(user.id)
+    usage_recorder.record(user.id, characters_translated=len(source_text))
 
     return AdvancedTextTranslationResponse(
         source_text=source_text,
@@ -778,10 +2847,267 @@ async def translate_text_advanced(
         natural_translation=natural_translation,
         source_lang=source_lang,
         target_lang=target_lang,
-        detected_idioms=detected_idioms
+        detected_idioms=detected_idioms,
+        from_translation_memory=bool(remembered),
+        tm_suggestions=tm_suggestions
     )
 
 
+class BatchTranslationItem(BaseModel):
+    id: str = Field(..., min_length=1, max_length=100)  # Echoed back on the item's result line
+    text: str = Field(..., min_length=1, max_length=5000)
+    source_lang: str
+    target_lang: str
+    enable_idiom_replacement: bool = True
+    formality: Optional[str] = Field(None, pattern="^(formal|informal)$")
+
+class BatchTranslationRequest(BaseModel):
+    items: List[BatchTranslationItem] = Field(..., min_length=1)
+
+
+@translation_router.post("/batch")
+async def translate_batch(
+        req: Request,
+        payload: BatchTranslationRequest,
+        user=Depends(get_current_active_user)
+):
+    """
+    Translates many items in one request. Items are grouped by direction and sent to the
+    translators in chunks of INFERENCE_MAX_BATCH_SIZE; results stream back as NDJSON lines
+    ({"id", "translated_text", ...} or {"id", "error"}) in completion order. Only items that
+    were translated (or served from translation memory) are billed, as soon as their chunk
+    is done, so a client that drops the stream still pays for what was translated.
+    """
+    if len(payload.items) > settings.TRANSLATE_BATCH_MAX_ITEMS:
+        raise HTTPException(status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            f"A batch may contain at most {settings.TRANSLATE_BATCH_MAX_ITEMS} items.")
+    await quota_manager.require(user)  # Refuses the batch if the balance is already spent
+    inference: InferenceBackend = req.app.state.inference
+
+    immediate: List[Dict[str, Any]] = []  # Results that need no model call
+    by_direction: Dict[tuple, List[BatchTranslationItem]] = collections.defaultdict(list)
+    for item in payload.items:
+        remembered = translation_memory.exact(item.text, item.source_lang, item.target_lang)
+        if remembered:
+            immediate.append({"id": item.id, "translated_text": remembered, "from_translation_memory": True,
+                              "_item": item})
+        elif not inference.has_model(f"translator_{item.source_lang}_{item.target_lang}"):
+            immediate.append({"id": item.id, "error": "Translation direction not supported."})
+        else:
+            by_direction[(item.source_lang, item.target_lang)].append(item)
+
+    session_id = str(uuid.uuid4())  # Groups the batch in translation_history
+
+    async def record(results: List[Dict[str, Any]]):
+        """Writes history, usage and quota charges for the translated results."""
+        rows = [{"user_id": user.id, "source_language": r["_item"].source_lang,
+                 "target_language": r["_item"].target_lang, "source_text": r["_item"].text,
+                 "translated_text": r.get("natural_translation") or r["translated_text"],
+                 "session_id": session_id, "timestamp": datetime.datetime.utcnow()}
+                for r in results if "_item" in r]
+        if not rows:
+            return
+        try:
+            await database.execute_many(translation_history.insert(), rows)
+            history_search_index.notify(user.id)
+            translated_characters = sum(len(row["source_text"]) for row in rows)
+            usage_recorder.record(user.id, characters_translated=translated_characters)
+            await quota_manager.charge(user.id, user.is_superuser, characters_translated=translated_characters)
+        except Exception as e:
+            logger.error(f"Recording batch translations failed for user {user.id}: {e}", exc_info=True)
+
+    async def translate_chunk(direction: tuple, chunk: List[BatchTranslationItem]) -> List[Dict[str, Any]]:
+        source_lang, target_lang = direction
+        texts, idiom_results = [], []
+        for item in chunk:
+            text = adjust_formality_for_translation(item.text, target_lang, item.formality)
+            texts.append(text)
+            idiom_results.append(replace_idioms(text) if item.enable_idiom_replacement and direction == ('ru', 'en')
+                                 else (text, []))
+        natural_indexes = [i for i, (_, detected) in enumerate(idiom_results) if detected]
+        try:
+            # Idiom-replaced variants ride along in the same translator batch
+            translated = await inference.translate(texts + [idiom_results[i][0] for i in natural_indexes],
+                                                   source_lang, target_lang)
+        except Exception as e:
+            logger.error(f"Batch translation chunk {source_lang}->{target_lang} failed for user {user.id}: {e}",
+                         exc_info=True)
+            return [{"id": item.id, "error": "Translation failed."} for item in chunk]
+        natural = dict(zip(natural_indexes, translated[len(texts):]))
+        results = []
+        for i, item in enumerate(chunk):
+            direct = translated[i]
+            if target_lang == 'ru':
+                direct = direct.replace("(formal)", "").replace("(informal)", "").strip()
+            results.append({"id": item.id, "translated_text": direct, "natural_translation": natural.get(i),
+                            "detected_idioms": [d.model_dump() for d in idiom_results[i][1]], "_item": item})
+        # Shielded: cancelling the chunk (the client dropped the stream) must not lose the charge
+        await asyncio.shield(record(results))
+        return results
+
+    await record(immediate)  # Translation-memory hits are served in full right away
+    chunk_size = settings.INFERENCE_MAX_BATCH_SIZE
+    tasks = [asyncio.ensure_future(translate_chunk(direction, items[start:start + chunk_size]))
+             for direction, items in by_direction.items() for start in range(0, len(items), chunk_size)]
+
+    async def result_lines():
+        def line(result: Dict[str, Any]) -> str:
+            result.pop("_item", None)
+            return json.dumps(result, ensure_ascii=False) + "\n"
+
+        try:
+            for result in immediate:
+                yield line(result)
+            for finished in asyncio.as_completed(tasks):
+                for result in await finished:
+                    yield line(result)
+        finally:
+            for task in tasks: task.cancel()  # Chunks already translated have been recorded
+
+    return StreamingResponse(result_lines(), media_type="application/x-ndjson")
+
+
+# ### DOCUMENT TRANSLATION ###
+SENTENCE_ABBREVIATIONS = {
+    'en': {"mr", "mrs", "ms", "dr", "prof", "sr", "jr", "st", "vs", "etc", "e.g", "i.e", "no", "fig", "inc", "ltd",
+           "co", "corp", "approx", "dept", "est", "jan", "feb", "mar", "apr", "jun", "jul", "aug", "sep", "sept",
+           "oct", "nov", "dec", "u.s", "a.m", "p.m"},
+    'ru': {"т.е", "т.д", "т.п", "т.к", "т.н", "др", "пр", "г", "гг", "ул", "стр", "см", "им", "проф", "акад", "доц",
+           "тыс", "млн", "млрд", "руб", "коп", "рис", "табл", "гл", "п", "пп", "ст", "с", "н.э", "англ",
+           "лат", "напр", "обл", "р-н", "кв", "д", "корп"},
+}
+SENTENCE_BOUNDARY = re.compile(r'([.!?…]+["»”)\]]*)\s+(?=["«“(\[\-–—]?\s*[A-ZА-ЯЁ0-9])')
+
+
+def split_sentences(text: str, lang: str) -> List[str]:
+    """
+    Splits one line of Russian or English prose into sentences. A boundary is terminal
+    punctuation followed by an upper-case or numeric start; known abbreviations and
+    initials (single letters) do not end a sentence.
+    """
+    abbreviations = SENTENCE_ABBREVIATIONS.get(lang, SENTENCE_ABBREVIATIONS['en'] | SENTENCE_ABBREVIATIONS['ru'])
+    sentences, start = [], 0
+    for match in SENTENCE_BOUNDARY.finditer(text):
+        end = match.end(1)
+        last_word = text[start:match.start(1)].rsplit(None, 1)[-1].lower() if text[start:match.start(1)].strip() else ""
+        if match.group(1) == "." and (last_word in abbreviations or (len(last_word) == 1 and last_word.isalpha())):
+            continue
+        sentences.append(text[start:end].strip())
+        start = match.end()
+    if text[start:].strip():
+        sentences.append(text[start:].strip())
+    return [piece for sentence in sentences for piece in split_long_segment(sentence)]
+
+
+def split_long_segment(sentence: str, max_chars: int = 400) -> List[str]:
+    """Marian degrades on very long inputs, so overlong sentences are cut at clause punctuation or spaces."""
+    pieces = []
+    while len(sentence) > max_chars:
+        window = sentence[:max_chars]
+        cut = max(window.rfind("; "), window.rfind(": "), window.rfind(", "))
+        cut = cut + 1 if cut > max_chars // 3 else (window.rfind(" ") if window.rfind(" ") > 0 else max_chars)
+        pieces.append(sentence[:cut].strip())
+        sentence = sentence[cut:].strip()
+    if sentence:
+        pieces.append(sentence)
+    return pieces
+
+
+class DocumentTranslationRequest(BaseModel):
+    text: str = Field(..., min_length=1, max_length=settings.DOCUMENT_MAX_CHARS)
+    source_lang: str
+    target_lang: str
+    enable_idiom_replacement: bool = True
+    formality: Optional[str] = Field(None, pattern="^(formal|informal)$")
+
+
+@translation_router.post("/document")
+async def translate_document(
+        req: Request,
+        payload: DocumentTranslationRequest,
+        user=Depends(get_current_active_user)
+):
+    """
+    Translates a long document sentence by sentence. Paragraphs (blank-line separated)
+    and line breaks are preserved; sentence batches run in parallel and each paragraph is
+    streamed as an NDJSON line ({"index", "text", "detected_idioms"}) as soon as it and
+    all paragraphs before it are translated, followed by {"done": true, "paragraphs": n}.
+    """
+    source_lang, target_lang = payload.source_lang, payload.target_lang
+    inference: InferenceBackend = req.app.state.inference
+    if not inference.has_model(f"translator_{source_lang}_{target_lang}"):
+        raise HTTPException(501, "Translation direction not supported.")
+    await quota_manager.require(user, characters_translated=len(payload.text))
+    replace = payload.enable_idiom_replacement and source_lang == 'ru' and target_lang == 'en'
+
+    # paragraphs -> lines -> sentence indexes into the flat `segments` list
+    paragraphs = [p for p in re.split(r"\n\s*\n", payload.text.replace("\r\n", "\n")) if p.strip()]
+    layout: List[List[List[int]]] = []
+    originals: List[str] = []  # Source sentences, for translation memory lookups
+    segments: List[str] = []  # What the translator sees
+    idioms: Dict[int, List[IdiomDetails]] = collections.defaultdict(list)  # paragraph index -> idioms
+    for p_index, paragraph in enumerate(paragraphs):
+        lines = []
+        for line in paragraph.split("\n"):
+            indexes = []
+            for sentence in split_sentences(line.strip(), source_lang):
+                text = adjust_formality_for_translation(sentence, target_lang, payload.formality)
+                if replace:
+                    text, detected = replace_idioms(text)
+                    idioms[p_index].extend(detected)
+                indexes.append(len(segments))
+                originals.append(sentence)
+                segments.append(text)
+            lines.append(indexes)
+        layout.append(lines)
+
+    async def translate_batch_of_segments(start: int) -> List[str]:
+        results = [translation_memory.exact(text, source_lang, target_lang)
+                   for text in originals[start:start + batch_size]]
+        misses = [i for i, result in enumerate(results) if result is None]
+        translated = (await inference.translate([segments[start + i] for i in misses], source_lang, target_lang)
+                      if misses else [])
+        for i, text in zip(misses, translated):
+            results[i] = text
+        if target_lang == 'ru':
+            results = [r.replace("(formal)", "").replace("(informal)", "").strip() for r in results]
+        return results
+
+    batch_size = settings.INFERENCE_MAX_BATCH_SIZE
+
+    async def paragraph_lines():
+        translated: List[Optional[str]] = [None] * len(segments)
+        starts = iter(range(0, len(segments), batch_size))
+        inflight: collections.deque = collections.deque()
+        next_paragraph = 0
+        try:
+            while True:
+                # Keep a bounded window of batches in flight; results are consumed in document order
+                while len(inflight) < settings.DOCUMENT_MAX_PARALLEL_BATCHES:
+                    start = next(starts, None)
+                    if start is None: break
+                    inflight.append((start, asyncio.ensure_future(translate_batch_of_segments(start))))
+                if not inflight: break
+                start, task = inflight.popleft()
+                translated[start:start + batch_size] = await task
+                while next_paragraph < len(layout) and all(
+                        translated[i] is not None for line in layout[next_paragraph] for i in line):
+                    text = "\n".join(" ".join(translated[i] for i in line) for line in layout[next_paragraph])
+                    yield json.dumps({"index": next_paragraph, "text": text,
+                                      "detected_idioms": [d.model_dump() for d in idioms.get(next_paragraph, [])]},
+                                     ensure_ascii=False) + "\n"
+                    next_paragraph += 1
+            yield json.dumps({"done": True, "paragraphs": len(layout)}) + "\n"
+        except Exception as e:
+            logger.error(f"Document translation failed for user {user.id}: {e}", exc_info=True)
+            yield json.dumps({"error": "Translation failed.", "index": next_paragraph}) + "\n"
+        finally:
+            for _, task in inflight: task.cancel()
+            usage_recorder.record(user.id, characters_translated=len(payload.text))
+
+    return StreamingResponse(paragraph_lines(), media_type="application/x-ndjson")
+
+
 # --- Voice Cloning Router ---
 voice_clone_router = fastapi.APIRouter(prefix="/api/voice-clone", tags=["Voice Cloning"],
                                        dependencies=[Depends(get_current_active_user)])
@@ -798,25 +3124,64 @@ async def upload_voice_sample(
     if not file.content_type or not file.content_type.startswith("audio/"):
         raise HTTPException(status.HTTP_400_BAD_REQUEST, "Invalid file type. Please upload an audio file.")
 
-    # Sanitize file name and create unique paths
-    safe_filename = re.sub(r'[^a-zA-Z0-9_.-]', '_', file.filename)
+    # The raw upload is only kept until it has been normalized into the reference WAV
     file_id = str(uuid.uuid4())
-    file_extension = os.path.splitext(safe_filename)[1] or '.wav'
-    save_path = os.path.join(settings.VOICE_CLONE_SAMPLES_DIR, f"user_{user.id}_{file_id}{file_extension}")
+    raw_path = os.path.join(settings.VOICE_CLONE_SAMPLES_DIR, f"user_{user.id}_{file_id}.upload")
+    save_path = os.path.join(settings.VOICE_CLONE_SAMPLES_DIR, f"user_{user.id}_{file_id}.wav")
     model_save_path = os.path.join(settings.VOICE_CLONE_MODELS_DIR, f"user_{user.id}_{file_id}_latents.pth")
 
+    started = time.perf_counter()
+    written = 0
     try:
-        with open(save_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        with open(raw_path, "wb") as buffer:
+            while chunk := await file.read(settings.VOICE_SAMPLE_CHUNK_BYTES):
+                written += len(chunk)
+                if written > settings.VOICE_SAMPLE_MAX_BYTES:
+                    raise HTTPException(status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                                        f"Voice samples are limited to {settings.VOICE_SAMPLE_MAX_BYTES // (1024 * 1024)} MB.")
+                await asyncio.to_thread(buffer.write, chunk)
+        received = time.perf_counter()
+        reference_seconds, content_hash = await audio_job_runner.run_in_pool(
+            prepare_voice_sample, raw_path, save_path, settings.VOICE_SAMPLE_MIN_SECONDS,
+            settings.VOICE_SAMPLE_MAX_SECONDS, settings.VOICE_SAMPLE_TARGET_DBFS)
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, str(e))
     except Exception as e:
-        logger.error(f"Failed to save uploaded file for user {user.id}: {e}")
-        raise HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR, "Could not save uploaded file.")
+        logger.error(f"Failed to ingest voice sample for user {user.id}: {e}")
+        if os.path.exists(save_path): os.remove(save_path)
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, "Could not read the uploaded audio.")
+    finally:
+        if os.path.exists(raw_path): os.remove(raw_path)
+    finished = time.perf_counter()
+    voice_ingest_stats.record(written, received - started, finished - received)
+    logger.info(f"Ingested voice sample for user {user.id}: {written / 1e6:.1f} MB received in "
+                f"{received - started:.2f}s ({written / 1e6 / max(received - started, 1e-6):.1f} MB/s), "
+                f"{reference_seconds:.1f}s of speech normalized in {finished - received:.2f}s")
+
+    # Identical audio (after normalization) reuses the latents trained from it before
+    known = await database.fetch_one(voice_latents.select().where(
+        voice_latents.c.user_id == user.id, voice_latents.c.content_hash == content_hash))
+    if known and os.path.exists(known['model_path']):
+        os.remove(save_path)
+        voice_ingest_stats.reused += 1
+        clone_id = await database.execute(voice_clones.insert().values(
+            user_id=user.id, clone_name=name, status="completed", model_path=known['model_path'],
+            source_audio_path=known['source_audio_path']))
+        return await database.fetch_one(voice_clones.select().where(voice_clones.c.id == clone_id))
 
+    try:
+        await quota_manager.require(user, clones_trained=1)
+    except HTTPException:
+        os.remove(save_path)
+        raise
     clone_id = await database.execute(
         voice_clones.insert().values(user_id=user.id, clone_name=name, source_audio_path=save_path))
 
     # Run the actual training task in the background
-    background_tasks.add_task(run_true_voice_training_task, clone_id, save_path, model_save_path)
+    background_tasks.add_task(run_true_voice_training_task, clone_id, user.id, save_path, model_save_path,
+                              content_hash, reference_seconds)
 
     new_clone = await database.fetch_one(voice_clones.select().where(voice_clones.c.id == clone_id))
     return new_clone
@@ -834,13 +3199,17 @@ async def delete_voice_clone(clone_id: int, user: UserInDB = Depends(get_current
     if not clone or clone['user_id'] != user.id:
         raise HTTPException(status.HTTP_404_NOT_FOUND, "Voice clone not found.")
 
-    # Clean up files from the filesystem
-    if clone['source_audio_path'] and os.path.exists(clone['source_audio_path']):
-        os.remove(clone['source_audio_path'])
-    if clone['model_path'] and os.path.exists(clone['model_path']):
-        os.remove(clone['model_path'])
-
     await database.execute(voice_clones.delete().where(voice_clones.c.id == clone_id))
+
+    # Clean up files from the filesystem, unless another clone reuses them (see voice_latents)
+    for column in ("source_audio_path", "model_path"):
+        path = clone[column]
+        if not path or await database.fetch_val(sqlalchemy.select(sqlalchemy.func.count()).select_from(
+                voice_clones).where(voice_clones.c[column] == path)):
+            continue
+        await database.execute(voice_latents.delete().where(voice_latents.c[column] == path))
+        if os.path.exists(path):
+            os.remove(path)
     return
 
 
@@ -867,31 +3236,31 @@ async def preview_voice_clone(
     if clone['status'] != 'completed' or not clone['model_path']:
         raise HTTPException(status.HTTP_400_BAD_REQUEST, "Voice clone is not ready for preview.")
 
-    xtts_model = req.app.state.ai_model_manager.get_model('xtts')
-    if not xtts_model:
+    inference: InferenceBackend = req.app.state.inference
+    if not inference.has_model('xtts'):
         raise HTTPException(status.HTTP_503_SERVICE_UNAVAILABLE, "TTS service is not available.")
+    await quota_manager.require(user, tts_seconds=len(payload.text) / 15)  # ~15 characters of speech per second
 
     try:
-        latents = torch.load(clone['model_path'], map_location=xtts_model.device)
-        gpt_cond_latent = latents['gpt_cond_latent']
-        speaker_embedding = latents['speaker_embedding']
-
         # NEW: Get emotion parameters from the helper function
         emotion_params = get_emotion_params(payload.emotion)
         logger.info(f"Generating preview for clone {clone_id} with emotion '{payload.emotion}': {emotion_params}")
 
-
-        tts_chunks = xtts_model.tts_stream(
-            text=payload.text,
-            language=payload.language,
-            gpt_cond_latent=gpt_cond_latent,
-            speaker_embedding=speaker_embedding,
-            **emotion_params # Unpack the emotion settings here
+        tts_chunks = inference.synthesize_stream(
+            payload.text,
+            payload.language,
+            emotion_params, # Unpack the emotion settings here
+            latents_path=clone['model_path']
         )
 
         async def audio_stream_generator():
-            for chunk in tts_chunks:
-                yield chunk.cpu().numpy().tobytes()
+            produced = 0
+            try:
+                async for chunk in tts_chunks:
+                    produced += len(chunk)
+                    yield chunk
+            finally:
+                usage_recorder.record(user.id, tts_seconds=produced / (2 * TTS_SAMPLE_RATE))
 
         return StreamingResponse(audio_stream_generator(), media_type="audio/wav")
 
@@ -899,12 +3268,214 @@ async def preview_voice_clone(
         logger.error(f"Failed to generate voice preview for clone {clone_id}: {e}", exc_info=True)
         raise HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR, "Failed to generate audio preview.")
 
+# --- History Listing Helpers ---
+def history_filters(
+    source_lang: Optional[str] = Query(None, max_length=10),
+    target_lang: Optional[str] = Query(None, max_length=10),
+    session_id: Optional[str] = Query(None, max_length=255),
+    since: Optional[datetime.datetime] = Query(None, description="Only entries at or after this time"),
+    until: Optional[datetime.datetime] = Query(None, description="Only entries before this time"),
+) -> Dict[str, Any]:
+    return {"source_lang": source_lang, "target_lang": target_lang, "session_id": session_id,
+            "since": since, "until": until}
+
+
+def history_query(user_id: int, filters: Dict[str, Any]):
+    """translation_history rows of one user, newest first, served by ix_translation_history_user_id_timestamp."""
+    c = translation_history.c
+    query = translation_history.select().where(c.user_id == user_id)
+    if filters["source_lang"]: query = query.where(c.source_language == filters["source_lang"])
+    if filters["target_lang"]: query = query.where(c.target_language == filters["target_lang"])
+    if filters["session_id"]: query = query.where(c.session_id == filters["session_id"])
+    if filters["since"]: query = query.where(c.timestamp >= filters["since"])
+    if filters["until"]: query = query.where(c.timestamp < filters["until"])
+    return query.order_by(c.timestamp.desc(), c.id.desc())
+
+
+async def fetch_history_page(user_id: int, filters: Dict[str, Any], cursor: Optional[str], limit: int) -> HistoryPage:
+    """Keyset page over (timestamp, id); the cursor is '<iso timestamp>|<id>' of the last entry returned."""
+    query = history_query(user_id, filters)
+    if cursor:
+        try:
+            cursor_ts, cursor_id = cursor.rsplit("|", 1)
+            cursor_ts, cursor_id = datetime.datetime.fromisoformat(cursor_ts), int(cursor_id)
+        except ValueError:
+            raise HTTPException(status.HTTP_400_BAD_REQUEST, "Invalid history cursor.")
+        c = translation_history.c
+        query = query.where(sqlalchemy.or_(c.timestamp < cursor_ts,
+                                           sqlalchemy.and_(c.timestamp == cursor_ts, c.id < cursor_id)))
+    rows = await database.fetch_all(query.limit(limit))
+    next_cursor = f"{rows[-1]['timestamp'].isoformat()}|{rows[-1]['id']}" if len(rows) == limit else None
+    return HistoryPage(entries=[HistoryEntry(**dict(row)) for row in rows], next_cursor=next_cursor)
+
+
+HISTORY_EXPORT_FIELDS = ["id", "timestamp", "session_id", "source_language", "target_language",
+                         "source_text", "translated_text"]
+
+
+def stream_history_export(user_id: int, filters: Dict[str, Any], export_format: str) -> StreamingResponse:
+    """Streams matching history as NDJSON or CSV straight off the database cursor."""
+    query = history_query(user_id, filters)
+
+    async def ndjson_lines():
+        async for row in database.iterate(query):
+            yield json.dumps({field: row[field] for field in HISTORY_EXPORT_FIELDS}, default=str,
+                             ensure_ascii=False) + "\n"
+
+    async def csv_lines():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(HISTORY_EXPORT_FIELDS)
+        async for row in database.iterate(query):
+            writer.writerow([row[field] for field in HISTORY_EXPORT_FIELDS])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+
+    filename = f"translation_history_{user_id}.{'csv' if export_format == 'csv' else 'ndjson'}"
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+    if export_format == "csv":
+        return StreamingResponse(csv_lines(), media_type="text/csv; charset=utf-8", headers=headers)
+    return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson", headers=headers)
+
+
 # --- Admin Router ---
 admin_router = fastapi.APIRouter(prefix="/api/admin", tags=["Admin"], dependencies=[Depends(get_superuser)])
 
 
-@admin_router.get("/users", response_model=List[UserInDB])
-async def list_users(): return await database.fetch_all(users.select())
+@admin_router.get("/users", response_model=UserPage)
+async def list_users(
+    after_id: Optional[int] = Query(None, description="Cursor from a previous page's next_cursor"),
+    limit: int = Query(100, ge=1, le=500),
+    is_active: Optional[bool] = None,
+    email: Optional[str] = Query(None, max_length=255, description="Case-insensitive email substring"),
+):
+    """Keyset-paginated user listing in id order."""
+    query = users.select()
+    if after_id is not None: query = query.where(users.c.id > after_id)
+    if is_active is not None: query = query.where(users.c.is_active == is_active)
+    if email: query = query.where(users.c.email.ilike(f"%{email}%"))
+    rows = await database.fetch_all(query.order_by(users.c.id).limit(limit))
+    return UserPage(users=[UserInDB(**dict(row)) for row in rows], next_cursor=rows[-1]['id'] if len(rows) == limit else None)
+
+
+@admin_router.get("/users/{user_id}/history", response_model=HistoryPage)
+async def get_user_history_by_admin(
+    user_id: int,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=500),
+    filters: Dict[str, Any] = Depends(history_filters),
+):
+    return await fetch_history_page(user_id, filters, cursor, limit)
+
+
+@admin_router.get("/users/{user_id}/history/export")
+async def export_user_history_by_admin(
+    user_id: int,
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    filters: Dict[str, Any] = Depends(history_filters),
+):
+    return stream_history_export(user_id, filters, format)
+
+
+@admin_router.get("/voice/metrics")
+async def voice_session_metrics():
+    """Admission, inference-scheduling, quality-tier and voice-sample ingest counters on this worker."""
+    return {"admission": admission_controller.stats(),
+            "ingest": voice_ingest_stats.snapshot(),
+            "quality": quality_controller.stats(),
+            "scheduler": {"slots": inference_scheduler.slots, "in_use": inference_scheduler.in_use,
+                          "queue_depth": inference_scheduler.queue_depth}}
+
+
+@admin_router.post("/profiling/captures", response_model=ProfileCaptureResponse, status_code=status.HTTP_202_ACCEPTED)
+async def start_profile_capture(request: ProfileCaptureRequest):
+    """Profiles this worker for `seconds` (or until stopped); download the result when completed."""
+    return profiler_service.start(request.mode, request.seconds)
+
+
+@admin_router.get("/profiling/captures", response_model=List[ProfileCaptureResponse])
+async def list_profile_captures():
+    return list(reversed(profiler_service.captures.values()))
+
+
+@admin_router.post("/profiling/captures/{capture_id}/stop", response_model=ProfileCaptureResponse)
+async def stop_profile_capture(capture_id: str):
+    if capture_id not in profiler_service.captures:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "Profile capture not found.")
+    profiler_service.stop(capture_id)
+    return profiler_service.captures[capture_id]
+
+
+@admin_router.get("/profiling/captures/{capture_id}/download")
+async def download_profile_capture(capture_id: str):
+    """cProfile captures download as pstats files (.prof), sampling captures as folded stacks."""
+    capture = profiler_service.captures.get(capture_id)
+    if not capture:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "Profile capture not found.")
+    if capture["status"] != "completed":
+        raise HTTPException(status.HTTP_409_CONFLICT, f"Profile capture is {capture['status']}.")
+    return FileResponse(capture["path"], filename=os.path.basename(capture["path"]),
+                        media_type="application/octet-stream")
+
+
+@admin_router.get("/traces/{session_id}")
+async def get_session_traces(session_id: str):
+    """Recent per-utterance stage timings of a live session that enabled tracing."""
+    return {"session_id": session_id, "traces": utterance_traces.get(session_id)}
+
+
+@admin_router.put("/users/{user_id}/quota-tier", response_model=QuotaTierUpdate)
+async def set_user_quota_tier(user_id: int, update: QuotaTierUpdate):
+    """Overrides a user's quota tier (one of QUOTA_TIERS)."""
+    if update.tier not in settings.QUOTA_TIERS:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, f"Unknown tier. Choose from: {sorted(settings.QUOTA_TIERS)}")
+    async with database.transaction():
+        await database.execute(user_quota_tiers.delete().where(user_quota_tiers.c.user_id == user_id))
+        await database.execute(user_quota_tiers.insert().values(user_id=user_id, tier=update.tier))
+    quota_manager.forget_tier(user_id)
+    return update
+
+
+@admin_router.get("/usage/totals", response_model=UsageRollup)
+async def usage_totals_rollup(user_id: int = Query(0, description="0 for all users")):
+    """All-time usage totals from the rollup table."""
+    row = await database.fetch_one(usage_totals.select().where(usage_totals.c.user_id == user_id))
+    return UsageRollup(**dict(row)) if row else UsageRollup(user_id=user_id)
+
+
+@admin_router.get("/usage/top", response_model=List[UsageRollup])
+async def usage_top_users(
+    metric: str = Query("characters_translated", pattern=f"^({'|'.join(USAGE_METRICS)})$"),
+    limit: int = Query(10, ge=1, le=100)
+):
+    """Top users by an all-time usage metric, read off the metric's index."""
+    rows = await database.fetch_all(usage_totals.select().where(usage_totals.c.user_id != 0)
+                                    .order_by(usage_totals.c[metric].desc()).limit(limit))
+    return [UsageRollup(**dict(row)) for row in rows]
+
+
+@admin_router.get("/usage/daily", response_model=List[UsageRollup])
+async def usage_daily_rollups(
+    since: datetime.date = Query(..., description="First day (UTC), inclusive"),
+    until: Optional[datetime.date] = Query(None, description="Last day (UTC), inclusive"),
+    user_id: int = Query(0, description="0 for all users")
+):
+    """Per-day usage for one user (or everyone) over at most a year."""
+    until = until or datetime.datetime.utcnow().date()
+    if (until - since).days > 366:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, "Date range may span at most one year.")
+    rows = await database.fetch_all(usage_daily.select().where(
+        usage_daily.c.user_id == user_id, usage_daily.c.day >= since, usage_daily.c.day <= until)
+        .order_by(usage_daily.c.day))
+    return [UsageRollup(**dict(row)) for row in rows]
+
+
+@admin_router.get("/chat/metrics")
+async def chat_metrics():
+    """Room, connection and fan-out latency counters for this node."""
+    return chat_manager.stats()
 
 
 @admin_router.put("/users/{user_id}", response_model=UserInDB)
@@ -917,19 +3488,40 @@ conversation_router = fastapi.APIRouter(prefix="/api/conversation", tags=["Conve
 @conversation_router.post("/summarize", response_model=SummarizationResponse)
 async def summarize_conversation(
     payload: SummarizationRequest,
+    req: Request,
     user: UserInDB = Depends(get_current_active_user)
 ):
     if not payload.conversation:
         raise HTTPException(status.HTTP_400_BAD_REQUEST, "Cannot summarize an empty conversation.")
 
+    inference: InferenceBackend = req.app.state.inference
+    mode = payload.mode or settings.SUMMARY_MODE
+    if mode != "llm" and not inference.has_model('sentence_encoder'):
+        mode = "llm"  # Extractive summarization needs the local sentence encoder
     try:
         full_transcript = format_transcript_for_llm(payload.conversation, payload.source_lang, payload.target_lang)
-        llm_result = await generate_summary_with_llm(full_transcript)
+        if mode == "llm":
+            llm_result = await summarization_engine.summarize(full_transcript)
+        elif mode == "auto" and summarization_engine.available:
+            # Shielded so a slow LLM answer still lands in the summary cache for the next request
+            llm_task = asyncio.ensure_future(summarization_engine.summarize_or_raise(full_transcript))
+            try:
+                llm_result = await asyncio.wait_for(asyncio.shield(llm_task), settings.SUMMARY_LLM_DEADLINE_SECONDS)
+                mode = "llm"
+            except Exception as e:
+                logger.warning(f"LLM summarization unavailable ({type(e).__name__}), using extractive summary.")
+                llm_task.add_done_callback(lambda t: t.cancelled() or t.exception())
+                llm_result = await extractive_summarizer.summarize(payload.conversation, inference)
+                mode = "extractive"
+        else:
+            llm_result = await extractive_summarizer.summarize(payload.conversation, inference)
+            mode = "extractive"
 
         return SummarizationResponse(
             summary=llm_result.get("summary", "Could not generate summary."),
             action_items=llm_result.get("action_items", []),
-            full_transcript=full_transcript
+            full_transcript=full_transcript,
+            mode=mode
         )
     except Exception as e:
         logger.error(f"Summarization failed for user {user.id}: {e}", exc_info=True)
@@ -939,13 +3531,241 @@ async def summarize_conversation(
 chat_router = fastapi.APIRouter(prefix="/api/chat", tags=["Chat"], dependencies=[Depends(get_current_active_user)])
 
 @chat_router.post("/create", response_model=ChatSessionCreateResponse)
-async def create_chat_session():
-    """Generates a new unique ID for a chat session."""
+async def create_chat_session(user: UserInDB = Depends(get_current_active_user)):
+    """Registers a new chat session that expires after CHAT_ROOM_TTL_SECONDS."""
+    now = datetime.datetime.utcnow()
+    open_rooms = await database.fetch_val(
+        sqlalchemy.select(sqlalchemy.func.count()).select_from(chat_sessions)
+        .where(chat_sessions.c.created_by == user.id, chat_sessions.c.expires_at > now))
+    if open_rooms >= settings.CHAT_MAX_ROOMS_PER_USER:
+        raise HTTPException(status.HTTP_429_TOO_MANY_REQUESTS,
+                            f"You can have at most {settings.CHAT_MAX_ROOMS_PER_USER} open chat sessions.")
+
     session_id = str(uuid4())
-    # In a production system, you might save this to a DB with an expiry time
+    await database.execute(chat_sessions.insert().values(
+        id=session_id, created_by=user.id, created_at=now, last_activity_at=now,
+        expires_at=now + datetime.timedelta(seconds=settings.CHAT_ROOM_TTL_SECONDS)))
+    chat_manager.counters["rooms_created"] += 1
     return ChatSessionCreateResponse(session_id=session_id)
 
 
+@chat_router.get("/{session_id}/messages", response_model=ChatHistoryResponse)
+async def get_chat_history(
+    session_id: str,
+    before_id: Optional[int] = Query(None, description="Cursor from a previous page's next_cursor"),
+    limit: int = Query(50, ge=1, le=200),
+    lang: Optional[str] = Query(None, max_length=10),
+    user: UserInDB = Depends(get_current_active_user)
+):
+    """Keyset-paginated chat history, newest page first, in the requested language when it was translated."""
+    user_prefs = json.loads(user.preferences) if isinstance(user.preferences, str) else user.preferences
+    rows = await chat_message_log.fetch_page(session_id, before_id, limit)
+    next_cursor = rows[-1]['id'] if len(rows) == limit else None
+    reader_lang = lang or user_prefs.get('interface_language', 'ru')
+    return ChatHistoryResponse(messages=[chat_message_for_language(row, reader_lang) for row in reversed(rows)],
+                               next_cursor=next_cursor)
+
+
+@chat_router.get("/{session_id}/participants", response_model=List[str])
+async def list_chat_participants(session_id: str):
+    """Returns the users currently connected to a chat session, on any node."""
+    return sorted(await chat_manager.participants(session_id))
+
+
+history_router = fastapi.APIRouter(prefix="/api/history", tags=["History"], dependencies=[Depends(get_current_active_user)])
+
+
+@history_router.get("", response_model=HistoryPage)
+async def list_history(
+    cursor: Optional[str] = Query(None, description="Cursor from a previous page's next_cursor"),
+    limit: int = Query(50, ge=1, le=200),
+    filters: Dict[str, Any] = Depends(history_filters),
+    user: UserInDB = Depends(get_current_active_user)
+):
+    """The caller's translation history, newest first, keyset-paginated."""
+    return await fetch_history_page(user.id, filters, cursor, limit)
+
+
+@history_router.get("/export")
+async def export_history(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    filters: Dict[str, Any] = Depends(history_filters),
+    user: UserInDB = Depends(get_current_active_user)
+):
+    """Streams the caller's (filtered) translation history as NDJSON or CSV."""
+    return stream_history_export(user.id, filters, format)
+
+
+@history_router.get("/search", response_model=List[HistoryEntry])
+async def search_history(
+    q: str = Query(..., min_length=1, max_length=500),
+    mode: str = Query("semantic", pattern="^(semantic|keyword)$"),
+    limit: int = Query(20, ge=1, le=100),
+    user: UserInDB = Depends(get_current_active_user)
+):
+    """Searches the caller's translation history by meaning (embedding index) or by substring."""
+    if mode == "keyword":
+        pattern = f"%{q}%"
+        rows = await database.fetch_all(
+            translation_history.select()
+            .where(translation_history.c.user_id == user.id,
+                   sqlalchemy.or_(translation_history.c.source_text.ilike(pattern),
+                                  translation_history.c.translated_text.ilike(pattern)))
+            .order_by(translation_history.c.id.desc()).limit(limit))
+        return [HistoryEntry(**dict(row)) for row in rows]
+
+    if not history_search_index.available:
+        raise HTTPException(status.HTTP_501_NOT_IMPLEMENTED, "Semantic search is not available.")
+    matches = await history_search_index.search(user.id, q, limit)
+    if not matches:
+        return []
+    rows = await database.fetch_all(translation_history.select().where(
+        translation_history.c.user_id == user.id, translation_history.c.id.in_([row_id for row_id, _ in matches])))
+    rows_by_id = {row['id']: row for row in rows}
+    return [HistoryEntry(**dict(rows_by_id[row_id]), score=score) for row_id, score in matches if row_id in rows_by_id]
+
+
+tm_router = fastapi.APIRouter(prefix="/api/tm", tags=["Translation Memory"], dependencies=[Depends(get_current_active_user)])
+
+
+@tm_router.get("/lookup", response_model=TMLookupResponse)
+async def lookup_translation_memory(
+    text: str = Query(..., min_length=1, max_length=5000),
+    source_lang: str = Query(..., max_length=10),
+    target_lang: str = Query(..., max_length=10)
+):
+    """Exact translation memory hit and fuzzy suggestions for a text."""
+    return TMLookupResponse(exact=translation_memory.exact(text, source_lang, target_lang),
+                            suggestions=await asyncio.to_thread(translation_memory.fuzzy, text, source_lang,
+                                                                target_lang))
+
+
+@tm_router.post("/import", dependencies=[Depends(get_superuser)])
+async def import_translation_memory(file: UploadFile = File(...), user: UserInDB = Depends(get_current_active_user)):
+    """Imports the translation units of a TMX file. Superusers only."""
+    data = await file.read(settings.TM_MAX_IMPORT_BYTES + 1)
+    if len(data) > settings.TM_MAX_IMPORT_BYTES:
+        raise HTTPException(status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, "TMX file is too large.")
+    try:
+        segments = await asyncio.to_thread(parse_tmx, data)
+    except ElementTree.ParseError as e:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, f"Invalid TMX: {e}")
+    imported = await translation_memory.add_segments(segments, user.id)
+    logger.info(f"User {user.id} imported {imported} translation memory segments from '{file.filename}'")
+    return {"imported": imported}
+
+
+@tm_router.get("/export")
+async def export_translation_memory(
+    source_lang: str = Query(..., max_length=10),
+    target_lang: str = Query(..., max_length=10)
+):
+    """Streams one direction of the translation memory as TMX 1.4."""
+    query = tm_segments.select().where(tm_segments.c.source_lang == source_lang,
+                                       tm_segments.c.target_lang == target_lang).order_by(tm_segments.c.id)
+
+    async def tmx_lines():
+        yield ('<?xml version="1.0" encoding="UTF-8"?>\n<tmx version="1.4">\n'
+               f'<header creationtool="{settings.APP_NAME}" creationtoolversion="{settings.APP_VERSION}" '
+               f'segtype="sentence" o-tmf="volkovoice" adminlang="en" srclang="{xml_escape(source_lang)}" '
+               'datatype="plaintext"/>\n<body>\n')
+        async for row in database.iterate(query):
+            yield (f'<tu><tuv xml:lang="{xml_escape(source_lang)}"><seg>{xml_escape(row["source_text"])}</seg></tuv>'
+                   f'<tuv xml:lang="{xml_escape(target_lang)}"><seg>{xml_escape(row["target_text"])}</seg></tuv></tu>\n')
+        yield "</body>\n</tmx>\n"
+
+    headers = {"Content-Disposition": f'attachment; filename="tm_{source_lang}_{target_lang}.tmx"'}
+    return StreamingResponse(tmx_lines(), media_type="application/x-tmx+xml", headers=headers)
+
+
+audio_job_router = fastapi.APIRouter(prefix="/api/audio-jobs", tags=["Audio Jobs"], dependencies=[Depends(get_current_active_user)])
+
+
+@audio_job_router.post("", response_model=AudioJobResponse, status_code=status.HTTP_202_ACCEPTED)
+async def create_audio_job(
+    file: UploadFile = File(...),
+    source_lang: str = Form("ru", max_length=10),
+    target_lang: str = Form("en", max_length=10),
+    dub: bool = Form(False),
+    voice_clone_id: Optional[int] = Form(None),
+    emotion: str = Form("neutral"),
+    user: UserInDB = Depends(get_current_active_user)
+):
+    """Uploads a recording for offline transcription, translation and optional dubbing."""
+    await quota_manager.require(user)  # Billed per processed chunk; needs a positive balance to start
+    job_id = str(uuid4())
+    directory = AudioJobRunner.job_dir(job_id)
+    os.makedirs(directory)
+    extension = os.path.splitext(re.sub(r'[^a-zA-Z0-9_.-]', '_', file.filename or ""))[1] or ".wav"
+    source_path = os.path.join(directory, f"source{extension}")
+    size = 0
+    try:
+        with open(source_path, "wb") as out:
+            while chunk := await file.read(1024 * 1024):
+                size += len(chunk)
+                if size > settings.AUDIO_JOB_MAX_UPLOAD_BYTES:
+                    raise HTTPException(status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, "Recording is too large.")
+                await asyncio.to_thread(out.write, chunk)
+    except BaseException:
+        shutil.rmtree(directory, ignore_errors=True)
+        raise
+
+    now = datetime.datetime.utcnow()
+    await database.execute(audio_jobs.insert().values(
+        id=job_id, user_id=user.id, status="queued", host=settings.NODE_HOST, source_path=source_path,
+        source_lang=source_lang, target_lang=target_lang, dub=dub, voice_clone_id=voice_clone_id, emotion=emotion,
+        created_at=now, updated_at=now))
+    audio_job_runner.submit()
+    return await database.fetch_one(audio_jobs.select().where(audio_jobs.c.id == job_id))
+
+
+@audio_job_router.get("", response_model=List[AudioJobResponse])
+async def list_audio_jobs(user: UserInDB = Depends(get_current_active_user)):
+    return await database.fetch_all(audio_jobs.select().where(audio_jobs.c.user_id == user.id)
+                                    .order_by(audio_jobs.c.created_at.desc()).limit(50))
+
+
+async def get_own_audio_job(job_id: str, user: UserInDB = Depends(get_current_active_user)) -> Any:
+    job = await database.fetch_one(audio_jobs.select().where(audio_jobs.c.id == job_id))
+    if not job or job['user_id'] != user.id:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "Audio job not found.")
+    return job
+
+
+@audio_job_router.get("/{job_id}", response_model=AudioJobResponse)
+async def get_audio_job(job: Any = Depends(get_own_audio_job)):
+    return job
+
+
+@audio_job_router.get("/{job_id}/transcript")
+async def get_audio_job_transcript(
+    format: str = Query("json", pattern="^(json|srt|vtt)$"),
+    track: str = Query("translation", pattern="^(translation|source)$"),
+    job: Any = Depends(get_own_audio_job)
+):
+    """
+    Timestamped segments as JSON, or one track as SRT/WebVTT subtitles. Speaker labels are
+    per ~AUDIO_JOB_CHUNK_SECONDS chunk ("chunk3/SPEAKER_01"), not matched across chunks.
+    """
+    result_path = os.path.join(AudioJobRunner.job_dir(job['id']), "result.json")
+    if job['status'] != "completed" or not os.path.exists(result_path):
+        raise HTTPException(status.HTTP_409_CONFLICT, "Audio job is not completed yet.")
+    segments = await asyncio.to_thread(AudioJobRunner._read_json, result_path)
+    if format == "json":
+        return segments
+    subtitles = render_subtitles(segments, "text" if track == "source" else "translation", format)
+    media_type = "application/x-subrip" if format == "srt" else "text/vtt"
+    return StreamingResponse(iter([subtitles]), media_type=f"{media_type}; charset=utf-8",
+                             headers={"Content-Disposition": f'attachment; filename="{job["id"]}.{format}"'})
+
+
+@audio_job_router.get("/{job_id}/dub")
+async def get_audio_job_dub(job: Any = Depends(get_own_audio_job)):
+    dub_path = os.path.join(AudioJobRunner.job_dir(job['id']), "dub.wav")
+    if job['status'] != "completed" or not os.path.exists(dub_path):
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "No dubbed audio for this job.")
+    return FileResponse(dub_path, media_type="audio/wav", filename=f"{job['id']}_dub.wav")
+
 
 # --- Include Routers ---
 app.include_router(system_router)
@@ -955,273 +3775,1165 @@ app.include_router(voice_clone_router)
 app.include_router(admin_router)
 app.include_router(conversation_router)
 app.include_router(chat_router)
+app.include_router(history_router)
+app.include_router(tm_router)
+app.include_router(audio_job_router)
 
 
 # ==============================================================================
 # XI. REAL-TIME TRANSLATION (WEBSOCKETS)
 # ==============================================================================
-class ConnectionManager:
-    def __init__(self): self.active_connections: Dict[int, WebSocket] = {}
+# ### /ws/translate WIRE PROTOCOLS ###
+# 'json' (default, legacy clients): JSON text frames for control/text, bare binary frames for PCM.
+# 'vv.bin.1': every frame in both directions is a binary envelope
+#   !BBHIII = version, message type, flags, utterance id, sequence number, payload length
+# followed by the payload (raw PCM for 'audio', compact UTF-8 JSON of `data` otherwise).
+# Clients opt in with Sec-WebSocket-Protocol: vv.bin.1 or ?protocol=vv.bin.1.
+# Sequencing (for ?resume=&last_seq=): under vv.bin.1 every frame has a seq. Under 'json' only text
+# frames do (as "seq"); bare audio frames belong to the preceding text frame, are replayed along with
+# it when that frame was missed, and audio after the client's last seen text frame is not replayed.
+# A client close with code 1000/1001 ends the session at once; after any other disconnect the session
+# stays resumable for VOICE_RESUME_GRACE_SECONDS.
+WS_PROTOCOL_JSON = "json"
+WS_PROTOCOL_BINARY_V1 = "vv.bin.1"
+WS_PROTOCOLS = (WS_PROTOCOL_BINARY_V1, WS_PROTOCOL_JSON)  # Preference order
+WS_ENVELOPE_VERSION = 1
+WS_ENVELOPE = struct.Struct("!BBHIII")
+WS_MESSAGE_TYPES = {
+    "session": 1, "status": 2, "transcript": 3, "translation": 4, "keywords": 5, "audio": 6,
+    "config": 7, "error": 8, "queue": 9, "quota_exceeded": 10, "live_clone_success": 11,
+    "utterance_end": 12, "ack": 13, "resumed": 14, "quality": 15, "trace": 16,
+}
+WS_MESSAGE_NAMES = {code: name for name, code in WS_MESSAGE_TYPES.items()}
+# Messages that report an utterance's progress and so make a not-yet-sent status obsolete
+WS_STATUS_SUPERSEDED_BY = {"transcript", "translation", "audio", "utterance_end"}
+
+
+def encode_envelope(msg_type: str, utterance_id: int, seq: int, payload: bytes) -> bytes:
+    return WS_ENVELOPE.pack(WS_ENVELOPE_VERSION, WS_MESSAGE_TYPES[msg_type], 0,
+                            utterance_id, seq, len(payload)) + payload
+
 
-    async def connect(self, ws: WebSocket, user_id: int): await ws.accept(); self.active_connections[user_id] = ws
+def decode_envelope(frame: bytes) -> tuple:
+    """Returns (message type name, utterance id, seq, payload); raises ValueError on a malformed frame."""
+    if len(frame) < WS_ENVELOPE.size:
+        raise ValueError("Frame shorter than the envelope header")
+    version, code, _, utterance_id, seq, length = WS_ENVELOPE.unpack_from(frame)
+    if version != WS_ENVELOPE_VERSION:
+        raise ValueError(f"Unsupported envelope version {version}")
+    if code not in WS_MESSAGE_NAMES:
+        raise ValueError(f"Unknown message type {code}")
+    payload = frame[WS_ENVELOPE.size:]
+    if len(payload) != length:
+        raise ValueError("Envelope length does not match the frame")
+    return WS_MESSAGE_NAMES[code], utterance_id, seq, payload
 
-    def disconnect(self, user_id: int): self.active_connections.pop(user_id, None)
 
-    async def send_json(self, msg: dict, user_id: int):
-      ws = self.active_connections.get(user_id)
-      if ws:
+def negotiate_ws_protocol(ws: WebSocket, requested: Optional[str]) -> tuple:
+    """
+    Picks the wire protocol for a /ws/translate connection. Returns (protocol, subprotocol to
+    echo in the handshake or None). Unknown requests fall back to JSON.
+    """
+    offered = ws.scope.get("subprotocols") or []
+    for protocol in WS_PROTOCOLS:
+        if protocol in offered:
+            return protocol, protocol
+    return (requested if requested in WS_PROTOCOLS else WS_PROTOCOL_JSON), None
+
+
+def decode_client_frame(msg: dict, protocol: str) -> tuple:
+    """
+    Normalizes one received ASGI websocket message to ("audio", bytes), ("config", dict),
+    ("ack", seq) or (None, None) for anything else. JSON text frames are accepted under either protocol.
+    """
+    if msg.get("bytes") is not None:
+        if protocol == WS_PROTOCOL_JSON:
+            return "audio", msg["bytes"]
+        msg_type, _, _, payload = decode_envelope(msg["bytes"])
+        if msg_type == "audio":
+            return "audio", payload
+        if msg_type == "config":
+            return "config", json.loads(payload)
+        if msg_type == "ack":
+            return "ack", int(json.loads(payload)["seq"])
+        return None, None
+    if msg.get("text"):
+        data = json.loads(msg["text"])
+        if data.get("type") == "config":
+            return "config", data.get("data", {})
+        if data.get("type") == "ack":
+            return "ack", int(data.get("data", {})["seq"])
+    return None, None
+
+
+class VoiceChannel:
+    """
+    Per-session wire state: negotiated protocol, current socket (None while detached), outgoing
+    sequence, current utterance, pending status and the replay buffer used to resume a session
+    (see the sequencing rules above).
+    """
+
+    def __init__(self, ws: WebSocket, protocol: str):
+        self.ws: Optional[WebSocket] = ws
+        self.protocol = protocol
+        self.resume_token = secrets.token_urlsafe(24)
+        self.seq = 0
+        self.utterance_id = 0
+        self.pending_status: Optional[tuple] = None  # (utterance id, text)
+        self.status_flush: Optional[asyncio.Task] = None
+        self.replay: "collections.deque[tuple]" = collections.deque()  # (position, seq, text or bytes frame)
+        self.replay_bytes = 0
+        self.position = 0  # Counts retained frames, sequenced or not
+        self.shed_seq = 0  # Highest seq dropped from the replay buffer
+        self.detached_at: Optional[float] = None
+        self.resumed = asyncio.Event()
+        self.released = asyncio.Event()  # Set when the current socket is given up
+
+    def next_seq(self) -> int:
+        self.seq = (self.seq + 1) & 0xFFFFFFFF
+        return self.seq
+
+    def envelope(self, msg_type: str, payload: bytes, utterance_id: Optional[int] = None) -> tuple:
+        seq = self.next_seq()
+        return seq, encode_envelope(msg_type, self.utterance_id if utterance_id is None else utterance_id,
+                                    seq, payload)
+
+    def retain(self, seq: int, frame: Union[str, bytes]):
+        """Keeps a sent frame for replay, shedding the oldest beyond the frame and byte limits."""
+        self.position += 1
+        self.replay.append((self.position, seq, frame))
+        self.replay_bytes += len(frame)
+        while self.replay and (len(self.replay) > settings.VOICE_REPLAY_MAX_FRAMES
+                               or self.replay_bytes > settings.VOICE_REPLAY_MAX_BYTES):
+            self._shed()
+
+    def acknowledge(self, seq: int):
+        """Drops frames the client confirmed it has received."""
+        while self.replay and self.replay[0][1] <= seq:
+            self._shed()
+
+    def _shed(self):
+        _, seq, frame = self.replay.popleft()
+        self.replay_bytes -= len(frame)
+        self.shed_seq = max(self.shed_seq, seq)
+
+
+class ConnectionManager:
+    """
+    Live translation sockets keyed by voice session id. A user may hold several
+    sessions at once (tabs, devices), each with its own pipeline. Callers send logical
+    messages; the session's VoiceChannel decides how they go on the wire. A session
+    whose socket drops (any close but a deliberate 1000/1001) is kept for
+    VOICE_RESUME_GRACE_SECONDS and can be resumed on a new socket with its resume
+    token, replaying every frame after the client's last seq.
+    """
+
+    def __init__(self):
+        self.active_connections: Dict[str, WebSocket] = {}
+        self.session_users: Dict[str, int] = {}
+        self.channels: Dict[str, VoiceChannel] = {}
+        self.resume_tokens: Dict[str, str] = {}  # token -> session_id
+
+    async def connect(self, ws: WebSocket, session_id: str, user_id: int,
+                      protocol: str = WS_PROTOCOL_JSON, subprotocol: Optional[str] = None):
+        await ws.accept(subprotocol=subprotocol)
+        self.active_connections[session_id] = ws
+        self.session_users[session_id] = user_id
+        channel = VoiceChannel(ws, protocol)
+        self.channels[session_id] = channel
+        self.resume_tokens[channel.resume_token] = session_id
+
+    def disconnect(self, session_id: str):
+        self.active_connections.pop(session_id, None)
+        self.session_users.pop(session_id, None)
+        channel = self.channels.pop(session_id, None)
+        if channel:
+            self.resume_tokens.pop(channel.resume_token, None)
+            if channel.status_flush and not channel.status_flush.done():
+                channel.status_flush.cancel()
+            channel.released.set()
+
+    def resumable_session(self, token: str, user_id: int) -> Optional[str]:
+        session_id = self.resume_tokens.get(token)
+        if session_id is None or self.session_users.get(session_id) != user_id:
+            return None
+        return session_id
+
+    async def wait_for_resume(self, session_id: str) -> bool:
+        """
+        Called by the pipeline when its socket is gone. Keeps the session (buffering output)
+        until the client resumes it or the grace period ends; False means tear it down.
+        """
+        channel = self.channels.get(session_id)
+        if not channel:
+            return False
+        channel.ws = None
+        channel.detached_at = time.monotonic()
+        self.active_connections.pop(session_id, None)
+        channel.released.set()
+        detached = sum(1 for c in self.channels.values() if c.detached_at is not None)
+        if detached > settings.VOICE_MAX_DETACHED_SESSIONS:
+            return False
+        channel.resumed.clear()
+        try:
+            await asyncio.wait_for(channel.resumed.wait(), timeout=settings.VOICE_RESUME_GRACE_SECONDS)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def resume(self, ws: WebSocket, session_id: str, last_seq: int, subprotocol: Optional[str] = None):
+        """Attaches a new socket to a detached session, replaying every retained frame after last_seq."""
+        channel = self.channels[session_id]
+        await ws.accept(subprotocol=subprotocol)
+        channel.acknowledge(last_seq)
+        missing = channel.shed_seq > last_seq
+        replayed = 0
+        # Frames produced while replaying are picked up by the next pass; the socket goes live
+        # only once nothing is left, so live and replayed frames never interleave out of order.
+        backlog = [item for item in channel.replay if item[1] > last_seq]
+        while backlog:
+            for position, _, frame in backlog:
+                await (ws.send_text(frame) if isinstance(frame, str) else ws.send_bytes(frame))
+                replayed += 1
+            backlog = [item for item in channel.replay if item[0] > position]
+        channel.ws = ws
+        channel.detached_at = None
+        channel.released = asyncio.Event()
+        self.active_connections[session_id] = ws
+        channel.resumed.set()
+        # Tells the client whether anything it missed had already been shed from the buffer
+        await self.send_json({"type": "resumed", "data": {
+            "replayed": replayed, "missing_from": last_seq + 1 if missing else None}}, session_id)
+
+    def acknowledge(self, session_id: str, seq: int):
+        channel = self.channels.get(session_id)
+        if channel:
+            channel.acknowledge(seq)
+
+    def begin_utterance(self, session_id: str) -> int:
+        """Starts a new utterance; later messages of the session are tagged with its id."""
+        channel = self.channels.get(session_id)
+        if not channel:
+            return 0
+        channel.utterance_id = (channel.utterance_id + 1) & 0xFFFFFFFF
+        return channel.utterance_id
+
+    async def end_utterance(self, session_id: str):
+        """Tells binary clients that all text and audio of the current utterance has been sent."""
+        channel = self.channels.get(session_id)
+        if channel and channel.protocol == WS_PROTOCOL_BINARY_V1:
+            await self._send_envelope(session_id, channel, "utterance_end", b"")
+
+    async def send_json(self, msg: dict, session_id: str):
+        channel = self.channels.get(session_id)
+        if not channel:
+            return
+        if channel.protocol == WS_PROTOCOL_JSON:
+            seq = channel.next_seq()
+            await self._send(session_id, channel, seq, json.dumps({**msg, "seq": seq}, ensure_ascii=False))
+            return
+        msg_type = msg.get("type")
+        if msg_type == "status":
+            # Status updates are coalesced: only the latest one within the window reaches the client
+            channel.pending_status = (channel.utterance_id, msg.get("data"))
+            if not channel.status_flush or channel.status_flush.done():
+                channel.status_flush = asyncio.create_task(self._flush_status_later(session_id, channel))
+            return
+        await self._settle_pending_status(session_id, channel, msg_type)
+        payload = json.dumps(msg.get("data"), separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+        await self._send_envelope(session_id, channel, msg_type, payload)
+
+    async def send_bytes(self, data: bytes, session_id: str):
+        channel = self.channels.get(session_id)
+        if not channel:
+            return
+        if channel.protocol == WS_PROTOCOL_JSON:
+            await self._send(session_id, channel, channel.seq, data)  # Unsequenced: filed under the last text frame
+            return
+        await self._settle_pending_status(session_id, channel, "audio")
+        await self._send_envelope(session_id, channel, "audio", data)
+
+    async def _settle_pending_status(self, session_id: str, channel: VoiceChannel, msg_type: str):
+        """Before another message goes out, a waiting status is dropped if it is obsolete, else sent first."""
+        if channel.pending_status is None:
+            return
+        utterance_id, text = channel.pending_status
+        channel.pending_status = None
+        if msg_type in WS_STATUS_SUPERSEDED_BY and utterance_id == channel.utterance_id:
+            return
+        await self._send_status(session_id, channel, utterance_id, text)
+
+    async def _flush_status_later(self, session_id: str, channel: VoiceChannel):
+        await asyncio.sleep(settings.WS_STATUS_COALESCE_SECONDS)
+        if channel.pending_status is not None:
+            utterance_id, text = channel.pending_status
+            channel.pending_status = None
+            await self._send_status(session_id, channel, utterance_id, text)
+
+    async def _send_status(self, session_id: str, channel: VoiceChannel, utterance_id: int, text: Any):
+        payload = json.dumps(text, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+        await self._send(session_id, channel, *channel.envelope("status", payload, utterance_id))
+
+    async def _send_envelope(self, session_id: str, channel: VoiceChannel, msg_type: str, payload: bytes):
+        await self._send(session_id, channel, *channel.envelope(msg_type, payload))
+
+    async def _send(self, session_id: str, channel: VoiceChannel, seq: int, frame: Union[str, bytes]):
+        # Retained first: a frame lost with a dropping socket is replayed on resume
+        channel.retain(seq, frame)
+        ws = channel.ws
+        if ws is None:
+            return
         try:
-            await ws.send_json(msg)
+            await (ws.send_text(frame) if isinstance(frame, str) else ws.send_bytes(frame))
         except WebSocketDisconnect:
-            self.disconnect(user_id)
+            if channel.ws is ws:
+                channel.ws = None
         except Exception as e:
-            logger.error(f"Error sending JSON to user {user_id}: {e}")
+            logger.error(f"Error sending to voice session {session_id}: {e}")
+
+manager = ConnectionManager()
+
 
+class AdmissionController:
+    """
+    Caps concurrent /ws/translate pipelines at the estimated inference capacity.
+    Sessions beyond capacity wait in a bounded FIFO queue and are told their
+    position; sessions beyond the queue, over the per-user cap or waiting longer
+    than VOICE_QUEUE_TIMEOUT_SECONDS are rejected.
+    """
 
-    async def send_bytes(self, data: bytes, user_id: int):
-      ws = self.active_connections.get(user_id)
-      if ws:
+    def __init__(self, capacity: int, max_queue: int, max_per_user: int):
+        self.capacity = capacity
+        self.max_queue = max_queue
+        self.max_per_user = max_per_user
+        self.active: Dict[str, int] = {}  # session_id -> user_id
+        self._queue: "collections.OrderedDict[str, tuple]" = collections.OrderedDict()
+        self.counters: Dict[str, int] = collections.Counter()
+
+    def _sessions_of(self, user_id: int) -> int:
+        return (sum(1 for uid in self.active.values() if uid == user_id)
+                + sum(1 for uid, _, _ in self._queue.values() if uid == user_id))
+
+    async def acquire(self, session_id: str, user_id: int, notify_position) -> Optional[str]:
+        """Waits until the session may start. Returns None once admitted, or a rejection reason."""
+        if self._sessions_of(user_id) >= self.max_per_user:
+            self.counters["rejected_per_user"] += 1
+            return f"You already have {self.max_per_user} active translation sessions."
+        if len(self.active) < self.capacity and not self._queue:
+            self.active[session_id] = user_id
+            self.counters["admitted"] += 1
+            return None
+        if len(self._queue) >= self.max_queue:
+            self.counters["rejected_capacity"] += 1
+            return "The server is at capacity. Please try again in a few minutes."
+
+        admitted = asyncio.get_running_loop().create_future()
+        self._queue[session_id] = (user_id, admitted, notify_position)
+        self.counters["queued"] += 1
+        await self._announce_positions()
         try:
-            await ws.send_bytes(data)
-        except WebSocketDisconnect:
-            self.disconnect(user_id)
+            await asyncio.wait_for(asyncio.shield(admitted), timeout=settings.VOICE_QUEUE_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            if not admitted.done():
+                self._queue.pop(session_id, None)
+                self.counters["rejected_timeout"] += 1
+                await self._announce_positions()
+                return "Timed out waiting for a free translation slot."
+        except asyncio.CancelledError:
+            self.release(session_id)
+            raise
+        self.counters["admitted"] += 1
+        return None
+
+    def release(self, session_id: str):
+        if self.active.pop(session_id, None) is not None:
+            self._admit_waiting()
+        elif self._queue.pop(session_id, None) is not None:
+            asyncio.ensure_future(self._announce_positions())
+
+    def _admit_waiting(self):
+        while self._queue and len(self.active) < self.capacity:
+            session_id, (user_id, admitted, _) = self._queue.popitem(last=False)
+            self.active[session_id] = user_id
+            admitted.set_result(True)
+        asyncio.ensure_future(self._announce_positions())
+
+    async def _announce_positions(self):
+        for position, (_, _, notify_position) in enumerate(list(self._queue.values()), start=1):
+            try:
+                await notify_position(position)
+            except Exception:
+                pass  # The waiting socket is going away; release() will drop it
+
+    def stats(self) -> Dict[str, Any]:
+        return {"capacity": self.capacity, "active": len(self.active), "queued": len(self._queue),
+                "counters": dict(self.counters)}
+
+
+class FairInferenceScheduler:
+    """
+    Start-time fair queuing of pipeline inference work across voice sessions. At most
+    `slots` model calls from live sessions run at once. When contended, the next slot
+    goes to the request with the smallest virtual start tag, and each session's virtual
+    clock advances by cost / weight, so one talkative session waits behind quieter
+    ones instead of monopolising Whisper and XTTS. Costs are rough seconds of compute
+    (see the *_cost helpers). Scheduling is per worker process.
+    """
+
+    def __init__(self, slots: int):
+        self.slots = slots
+        self.in_use = 0
+        self.virtual_time = 0.0
+        self._weights: Dict[str, float] = {}
+        self._finish_tags: Dict[str, float] = {}
+        self._waiters: List[tuple] = []  # heap of (start_tag, seq, future)
+        self._sequence = itertools.count()
+
+    def register(self, session_id: str, weight: float = 1.0):
+        self._weights[session_id] = weight
+        self._finish_tags[session_id] = self.virtual_time
+
+    def unregister(self, session_id: str):
+        self._weights.pop(session_id, None)
+        self._finish_tags.pop(session_id, None)
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(1 for _, _, future in self._waiters if not future.done())
+
+    @staticmethod
+    def transcription_cost(audio_seconds: float) -> float:
+        return 0.3 * audio_seconds
+
+    @staticmethod
+    def translation_cost(text: str) -> float:
+        return 0.05 + len(text) / 2000
+
+    @staticmethod
+    def synthesis_cost(text: str) -> float:
+        return len(text) / 15  # ~15 characters of speech per second, synthesized near real time
+
+    @asynccontextmanager
+    async def slot(self, session_id: str, cost: float):
+        weight = self._weights.get(session_id, 1.0)
+        start_tag = max(self.virtual_time, self._finish_tags.get(session_id, self.virtual_time))
+        self._finish_tags[session_id] = start_tag + cost / weight
+
+        if self.in_use < self.slots and not self.queue_depth:
+            self.in_use += 1
+            self.virtual_time = start_tag
+        else:
+            granted = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._waiters, (start_tag, next(self._sequence), granted))
+            try:
+                await granted
+            except asyncio.CancelledError:
+                if granted.done() and not granted.cancelled():
+                    self._release()  # The slot was granted just as we were cancelled
+                raise
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _release(self):
+        self.in_use -= 1
+        while self._waiters:
+            start_tag, _, granted = heapq.heappop(self._waiters)
+            if granted.done():
+                continue  # Waiter was cancelled
+            self.in_use += 1
+            self.virtual_time = start_tag
+            granted.set_result(True)
+            break
+
+admission_controller = AdmissionController(
+    capacity=settings.MAX_CONCURRENT_VOICE_SESSIONS or settings.INFERENCE_WORKERS * 4,
+    max_queue=settings.VOICE_QUEUE_MAX_LENGTH,
+    max_per_user=settings.MAX_VOICE_SESSIONS_PER_USER)
+# One slot per inference executor thread: more would let work queue up, unordered, in the executor
+inference_scheduler = FairInferenceScheduler(slots=settings.INFERENCE_WORKERS)
+
+
+# ### LOAD-ADAPTIVE QUALITY ###
+QUALITY_TIERS = ("full", "reduced", "fast", "text")  # Best to cheapest
+QUALITY_TIER_FEATURES = {
+    "full": {"topics": True, "diarization": True, "fast_stt": False, "speech": True},
+    "reduced": {"topics": False, "diarization": False, "fast_stt": False, "speech": True},
+    "fast": {"topics": False, "diarization": False, "fast_stt": True, "speech": True},
+    "text": {"topics": False, "diarization": False, "fast_stt": True, "speech": False},
+}
+
+
+class QualityController:
+    """
+    Steps live sessions down through QUALITY_TIERS when this worker is overloaded, so that
+    latency degrades gracefully instead of growing for everyone. Every
+    QUALITY_EVAL_INTERVAL_SECONDS load is scored as the larger of inference queue depth per
+    slot and recent p95 utterance latency over QUALITY_LATENCY_SLO_SECONDS. Above
+    QUALITY_DEGRADE_PRESSURE the worker drops one tier, below QUALITY_RECOVER_PRESSURE it
+    recovers one, at most once per QUALITY_MIN_DWELL_SECONDS. A session never goes below the
+    floor of its user's quota tier (QUALITY_TIER_FLOORS) and is told when its tier changes.
+    """
+
+    def __init__(self):
+        self.level = 0  # Index into QUALITY_TIERS for this worker
+        self.changed_at = 0.0
+        self.pressure = 0.0
+        self._floors: Dict[str, int] = {}  # session_id -> cheapest tier index allowed
+        self._announced: Dict[str, int] = {}  # session_id -> tier index last sent to the client
+        self._latencies: "collections.deque[tuple]" = collections.deque(maxlen=4096)  # (monotonic, seconds)
+        self.stage_seconds: Dict[str, float] = collections.Counter()
+        self.stage_counts: Dict[str, int] = collections.Counter()
+        self.counters: Dict[str, int] = collections.Counter()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task: self._task.cancel()
+
+    async def register(self, session_id: str, user_id: int, is_superuser: bool):
+        tier = await quota_manager.tier_for(user_id, is_superuser)
+        self._floors[session_id] = QUALITY_TIERS.index(settings.QUALITY_TIER_FLOORS.get(tier, QUALITY_TIERS[-1]))
+        self._announced[session_id] = self.level_for(session_id)
+
+    def unregister(self, session_id: str):
+        self._floors.pop(session_id, None)
+        self._announced.pop(session_id, None)
+
+    def level_for(self, session_id: str) -> int:
+        return min(self.level, self._floors.get(session_id, 0))
+
+    def features(self, session_id: str) -> Dict[str, bool]:
+        return QUALITY_TIER_FEATURES[QUALITY_TIERS[self.level_for(session_id)]]
+
+    def tier_message(self, session_id: str) -> dict:
+        tier = QUALITY_TIERS[self.level_for(session_id)]
+        return {"type": "quality", "data": {"tier": tier, "features": QUALITY_TIER_FEATURES[tier]}}
+
+    def record_stage(self, stage: str, seconds: float):
+        self.stage_seconds[stage] += seconds
+        self.stage_counts[stage] += 1
+
+    def record_latency(self, seconds: float):
+        """End-to-end latency of one utterance: segment ready to first audio (or text, without speech)."""
+        self._latencies.append((time.monotonic(), seconds))
+
+    def p95_latency(self) -> float:
+        horizon = time.monotonic() - settings.QUALITY_LATENCY_WINDOW_SECONDS
+        while self._latencies and self._latencies[0][0] < horizon:
+            self._latencies.popleft()
+        if not self._latencies:
+            return 0.0
+        ordered = sorted(seconds for _, seconds in self._latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def evaluate(self) -> bool:
+        """Re-scores load and moves the worker tier by at most one step. Returns True if it changed."""
+        queue_pressure = inference_scheduler.queue_depth / max(inference_scheduler.slots, 1)
+        self.pressure = max(queue_pressure, self.p95_latency() / settings.QUALITY_LATENCY_SLO_SECONDS)
+        now = time.monotonic()
+        if now - self.changed_at < settings.QUALITY_MIN_DWELL_SECONDS:
+            return False
+        if self.pressure > settings.QUALITY_DEGRADE_PRESSURE and self.level < len(QUALITY_TIERS) - 1:
+            self.level += 1
+            self.counters["degraded"] += 1
+        elif self.pressure < settings.QUALITY_RECOVER_PRESSURE and self.level > 0:
+            self.level -= 1
+            self.counters["recovered"] += 1
+        else:
+            return False
+        self.changed_at = now
+        # Latencies measured at the previous tier would otherwise keep pushing the next decision
+        self._latencies.clear()
+        logger.warning(f"Live quality tier is now '{QUALITY_TIERS[self.level]}' (load pressure {self.pressure:.2f})")
+        return True
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(settings.QUALITY_EVAL_INTERVAL_SECONDS)
+            try:
+                if self.evaluate():
+                    await self._notify_sessions()
+            except Exception as e:
+                logger.error(f"Quality controller evaluation failed: {e}", exc_info=True)
+
+    async def _notify_sessions(self):
+        for session_id in list(self._floors):
+            level = self.level_for(session_id)
+            if self._announced.get(session_id) != level:
+                self._announced[session_id] = level
+                await manager.send_json(self.tier_message(session_id), session_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"tier": QUALITY_TIERS[self.level], "pressure": round(self.pressure, 3),
+                "p95_latency_seconds": round(self.p95_latency(), 3), "sessions": len(self._floors),
+                "avg_stage_seconds": {stage: round(self.stage_seconds[stage] / count, 3)
+                                      for stage, count in self.stage_counts.items()},
+                **self.counters}
+
+quality_controller = QualityController()
+
+
+# ### PROFILING & UTTERANCE TRACES ###
+def sample_stacks(stop: threading.Event, interval_seconds: float, max_seconds: float) -> collections.Counter:
+    """
+    Samples the stack of every other thread until `stop` is set or max_seconds pass. Returns
+    folded stacks ("thread;outer;...;inner" -> sample count) as consumed by flame graph tools.
+    """
+    stacks = collections.Counter()
+    own_ident = threading.get_ident()
+    thread_names: Dict[int, str] = {}
+    deadline = time.monotonic() + max_seconds
+    while not stop.wait(interval_seconds) and time.monotonic() < deadline:
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            if ident not in thread_names:
+                thread_names.update((thread.ident, thread.name) for thread in threading.enumerate())
+            parts = []
+            while frame is not None:
+                code = frame.f_code
+                parts.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            parts.append(thread_names.get(ident, str(ident)))
+            stacks[";".join(reversed(parts))] += 1
+    return stacks
+
+
+class ProfilerService:
+    """
+    Admin-triggered profiling of this worker process without a restart. 'cprofile' instruments
+    the event loop thread, where every request handler and pipeline coroutine runs; 'sampling'
+    snapshots all threads (including inference executor threads) every PROFILE_SAMPLE_INTERVAL_MS
+    and writes folded stacks. One capture runs at a time; the last PROFILE_MAX_CAPTURES are kept.
+    """
+
+    def __init__(self):
+        self.captures: "collections.OrderedDict[str, Dict[str, Any]]" = collections.OrderedDict()
+        self._stop = threading.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, mode: str, seconds: float) -> Dict[str, Any]:
+        if self._task and not self._task.done():
+            raise HTTPException(status.HTTP_409_CONFLICT, "A profile capture is already running.")
+        if not os.path.exists(settings.PROFILE_DIR): os.makedirs(settings.PROFILE_DIR)
+        capture = {"id": uuid.uuid4().hex, "mode": mode, "seconds": seconds, "status": "running",
+                   "started_at": datetime.datetime.utcnow(), "finished_at": None, "error": None, "path": None}
+        self.captures[capture["id"]] = capture
+        self._stop.clear()
+        self._task = asyncio.create_task(self._capture(capture))
+        return capture
+
+    def stop(self, capture_id: str) -> bool:
+        """Ends a running capture early; its result is still written."""
+        capture = self.captures.get(capture_id)
+        if not capture or capture["status"] != "running":
+            return False
+        self._stop.set()
+        return True
+
+    async def close(self):
+        self._stop.set()
+        if self._task: await asyncio.gather(self._task, return_exceptions=True)
+
+    async def _capture(self, capture: Dict[str, Any]):
+        extension = "prof" if capture["mode"] == "cprofile" else "folded"
+        path = os.path.join(settings.PROFILE_DIR, f"{capture['id']}.{extension}")
+        try:
+            if capture["mode"] == "cprofile":
+                profiler = cProfile.Profile()
+                profiler.enable()
+                try:
+                    await asyncio.to_thread(self._stop.wait, capture["seconds"])
+                finally:
+                    profiler.disable()
+                await asyncio.to_thread(profiler.dump_stats, path)
+            else:
+                stacks = await asyncio.to_thread(sample_stacks, self._stop,
+                                                 settings.PROFILE_SAMPLE_INTERVAL_MS / 1000, capture["seconds"])
+
+                def write_folded():
+                    with open(path, "w", encoding="utf-8") as output:
+                        output.writelines(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+                await asyncio.to_thread(write_folded)
+            capture.update(status="completed", path=path)
+            logger.info(f"Profile capture {capture['id']} ({capture['mode']}) written to {path}")
         except Exception as e:
-            logger.error(f"Error sending bytes to user {user_id}: {e}")
+            logger.error(f"Profile capture {capture['id']} failed: {e}", exc_info=True)
+            capture.update(status="failed", error=str(e))
+        finally:
+            capture["finished_at"] = datetime.datetime.utcnow()
+            while len(self.captures) > settings.PROFILE_MAX_CAPTURES:
+                _, old = self.captures.popitem(last=False)
+                if old["path"] and os.path.exists(old["path"]):
+                    os.remove(old["path"])
 
-manager = ConnectionManager()
+profiler_service = ProfilerService()
+
+
+class UtteranceTrace:
+    """Stage timestamps of one utterance, in milliseconds since its first audio was received."""
 
+    def __init__(self, utterance_id: int, received_at: float):
+        self.utterance_id = utterance_id
+        self.received_at = received_at  # time.monotonic()
+        self.started_at = datetime.datetime.utcnow() - datetime.timedelta(seconds=time.monotonic() - received_at)
+        self.stages: Dict[str, float] = {"received": 0.0}
 
-async def audio_pipeline(ws: WebSocket, user_id: int, app_state: Any, config: Dict):
+    def mark(self, stage: str):
+        self.stages[stage] = round((time.monotonic() - self.received_at) * 1000, 1)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"utterance_id": self.utterance_id, "started_at": self.started_at.isoformat() + "Z",
+                "stages_ms": self.stages}
+
+
+class TraceStore:
+    """Ring buffers of recent utterance traces for the last TRACE_MAX_SESSIONS traced sessions."""
+
+    def __init__(self):
+        self._sessions: "collections.OrderedDict[str, collections.deque]" = collections.OrderedDict()
+
+    def record(self, session_id: str, trace: Dict[str, Any]):
+        traces = self._sessions.get(session_id)
+        if traces is None:
+            traces = self._sessions[session_id] = collections.deque(maxlen=settings.TRACE_PER_SESSION)
+            while len(self._sessions) > settings.TRACE_MAX_SESSIONS:
+                self._sessions.popitem(last=False)
+        else:
+            self._sessions.move_to_end(session_id)
+        traces.append(trace)
+
+    def get(self, session_id: str) -> List[Dict[str, Any]]:
+        return list(self._sessions.get(session_id, ()))
+
+utterance_traces = TraceStore()
+
+
+TOPIC_STOP_WORDS = {
+    'en': frozenset("""
+        a about above after again against all also am an and any are as at be because been before being below
+        between both but by can could did do does doing down during each few for from further get got had has
+        have having he her here hers herself him himself his how i if in into is it its itself just know let
+        like me more most my myself no nor not now of off on once only or other our ours ourselves out over own
+        really right same she should so some such than that the their theirs them themselves then there these
+        they this those through to too under until up us very was we well were what when where which while who
+        whom why will with would yeah yes you your yours yourself yourselves okay ok oh um uh going think want
+        one thing things something lot gonna
+    """.split()),
+    'ru': frozenset("""
+        а без более больше будет будто бы был была были было быть в вам вас вдруг ведь во вот впрочем все всегда
+        всего всех всю вы где да даже два для до другой его ее ей ему если есть еще ж же за зачем здесь и из или
+        им иногда их к как какая какой когда конечно которая которые который кто куда ли лучше между меня мне
+        много может можно мой моя мы на над надо наконец нас не него нее ней нельзя нет ни нибудь никогда ним
+        них ничего но ну о об один он она они опять от перед по под после потом потому почти при про раз разве
+        с сам свою себе себя сейчас со совсем так такой там тебя тем теперь то тогда того тоже только том тот
+        три тут ты у уж уже хорошо хоть чего чем через что чтоб чтобы чуть эти этого этой этом этот эту я
+        это просто вообще очень давай давайте ага угу значит типа вот-вот
+    """.split()),
+}
+
+
+class TopicTracker:
+    """
+    Running topic keywords for one live session. Each segment is embedded once; new
+    1-2 word candidate phrases are embedded in the same call and cached. A phrase's
+    score is its decayed sum of similarity to the segments it occurs in, so topics
+    fade after TOPIC_HALF_LIFE_SECONDS without mention. update() returns the new
+    top-N list only when the ranking changed.
+    """
+
+    WORD_PATTERN = re.compile(r"[^\W\d_]+(?:-[^\W\d_]+)*")
+
+    def __init__(self, language: str, top_n: int = 5, half_life_seconds: float = 120.0,
+                 max_candidates: int = 200):
+        self.stop_words = TOPIC_STOP_WORDS.get(language, TOPIC_STOP_WORDS['en'] | TOPIC_STOP_WORDS['ru'])
+        self.top_n = top_n
+        self.decay_rate = np.log(2) / half_life_seconds
+        self.max_candidates = max_candidates
+        self.scores: Dict[str, float] = {}
+        self._embeddings: Dict[str, np.ndarray] = {}
+        self._last_update = time.monotonic()
+        self._ranking: List[str] = []
+
+    def candidates(self, text: str) -> List[str]:
+        words = [w.lower() for w in self.WORD_PATTERN.findall(text)]
+        phrases = []
+        for i, word in enumerate(words):
+            if len(word) < 3 or word in self.stop_words: continue
+            phrases.append(word)
+            if i + 1 < len(words) and len(words[i + 1]) >= 3 and words[i + 1] not in self.stop_words:
+                phrases.append(f"{word} {words[i + 1]}")
+        return list(dict.fromkeys(phrases))
+
+    async def update(self, text: str, inference: InferenceBackend) -> Optional[List[str]]:
+        phrases = self.candidates(text)
+        if len(phrases) < 2:  # Too little content to say anything about the topic
+            return None
+        new_phrases = [p for p in phrases if p not in self._embeddings]
+        embeddings = await inference.embed([text] + new_phrases)
+        segment_embedding = embeddings[0]
+        self._embeddings.update(zip(new_phrases, embeddings[1:]))
+
+        now = time.monotonic()
+        decay = float(np.exp(-self.decay_rate * (now - self._last_update)))
+        self._last_update = now
+        for phrase in self.scores:
+            self.scores[phrase] *= decay
+        similarities = np.stack([self._embeddings[p] for p in phrases]) @ segment_embedding
+        for phrase, similarity in zip(phrases, similarities):
+            self.scores[phrase] = self.scores.get(phrase, 0.0) + max(float(similarity), 0.0)
+
+        if len(self.scores) > self.max_candidates:
+            keep = heapq.nlargest(self.max_candidates, self.scores.items(), key=lambda item: item[1])
+            self.scores = dict(keep)
+            self._embeddings = {p: self._embeddings[p] for p in self.scores}
+
+        ranking = self._rank()
+        if ranking == self._ranking:
+            return None
+        self._ranking = ranking
+        return ranking
+
+    def _rank(self) -> List[str]:
+        """Top phrases by score, skipping single words already covered by a higher-ranked phrase."""
+        ranking: List[str] = []
+        for phrase, _ in sorted(self.scores.items(), key=lambda item: item[1], reverse=True):
+            if any(phrase in chosen.split() or chosen in phrase.split() for chosen in ranking):
+                continue
+            ranking.append(phrase)
+            if len(ranking) >= self.top_n: break
+        return ranking
+
+
+async def audio_pipeline(ws: WebSocket, user_id: int, session_id: str, app_state: Any, config: Dict,
+                         protocol: str = WS_PROTOCOL_JSON):
     initial_user_check = await database.fetch_one(users.select().where(users.c.id == user_id))
     if not initial_user_check or not initial_user_check['is_active']:
         logger.warning(f"WebSocket connection for inactive or non-existent user_id {user_id} terminated.")
         await ws.close(code=status.WS_1008_POLICY_VIOLATION, reason="User account is inactive.")
         return
 
-    xtts_model = app_state.ai_model_manager.get_model('xtts')
-    stt = app_state.ai_model_manager.get_model('stt')
-    keyword_extractor = app_state.ai_model_manager.get_model('keyword_extractor')
-    # Using a local reference to avoid repeated lookups
-    diarization_pipeline = app_state.ai_model_manager.models.get('diarization') # Use .get for safety
+    inference: InferenceBackend = app_state.inference
 
-    if not all([xtts_model, stt]):
+    if not (inference.has_model('xtts') and inference.has_model('stt')):
         logger.error(f"User {user_id}: Essential AI models (XTTS, STT) not loaded. Terminating WebSocket.")
-        await manager.send_json({"type": "error", "data": "Core AI services are unavailable. Please try again later."}, user_id)
+        await manager.send_json({"type": "error", "data": "Core AI services are unavailable. Please try again later."}, session_id)
         await ws.close(code=status.WS_1011_INTERNAL_ERROR)
         return
 
-    if not diarization_pipeline:
+    diarization_enabled = inference.has_model('diarization')
+    if not diarization_enabled:
         logger.warning(f"User {user_id}: Diarization model not loaded. Multi-speaker detection is disabled.")
 
+    is_superuser = initial_user_check['is_superuser']
+    quota_notice_sent_at = 0.0  # Throttles quota_exceeded messages
+    topic_tracker = (TopicTracker(config.get('source_lang', 'ru'), settings.TOPIC_TOP_N,
+                                  settings.TOPIC_HALF_LIFE_SECONDS, settings.TOPIC_MAX_CANDIDATES)
+                     if inference.has_model('sentence_encoder') else None)
+
     audio_queue = asyncio.Queue()
+    live_clone_store: LiveCloneStore = app_state.live_clone_store
     live_cloned_latents = None
-    has_attempted_live_clone = False
-
-    async def receiver():
+    live_clone_seconds = 0.0  # Seconds of speech the current live latents were computed from
+    live_clone_reference = bytearray()  # Speech accumulated for (re)computing live latents
+    live_clone_task: Optional[asyncio.Task] = None
+    live_clone_failures = 0  # Consecutive failed clone attempts
+    live_clone_failed_seconds = 0.0  # Reference length of the last failed attempt
+
+    stored_clone = await live_clone_store.load(user_id)
+    if stored_clone:
+        live_cloned_latents = stored_clone['latents']
+        live_clone_seconds = stored_clone['reference_seconds']
+        logger.info(f"Restored live voice clone for user {user_id} ({live_clone_seconds:.1f}s of reference audio)")
+        await manager.send_json({"type": "live_clone_success", "data": "Restored your voice from a previous session."}, session_id)
+
+    async def refine_live_clone(reference: bytes, reference_seconds: float):
+        nonlocal live_cloned_latents, live_clone_seconds, live_clone_failures, live_clone_failed_seconds
+        is_first_clone = live_cloned_latents is None
+        try:
+            if is_first_clone:
+                await manager.send_json({"type": "status", "data": "Analyzing your voice for live cloning..."}, session_id)
+            async with inference_scheduler.slot(session_id, FairInferenceScheduler.transcription_cost(reference_seconds)):
+                latents = await inference.conditioning_latents(pcm=reference)
+            live_cloned_latents = latents
+            live_clone_seconds = reference_seconds
+            live_clone_failures = 0
+            await live_clone_store.save(user_id, latents, reference_seconds)
+            logger.info(f"Live voice clone for user {user_id} updated from {reference_seconds:.1f}s of audio")
+            if is_first_clone:
+                await manager.send_json({"type": "live_clone_success", "data": "Live clone successful! Translations will now use your voice."}, session_id)
+        except Exception as e:
+            live_clone_failures += 1
+            live_clone_failed_seconds = reference_seconds
+            logger.error(f"Live voice cloning failed for user {user_id} "
+                         f"(attempt {live_clone_failures}/{settings.LIVE_CLONE_MAX_ATTEMPTS}): {e}")
+            if is_first_clone and live_clone_failures == 1:
+                await manager.send_json({"type": "error", "data": "Live voice cloning failed. Using default voice."}, session_id)
+
+    async def translate_and_speak(segment: np.ndarray, speaker: str, status_message: str, received_at: float):
+        """
+        Transcribes, translates and voices one speaker segment of 16 kHz float32 audio whose first
+        bytes arrived at `received_at` (monotonic). Traced sessions get the stage timings back.
+        """
+        utterance_id = manager.begin_utterance(session_id)
+        log_utterance_id.set(f"{session_id[:8]}-{utterance_id}")
+        trace = UtteranceTrace(utterance_id, received_at) if config.get('trace') else None
+        if trace: trace.mark("segmented")
+        try:
+            await speak_utterance(segment, speaker, status_message, trace)
+        finally:
+            await manager.end_utterance(session_id)
+            if trace:
+                utterance_traces.record(session_id, trace.to_dict())
+                await manager.send_json({"type": "trace", "data": trace.to_dict()}, session_id)
+
+    async def speak_utterance(segment: np.ndarray, speaker: str, status_message: str,
+                              trace: Optional[UtteranceTrace]):
+        nonlocal quota_notice_sent_at
+        source_lang = config.get('source_lang', 'ru')
+        target_lang = config.get('target_lang', 'en')
+        features = quality_controller.features(session_id)
+
+        # Speech is billed as it is processed; once the user's quota is spent, segments are skipped
+        allowed, _, retry_after = await quota_manager.check(user_id, is_superuser)
+        if not allowed:
+            if time.monotonic() - quota_notice_sent_at > 30:
+                quota_notice_sent_at = time.monotonic()
+                await manager.send_json({"type": "quota_exceeded",
+                                         "data": {"retry_after_seconds": round(retry_after, 1)}}, session_id)
+            return
+
+        # 1. Transcribe
+        await manager.send_json({"type": "status", "data": status_message}, session_id)
+        started = time.monotonic()
+        async with inference_scheduler.slot(session_id, FairInferenceScheduler.transcription_cost(
+                segment.shape[0] / PCM_SAMPLE_RATE)):
+            transcribed = await inference.transcribe(segment, source_lang, fast=features['fast_stt'])
+        quality_controller.record_stage("stt", time.monotonic() - started)
+        if trace: trace.mark("transcribed")
+        usage_recorder.record(user_id, audio_seconds=segment.shape[0] / PCM_SAMPLE_RATE)
+        await quota_manager.charge(user_id, is_superuser, audio_seconds=segment.shape[0] / PCM_SAMPLE_RATE)
+        if not transcribed: return
+
+        await manager.send_json({"type": "transcript",
+                                 "data": {"text": transcribed, "lang": source_lang, "speaker": speaker}}, session_id)
+
+        # --- SESSION TOPICS: only sent when the running keyword ranking changes ---
+        if topic_tracker and features['topics']:
+            async with inference_scheduler.slot(session_id, FairInferenceScheduler.translation_cost(transcribed)):
+                keywords = await topic_tracker.update(transcribed, inference)
+            if keywords:
+                pipeline_logger.info("Session topics for user %s: %s", user_id, keywords)
+                await manager.send_json({"type": "keywords", "data": keywords}, session_id)
+
+        # 2. Translate
+        # (For simplicity, we won't call the full advanced translate endpoint here, but a production system could)
+        translate_started = time.monotonic()
+        async with inference_scheduler.slot(session_id, FairInferenceScheduler.translation_cost(transcribed)):
+            translated = await translate_with_memory(inference, transcribed, source_lang, target_lang)
+        quality_controller.record_stage("translate", time.monotonic() - translate_started)
+        if trace: trace.mark("translated")
+        usage_recorder.record(user_id, characters_translated=len(transcribed))
+        await quota_manager.charge(user_id, is_superuser, characters_translated=len(transcribed))
+        await manager.send_json({"type": "translation",
+                                 "data": {"text": translated, "lang": target_lang, "speaker": speaker}}, session_id)
+        if not features['speech']:  # Text-only tier under overload
+            quality_controller.record_latency(time.monotonic() - started)
+            return
+
+        # 3. Synthesize
+        voice_clone_id = config.get('voice_clone_id')
+        latents_path, speaker_latents = None, None
+
+        if voice_clone_id:  # Priority 1: User selected an offline clone
+            clone_record = await database.fetch_one(
+                voice_clones.select().where(voice_clones.c.id == voice_clone_id, voice_clones.c.user_id == user_id))
+            if clone_record and clone_record['status'] == 'completed' and clone_record['model_path']:
+                latents_path = clone_record['model_path']
+        elif live_cloned_latents:  # Priority 2: Use the live-cloned voice
+            speaker_latents = live_cloned_latents
+
+        # --- NEW: APPLY EMOTION PARAMETERS ---
+        # Get the emotion from the WebSocket config, defaulting to 'neutral'
+        selected_emotion = config.get('emotion', 'neutral')
+        emotion_params = get_emotion_params(selected_emotion)
+        pipeline_logger.debug("Synthesizing for user %s with emotion '%s': %s", user_id, selected_emotion, emotion_params)
+
+        # The synthesis slot is only held while XTTS produces audio; a separate task sends it, so a
+        # slow client delays its own audio rather than everyone's inference
+        produced = 0
+        outbound: asyncio.Queue = asyncio.Queue()
+
+        async def forward_audio():
+            while (chunk := await outbound.get()) is not None:
+                await manager.send_bytes(chunk, session_id)
+
+        sender = asyncio.create_task(forward_audio())
+        synthesis_started = time.monotonic()
+        try:
+            async with inference_scheduler.slot(session_id, FairInferenceScheduler.synthesis_cost(translated)):
+                async for audio_chunk in inference.synthesize_stream(translated, target_lang, emotion_params,
+                                                                     latents=speaker_latents, latents_path=latents_path):
+                    if not produced:
+                        quality_controller.record_stage("tts_first_chunk", time.monotonic() - synthesis_started)
+                        quality_controller.record_latency(time.monotonic() - started)
+                        if trace: trace.mark("first_audio")
+                    produced += len(audio_chunk)
+                    outbound.put_nowait(audio_chunk)
+        finally:
+            outbound.put_nowait(None)
+            await sender
+        if trace and produced: trace.mark("last_audio")
+        usage_recorder.record(user_id, tts_seconds=produced / (2 * TTS_SAMPLE_RATE))
+        await quota_manager.charge(user_id, is_superuser, tts_seconds=produced / (2 * TTS_SAMPLE_RATE))
+
+    async def receive_from(current_ws: WebSocket) -> Optional[int]:
+        """Feeds one socket's frames into the pipeline until that socket disconnects. Returns the close code."""
         try:
             while True:
-                msg = await ws.receive()
+                msg = await current_ws.receive()
                 if msg.get("type") == "websocket.disconnect":
+                    return msg.get("code")
+                try:
+                    kind, payload = decode_client_frame(msg, protocol)
+                except (ValueError, KeyError, TypeError):  # ValueError includes json.JSONDecodeError
+                    pipeline_logger.warning("Received a malformed frame from user %s", user_id)
+                    continue
+                if kind == "audio":
+                    await audio_queue.put((time.monotonic(), payload))
+                elif kind == "ack":
+                    manager.acknowledge(session_id, payload)
+                elif kind == "config":
+                    config.update(payload)
+                    pipeline_logger.info("User %s updated WS config: %s", user_id, config)
+                    await manager.send_json({"type": "status", "data": "Configuration updated."}, session_id)
+        except WebSocketDisconnect as e:
+            return e.code
+
+    async def receiver():
+        # Buffered audio keeps being processed while detached; its output waits in the replay buffer
+        try:
+            current_ws = ws
+            while current_ws is not None:
+                close_code = await receive_from(current_ws)
+                if close_code in (status.WS_1000_NORMAL_CLOSURE, status.WS_1001_GOING_AWAY):
+                    # The client hung up on purpose: free the pipeline and admission slot right away
+                    logger.info(f"WebSocket closed by user {user_id} (session {session_id}, code {close_code}).")
                     break
-                if "bytes" in msg:
-                    await audio_queue.put(msg["bytes"])
-                elif "text" in msg:
-                    try:
-                        data = json.loads(msg["text"]);
-                        if data.get("type") == "config":
-                            config.update(data.get("data", {}))
-                            logger.info(f"User {user_id} updated WS config: {config}")
-                            await manager.send_json({"type": "status", "data": "Configuration updated."}, user_id)
-                    except json.JSONDecodeError:
-                        logger.warning(f"Received invalid JSON from user {user_id}")
-        except WebSocketDisconnect:
-            logger.info(f"WebSocket disconnected for user {user_id}.")
+                logger.info(f"WebSocket disconnected for user {user_id} (session {session_id}, code {close_code}); "
+                            f"awaiting resume.")
+                if not await manager.wait_for_resume(session_id):
+                    break
+                logger.info(f"Voice session {session_id} resumed for user {user_id}.")
+                current_ws = manager.active_connections.get(session_id)
         finally:
             await audio_queue.put(None) # Signal processor to stop
 
     async def processor():
-        nonlocal live_cloned_latents, has_attempted_live_clone
+        nonlocal live_clone_task
         audio_buffer = bytearray()
         # Assuming 16kHz, 16-bit mono audio. 5 seconds = 16000 * 2 * 5 = 160KB
         DIARIZATION_THRESHOLD = 180000
-        LIVE_CLONE_THRESHOLD = 160000
+        BYTES_PER_SECOND = 32000
+        max_reference_bytes = int(settings.LIVE_CLONE_MAX_REFERENCE_SECONDS * BYTES_PER_SECOND)
+
+        buffer_received_at = 0.0  # When the first bytes now in audio_buffer arrived
 
         while True:
-            chunk = await audio_queue.get()
-            if chunk is None: break
+            item = await audio_queue.get()
+            if item is None: break
+            received_at, chunk = item
+            if not audio_buffer:
+                buffer_received_at = received_at
             audio_buffer.extend(chunk)
 
             # --- DYNAMIC PROCESSING LOGIC ---
-            if not has_attempted_live_clone and not config.get('voice_clone_id') and len(audio_buffer) > LIVE_CLONE_THRESHOLD:
-                has_attempted_live_clone = True
+            # Live cloning is refined in the background as more speech arrives, up to the reference cap.
+            # A failed attempt is only retried once another refine step of speech has arrived, and
+            # the session gives up after LIVE_CLONE_MAX_ATTEMPTS failures in a row.
+            if (not config.get('voice_clone_id') and live_clone_seconds < settings.LIVE_CLONE_MAX_REFERENCE_SECONDS
+                    and live_clone_failures < settings.LIVE_CLONE_MAX_ATTEMPTS):
+                if len(live_clone_reference) < max_reference_bytes:
+                    live_clone_reference.extend(chunk[:max_reference_bytes - len(live_clone_reference)])
+                reference_seconds = len(live_clone_reference) / BYTES_PER_SECOND
+                next_milestone = (settings.LIVE_CLONE_MIN_SECONDS if live_cloned_latents is None
+                                  else min(live_clone_seconds + settings.LIVE_CLONE_REFINE_STEP_SECONDS,
+                                           settings.LIVE_CLONE_MAX_REFERENCE_SECONDS))
+                if live_clone_failures:
+                    next_milestone = max(next_milestone, live_clone_failed_seconds + settings.LIVE_CLONE_REFINE_STEP_SECONDS)
+                if reference_seconds >= next_milestone and (live_clone_task is None or live_clone_task.done()):
+                    live_clone_task = asyncio.create_task(
+                        refine_live_clone(bytes(live_clone_reference), reference_seconds))
+
+            if (diarization_enabled and quality_controller.features(session_id)['diarization']
+                    and len(audio_buffer) > DIARIZATION_THRESHOLD):
                 try:
-                    await manager.send_json({"type": "status", "data": "Analyzing your voice for live cloning..."}, user_id)
-                    with tempfile.NamedTemporaryFile(suffix=".wav", delete=True) as tmpfile:
-                        audio_np = np.frombuffer(audio_buffer, dtype=np.int16).astype(np.float32) / 32768.0
-                        audio_tensor = torch.from_numpy(audio_np).unsqueeze(0)
-                        torchaudio.save(tmpfile.name, audio_tensor, 16000)
-
-                        gpt_cond_latent, speaker_embedding = xtts_model.get_conditioning_latents(audio_path=tmpfile.name)
-                        live_cloned_latents = {'gpt_cond_latent': gpt_cond_latent, 'speaker_embedding': speaker_embedding}
-                        logger.info(f"Successfully performed live voice clone for user {user_id}")
-                        await manager.send_json({"type": "live_clone_success", "data": "Live clone successful! Translations will now use your voice."})
-                except Exception as e:
-                    logger.error(f"Live voice cloning failed for user {user_id}: {e}")
-                    await manager.send_json({"type": "error", "data": "Live voice cloning failed. Using default voice."})
+                    audio_np = pcm16_to_float32(audio_buffer)
+                    audio_buffer.clear()
 
-            if diarization_pipeline and len(audio_buffer) > DIARIZATION_THRESHOLD:
-                try:
-                    with tempfile.NamedTemporaryFile(suffix=".wav", delete=True) as tmpfile:
-                        audio_np = np.frombuffer(audio_buffer, dtype=np.int16).astype(np.float32) / 32768.0
-                        audio_tensor = torch.from_numpy(audio_np).unsqueeze(0)
-                        torchaudio.save(tmpfile.name, audio_tensor, 16000)
-                        audio_buffer.clear()
-
-                        await manager.send_json({"type": "status", "data": "Identifying speakers..."}, user_id)
-                        diarization = diarization_pipeline(tmpfile.name)
-
-                        for turn, _, speaker in diarization.itertracks(yield_label=True):
-                            start_time, end_time = turn.start, turn.end
-
-                            # 4. Extract audio segment for this specific speaker
-                            waveform, sample_rate = torchaudio.load(tmpfile.name)
-                            segment = waveform[0, int(start_time * sample_rate):int(end_time * sample_rate)]
-
-                            if segment.shape[0] < (sample_rate * 0.5):  # Ignore very short segments
-                                continue
-
-                            # 5. Transcribe the segment
-                            await manager.send_json({"type": "status", "data": f"Transcribing {speaker}..."}, user_id)
-                            stt_res = stt(segment.numpy(), generate_kwargs={"language": config['source_lang']})
-                            transcribed = stt_res["text"].strip()
-                            if not transcribed: continue
-
-                            # Send transcript with speaker ID
-                            await manager.send_json({"type": "transcript",
-                                                           "data": {"text": transcribed, "lang": config['source_lang'],
-                                                                    "speaker": speaker}}, user_id)
-
-                            # --- NEW: EXTRACT AND SEND KEYWORDS ---
-                            if keyword_extractor:
-                                keywords = extract_keywords_from_text(transcribed, keyword_extractor)
-                                if keywords:
-                                    logger.info(f"Identified keywords for user {user_id}: {keywords}")
-                                    await manager.send_json({"type": "keywords", "data": keywords}, user_id)
-
-                            # 6. Translate the segment
-                            # (For simplicity, we won't call the full advanced translate endpoint here, but a production system could)
-                            translator = app_state.ai_model_manager.get_model(
-                                f"translator_{config['source_lang']}_{config['target_lang']}")
-                            translated = translator(transcribed)[0]['translation_text']
-                            await manager.send_json({"type": "translation",
-                                                     "data": {"text": translated, "lang": config['target_lang'],
-                                                              "speaker": speaker}}, user_id)
-
-                            voice_clone_id = config.get('voice_clone_id')
-                            speaker_latents = None
-
-                            if voice_clone_id:  # Priority 1: User selected an offline clone
-                                clone_record = await database.fetch_one(
-                                    voice_clones.select().where(voice_clones.c.id == voice_clone_id,
-                                                                voice_clones.c.user_id == user_id))
-                                if clone_record and clone_record['status'] == 'completed' and clone_record[
-                                    'model_path']:
-                                    speaker_latents = torch.load(clone_record['model_path'],
-                                                                 map_location=xtts_model.device)
-
-                            elif live_cloned_latents:  # Priority 2: Use the live-cloned voice
-                                speaker_latents = live_cloned_latents
-
-                            # Synthesize speech
-                            tts_kwargs = {
-                                "text": translated,
-                                "language": config.get('target_lang', 'en'),
-                            }
-
-                            # Add voice cloning latents if available
-                            if speaker_latents:
-                                tts_kwargs['gpt_cond_latent'] = speaker_latents['gpt_cond_latent']
-                                tts_kwargs['speaker_embedding'] = speaker_latents['speaker_embedding']
-                            else:
-                                # Fallback to a default speaker wav if no clone is used
-                                default_wav_path = "models/default_reference.wav"
-                                if os.path.exists(default_wav_path):
-                                    tts_kwargs['speaker_wav'] = default_wav_path
-
-                            # --- NEW: APPLY EMOTION PARAMETERS ---
-                            # Get the emotion from the WebSocket config, defaulting to 'neutral'
-                            selected_emotion = config.get('emotion', 'neutral')
-                            emotion_params = get_emotion_params(selected_emotion)
-                            tts_kwargs.update(emotion_params)  # Add the emotion params to the TTS arguments
-                            logger.info(
-                                f"Synthesizing for user {user_id} with emotion '{selected_emotion}': {emotion_params}")
-
-                            # Generate audio chunks with the combined parameters
-                            tts_chunks = xtts_model.tts_stream(**tts_kwargs)
-                            for chunk in tts_chunks:
-                                await manager.send_bytes(chunk.to(torch.int16).cpu().numpy().tobytes(), user_id)
+                    await manager.send_json({"type": "status", "data": "Identifying speakers..."}, session_id)
+                    async with inference_scheduler.slot(session_id, FairInferenceScheduler.transcription_cost(
+                            audio_np.shape[0] / PCM_SAMPLE_RATE)):
+                        speaker_turns = await inference.diarize(audio_np)
+                    for start_time, end_time, speaker in speaker_turns:
+                        # Extract audio segment for this specific speaker
+                        segment = audio_np[int(start_time * PCM_SAMPLE_RATE):int(end_time * PCM_SAMPLE_RATE)]
+                        if segment.shape[0] < (PCM_SAMPLE_RATE * 0.5):  # Ignore very short segments
+                            continue
+                        await translate_and_speak(segment, speaker, f"Transcribing {speaker}...", buffer_received_at)
                 except Exception as e:
                     logger.error(f"WS Diarization Pipeline Error for user {user_id}: {e}", exc_info=True)
-                    await manager.send_json({"type": "error", "data": "Speaker identification failed."}, user_id)
+                    await manager.send_json({"type": "error", "data": "Speaker identification failed."}, session_id)
                     audio_buffer.clear()
             # Fallback for single speaker or small buffers
             elif len(audio_buffer) > 96000:
                 # This part handles single-speaker translation when diarization is off or buffer is small
                 try:
-                    with tempfile.NamedTemporaryFile(suffix=".wav", delete=True) as tmpfile:
-                        audio_np = np.frombuffer(audio_buffer, dtype=np.int16).astype(np.float32) / 32768.0
-                        audio_tensor = torch.from_numpy(audio_np).unsqueeze(0)
-                        torchaudio.save(tmpfile.name, audio_tensor, 16000)
-                        audio_buffer.clear()
-
-                        # 1. Transcribe
-                        await manager.send_json({"type": "status", "data": f"Transcribing..."}, user_id)
-                        stt_res = stt(tmpfile.name, generate_kwargs={"language": config.get('source_lang', 'ru')})
-                        transcribed = stt_res["text"].strip()
-                        if not transcribed: continue
-
-                        await manager.send_json({"type": "transcript", "data": {"text": transcribed, "lang": config['source_lang'], "speaker": "SPEAKER_00"}}, user_id)
-
-                        # 2. Translate
-                        translator = app_state.ai_model_manager.get_model(f"translator_{config['source_lang']}_{config['target_lang']}")
-                        translated = translator(transcribed)[0]['translation_text']
-                        await manager.send_json({"type": "translation", "data": {"text": translated, "lang": config['target_lang'], "speaker": "SPEAKER_00"}}, user_id)
-
-                        # 3. Synthesize
-                        voice_clone_id = config.get('voice_clone_id')
-                        speaker_latents = None
-
-                        if voice_clone_id:
-                            clone_record = await database.fetch_one(voice_clones.select().where(voice_clones.c.id == voice_clone_id, voice_clones.c.user_id == user_id))
-                            if clone_record and clone_record['status'] == 'completed' and clone_record['model_path']:
-                                speaker_latents = torch.load(clone_record['model_path'], map_location=xtts_model.device)
-                        elif live_cloned_latents:
-                            speaker_latents = live_cloned_latents
-
-                        tts_kwargs = {"text": translated, "language": config.get('target_lang', 'en')}
-                        if speaker_latents:
-                            tts_kwargs['gpt_cond_latent'] = speaker_latents['gpt_cond_latent']
-                            tts_kwargs['speaker_embedding'] = speaker_latents['speaker_embedding']
-                        else:
-                            # Add a default reference audio if you have one, for better default voice quality
-                             default_wav_path = "models/default_reference.wav"
-                             if os.path.exists(default_wav_path):
-                                tts_kwargs['speaker_wav'] = default_wav_path
-
-                        tts_chunks = xtts_model.tts_stream(**tts_kwargs)
-                        for chunk in tts_chunks:
-                            await manager.send_bytes(chunk.to(torch.int16).cpu().numpy().tobytes(), user_id)
-
+                    audio_np = pcm16_to_float32(audio_buffer)
+                    audio_buffer.clear()
+                    await translate_and_speak(audio_np, "SPEAKER_00", "Transcribing...", buffer_received_at)
                 except Exception as e:
                     logger.error(f"WS Single-Speaker Pipeline Error for user {user_id}: {e}", exc_info=True)
-                    await manager.send_json({"type": "error", "data": "An error occurred during translation."}, user_id)
+                    await manager.send_json({"type": "error", "data": "An error occurred during translation."}, session_id)
                     audio_buffer.clear()
 
-    await asyncio.gather(receiver(), processor())
+    try:
+        await asyncio.gather(receiver(), processor())
+    finally:
+        if live_clone_task and not live_clone_task.done():
+            live_clone_task.cancel()
+
+
+async def hold_while_queued(ws: WebSocket, config: Dict, protocol: str = WS_PROTOCOL_JSON):
+    """
+    Consumes client frames while a session waits for admission: config updates are
+    applied, audio is discarded. Returns when the client disconnects.
+    """
+    try:
+        while True:
+            msg = await ws.receive()
+            if msg.get("type") == "websocket.disconnect":
+                return
+            try:
+                kind, payload = decode_client_frame(msg, protocol)
+            except ValueError:
+                continue
+            if kind == "config":
+                config.update(payload)
+    except WebSocketDisconnect:
+        return
 
 
 @app.websocket("/ws/translate")
-async def websocket_endpoint(websocket: WebSocket, token: str = Query(...)):
+async def websocket_endpoint(websocket: WebSocket, token: str = Query(...),
+                             protocol: Optional[str] = Query(None, max_length=20),
+                             resume: Optional[str] = Query(None, max_length=64),
+                             last_seq: int = Query(0, ge=0)):
     try:
         fb_user = await get_current_user_from_token(token)
         user = await get_current_active_user(fb_user)
@@ -1229,7 +4941,14 @@ async def websocket_endpoint(websocket: WebSocket, token: str = Query(...)):
         await websocket.close(code=status.WS_1008_POLICY_VIOLATION);
         return
 
-    await manager.connect(websocket, user.id)
+    if resume:
+        await resume_voice_session(websocket, user.id, resume, last_seq)
+        return
+
+    session_id = str(uuid4())
+    log_session_id.set(session_id)
+    protocol, subprotocol = negotiate_ws_protocol(websocket, protocol)
+    await manager.connect(websocket, session_id, user.id, protocol, subprotocol)
     # Load user preferences into the initial config
     user_prefs = json.loads(user.preferences) if isinstance(user.preferences, str) else user.preferences
     config = {
@@ -1239,42 +4958,437 @@ async def websocket_endpoint(websocket: WebSocket, token: str = Query(...)):
         "formality": "formal" # Default formality
     }
 
+    async def notify_queue_position(position: int):
+        await manager.send_json({"type": "queue", "data": {
+            "position": position, "message": f"All translation slots are busy. You are number {position} in line."}},
+            session_id)
+
     try:
-        await manager.send_json({"type": "status", "data": "Connected to Volkovoice."}, user.id)
-        await audio_pipeline(websocket, user.id, app.state, config)
+        # --- Admission control: wait for a slot, but notice if the client gives up ---
+        admission = asyncio.create_task(admission_controller.acquire(session_id, user.id, notify_queue_position))
+        client_gone = asyncio.create_task(hold_while_queued(websocket, config, protocol))
+        await asyncio.wait({admission, client_gone}, return_when=asyncio.FIRST_COMPLETED)
+        if not admission.done():
+            admission.cancel()
+            return
+        client_gone.cancel()
+        rejection = admission.result()
+        if rejection:
+            await manager.send_json({"type": "error", "data": rejection}, session_id)
+            await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER, reason="Server at capacity")
+            return
+
+        inference_scheduler.register(session_id, weight=2.0 if user.is_superuser else 1.0)
+        await quality_controller.register(session_id, user.id, user.is_superuser)
+        await manager.send_json({"type": "session", "data": {
+            "session_id": session_id, "protocol": protocol,
+            "resume_token": manager.channels[session_id].resume_token}}, session_id)
+        if quality_controller.level_for(session_id):  # Joined while this worker is degraded
+            await manager.send_json(quality_controller.tier_message(session_id), session_id)
+        await manager.send_json({"type": "status", "data": "Connected to Volkovoice."}, session_id)
+        await audio_pipeline(websocket, user.id, session_id, app.state, config, protocol)
     except Exception as e:
-        logger.error(f"Unhandled WS Error for user {user.id}: {e}", exc_info=True)
+        logger.error(f"Unhandled WS Error for user {user.id} (session {session_id}): {e}", exc_info=True)
     finally:
-        manager.disconnect(user.id)
-        logger.info(f"Cleaned up connection for user {user.id}")
+        admission_controller.release(session_id)
+        inference_scheduler.unregister(session_id)
+        quality_controller.unregister(session_id)
+        manager.disconnect(session_id)
+        logger.info(f"Cleaned up voice session {session_id} for user {user.id}")
 
 
-class ChatConnectionManager:
+async def resume_voice_session(websocket: WebSocket, user_id: int, token: str, last_seq: int):
+    """
+    Reattaches a reconnecting client to its detached session. The session's pipeline (started by
+    the original connection) keeps running; this connection only holds the socket open until it drops.
+    """
+    session_id = manager.resumable_session(token, user_id)
+    channel = manager.channels.get(session_id) if session_id else None
+    if channel is None or channel.detached_at is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Session cannot be resumed")
+        return
+    log_session_id.set(session_id)
+    offered = websocket.scope.get("subprotocols") or []
+    await manager.resume(websocket, session_id, last_seq,
+                         subprotocol=channel.protocol if channel.protocol in offered else None)
+    await channel.released.wait()
+
+
+# ### CHAT PUB/SUB BROKERS ###
+# The broker implementations live in chat_broker.py; CHAT_BROKER_URL picks one.
+class LatencyStats:
+    """Rolling latency window with cheap percentile snapshots."""
+
+    def __init__(self, window: int = 2048):
+        self.samples = collections.deque(maxlen=window)
+        self.count = 0
+        self.max_seconds = 0.0
+
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+        self.count += 1
+        self.max_seconds = max(self.max_seconds, seconds)
+
+    def snapshot(self) -> Dict[str, float]:
+        if not self.samples:
+            return {"count": self.count, "p50_ms": 0.0, "p95_ms": 0.0, "max_ms": 0.0}
+        p50, p95 = np.percentile(np.fromiter(self.samples, dtype=np.float64), [50, 95]) * 1000
+        return {"count": self.count, "p50_ms": round(float(p50), 3), "p95_ms": round(float(p95), 3),
+                "max_ms": round(self.max_seconds * 1000, 3)}
+
+
+def create_chat_broker() -> ChatBroker:
+    if settings.CHAT_BROKER_URL:
+        return RedisChatBroker(settings.CHAT_BROKER_URL, settings.CHAT_PRESENCE_TTL_SECONDS)
+    return InMemoryChatBroker()
+
+
+# ### USAGE QUOTAS ###
+# Token-bucket stores and the QuotaManager live in quota.py; tiers and tier overrides come from here.
+async def lookup_quota_tier(user_id: int) -> Optional[str]:
+    row = await database.fetch_one(user_quota_tiers.select().where(user_quota_tiers.c.user_id == user_id))
+    return row['tier'] if row else None
+
+quota_manager = QuotaManager(settings.QUOTA_COST_WEIGHTS, settings.QUOTA_TIERS, settings.QUOTA_DEFAULT_TIER,
+                             settings.QUOTA_SUPERUSER_TIER, settings.QUOTA_TIER_CACHE_SECONDS, lookup_quota_tier)
+
+
+def chat_message_for_language(row: Any, lang: str) -> ChatMessageBroadcast:
+    """Builds a stored message as seen by a reader of `lang`, falling back to the original text."""
+    translations = row['translations'] if isinstance(row['translations'], dict) else json.loads(row['translations'])
+    translated_lang = lang if lang in translations else row['original_lang']
+    return ChatMessageBroadcast(
+        id=row['message_id'],
+        sender_uid=row['sender_uid'],
+        original_text=row['original_text'],
+        original_lang=row['original_lang'],
+        translated_text=translations.get(translated_lang, row['original_text']),
+        translated_lang=translated_lang,
+        timestamp=row['timestamp']
+    )
+
+
+class ChatMessageLog:
+    """
+    Persists chat messages with batched appends: the receive loop only buffers a row,
+    and a background task writes buffered rows with one executemany per flush.
+    """
+
     def __init__(self):
-        self.rooms: Dict[str, Dict[str, WebSocket]] = {}
+        self._buffer: List[Dict[str, Any]] = []
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task: self._task.cancel()
+        await self.flush()
+
+    def append(self, row: Dict[str, Any]):
+        self._buffer.append(row)
+        if len(self._buffer) >= settings.CHAT_LOG_MAX_BATCH:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=settings.CHAT_LOG_FLUSH_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        async with self._flush_lock:
+            rows, self._buffer = self._buffer, []
+            if not rows:
+                return
+            try:
+                await database.execute_many(chat_messages.insert(), rows)
+            except Exception as e:
+                logger.error(f"Failed to persist {len(rows)} chat messages: {e}", exc_info=True)
+                self._buffer[:0] = rows[-settings.CHAT_LOG_MAX_BATCH * 10:]  # Retry later, bounded
+
+    async def fetch_page(self, session_id: str, before_id: Optional[int], limit: int) -> List[Any]:
+        """Newest-first page of a session's messages older than before_id, using (session_id, id)."""
+        await self.flush()  # So messages still in the buffer are visible
+        query = chat_messages.select().where(chat_messages.c.session_id == session_id)
+        if before_id is not None:
+            query = query.where(chat_messages.c.id < before_id)
+        return await database.fetch_all(query.order_by(chat_messages.c.id.desc()).limit(limit))
+
+chat_message_log = ChatMessageLog()
+
+
+class ChatConnection:
+    """
+    One chat participant socket. Outbound frames go into a bounded queue drained by a
+    dedicated writer task, so a slow link only ever delays its own messages.
+    """
+
+    def __init__(self, ws: WebSocket, session_id: str, user_uid: str, lang: str, room_latency: LatencyStats):
+        self.ws = ws
+        self.session_id = session_id
+        self.user_uid = user_uid
+        self.lang = lang  # Language this participant reads
+        self.room_latency = room_latency
+        self.queue: collections.deque = collections.deque()
+        self.skipped = 0  # Frames shed by the slow-consumer policy since the last notice
+        self.last_seen = time.monotonic()  # Last inbound frame (message or pong)
+        self._ready = asyncio.Event()
+        self.writer_task: Optional[asyncio.Task] = None
+
+    def start(self, on_failure):
+        self.writer_task = asyncio.create_task(self._write_loop(on_failure))
+
+    def enqueue(self, payload: str, published_at: float) -> bool:
+        """Queues an already-serialized frame. Returns False if the consumer must be disconnected."""
+        if len(self.queue) >= settings.CHAT_OUTBOUND_QUEUE_SIZE:
+            policy = settings.CHAT_SLOW_CONSUMER_POLICY
+            if policy == "disconnect":
+                return False
+            self.skipped += 1
+            if policy == "drop":
+                return True
+            self.queue.popleft()  # coalesce: shed the oldest frame, the client is told how many it missed
+        self.queue.append((payload, published_at))
+        self._ready.set()
+        return True
+
+    def touch(self):
+        self.last_seen = time.monotonic()
+
+    def prepend(self, payloads: List[str]):
+        """Puts replayed history ahead of anything queued live since the connection registered."""
+        now = time.time()
+        self.queue.extendleft((payload, now) for payload in reversed(payloads))
+        if self.queue: self._ready.set()
+
+    async def _write_loop(self, on_failure):
+        try:
+            while True:
+                while not self.queue:
+                    self._ready.clear()
+                    await self._ready.wait()
+                if self.skipped:
+                    notice, self.skipped = {"type": "messages_skipped", "data": {"count": self.skipped}}, 0
+                    await self.ws.send_text(json.dumps(notice))
+                payload, published_at = self.queue.popleft()
+                await self.ws.send_text(payload)
+                self.room_latency.record(time.time() - published_at)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if not isinstance(e, WebSocketDisconnect):
+                pipeline_logger.warning("Chat send to %s in session %s failed: %s", self.user_uid, self.session_id, e)
+            asyncio.create_task(on_failure(self))
+
+    def close(self):
+        if self.writer_task and self.writer_task is not asyncio.current_task():
+            self.writer_task.cancel()
+
+
+class ChatConnectionManager:
+    """
+    Tracks the chat sockets connected to this node. Broadcasts go through the chat
+    broker and are delivered by each node to its local sockets, so two participants
+    of a room can sit on different workers or hosts. Local delivery only enqueues
+    the pre-serialized frame on each participant's writer, so fan-out never waits
+    on a slow socket.
+    """
 
-    async def connect(self, ws: WebSocket, session_id: str, user_uid: str):
+    def __init__(self):
+        self.rooms: Dict[str, Dict[str, ChatConnection]] = {}
+        self.broker: ChatBroker = InMemoryChatBroker()
+        # Publish-to-local-delivery latency; assumes node clocks are NTP-synchronised.
+        self.fanout_latency = LatencyStats()
+        # Publish-to-socket-write latency per room on this node
+        self.room_latency: Dict[str, LatencyStats] = {}
+        self.counters: Dict[str, int] = collections.Counter()
+        self._background_tasks: List[asyncio.Task] = []
+
+    async def start(self, broker: ChatBroker):
+        self.broker = broker
+        await broker.start()
+        self._background_tasks = [asyncio.create_task(self._presence_heartbeat()),
+                                  asyncio.create_task(self._liveness_loop()),
+                                  asyncio.create_task(self._garbage_collection_loop())]
+
+    async def stop(self):
+        for task in self._background_tasks: task.cancel()
+        for room in self.rooms.values():
+            for connection in room.values():
+                connection.close()
+        await self.broker.close()
+
+    @staticmethod
+    def _channel(session_id: str) -> str:
+        return f"volkovoice:chat:room:{session_id}"
+
+    async def connect(self, ws: WebSocket, session_id: str, user_uid: str, lang: str) -> ChatConnection:
         await ws.accept()
         if session_id not in self.rooms:
             self.rooms[session_id] = {}
-        self.rooms[session_id][user_uid] = ws
-        logger.info(f"User {user_uid} connected to chat session {session_id}")
-
-    def disconnect(self, session_id: str, user_uid: str):
-        if session_id in self.rooms:
-            if user_uid in self.rooms[session_id]:
-                del self.rooms[session_id][user_uid]
-                if not self.rooms[session_id]: # Delete room if empty
-                    del self.rooms[session_id]
-        logger.info(f"User {user_uid} disconnected from chat session {session_id}")
-
-    async def broadcast(self, session_id: str, message: dict):
-        if session_id in self.rooms:
-            for uid, connection in self.rooms[session_id].items():
-                try:
-                    await connection.send_json(message)
-                except WebSocketDisconnect:
-                    self.disconnect(session_id, uid)
+            self.room_latency[session_id] = LatencyStats(window=512)
+            await self.broker.subscribe(self._channel(session_id),
+                                        functools.partial(self._on_broker_message, session_id))
+        previous = self.rooms[session_id].get(user_uid)
+        if previous:
+            previous.close()
+        connection = ChatConnection(ws, session_id, user_uid, lang, self.room_latency[session_id])
+        self.rooms[session_id][user_uid] = connection
+        await self.broker.add_presence(session_id, user_uid, {"node": settings.NODE_ID, "lang": lang})
+        # The connection is registered (so nothing live is missed) before history is loaded,
+        # and its writer only starts once the replay sits ahead of any live frames.
+        try:
+            history = await chat_message_log.fetch_page(session_id, None, settings.CHAT_REPLAY_MESSAGES)
+            connection.prepend([json.dumps(chat_message_for_language(row, lang).model_dump(mode='json'))
+                                for row in reversed(history)])
+        except Exception as e:
+            logger.error(f"Could not replay history for chat session {session_id}: {e}")
+        connection.start(self._on_connection_failure)
+        self.counters["connections_opened"] += 1
+        pipeline_logger.info("User %s connected to chat session %s reading '%s'", user_uid, session_id, lang)
+        return connection
+
+    async def disconnect(self, session_id: str, user_uid: str, connection: Optional[ChatConnection] = None):
+        room = self.rooms.get(session_id)
+        current = room.get(user_uid) if room is not None else None
+        if current is None or (connection is not None and current is not connection):
+            return  # Already gone, or the user has since reconnected with a new socket
+        current.close()
+        del room[user_uid]
+        self.counters["connections_closed"] += 1
+        if not room: # Delete room if empty
+            del self.rooms[session_id]
+            self.room_latency.pop(session_id, None)
+            await self.broker.unsubscribe(self._channel(session_id))
+        await self.broker.remove_presence(session_id, user_uid)
+        pipeline_logger.info("User %s disconnected from chat session %s", user_uid, session_id)
+
+    async def _on_connection_failure(self, connection: ChatConnection):
+        await self.disconnect(connection.session_id, connection.user_uid, connection)
+
+    async def _evict(self, connection: ChatConnection, code: int, reason: str):
+        await self.disconnect(connection.session_id, connection.user_uid, connection)
+        try:
+            await connection.ws.close(code=code, reason=reason)
+        except Exception:
+            pass  # The socket is usually already dead
+
+    async def _disconnect_slow_consumer(self, connection: ChatConnection):
+        self.counters["slow_consumer_disconnects"] += 1
+        logger.warning(f"Disconnecting slow chat consumer {connection.user_uid} in session {connection.session_id}")
+        await self._evict(connection, status.WS_1013_TRY_AGAIN_LATER, "Too slow to keep up.")
+
+    async def participants(self, session_id: str) -> Dict[str, Dict[str, Any]]:
+        """Room members across all nodes."""
+        return await self.broker.presence(session_id)
+
+    async def room_languages(self, session_id: str) -> set:
+        """Distinct languages read by the room's participants across all nodes."""
+        members = await self.broker.presence(session_id)
+        languages = {info["lang"] for info in members.values() if info.get("lang")}
+        languages.update(c.lang for c in self.rooms.get(session_id, {}).values())
+        return languages
+
+    async def broadcast(self, session_id: str, messages_by_lang: Dict[str, dict], fallback_lang: str):
+        """
+        Publishes one message in every language present in the room. Each variant is
+        serialized once; every node hands each local socket the variant in its own
+        language, or the fallback_lang variant if that language arrived after publishing.
+        """
+        envelope = {"origin": settings.NODE_ID, "published_at": time.time(), "fallback": fallback_lang,
+                    "payloads": {lang: json.dumps(message) for lang, message in messages_by_lang.items()}}
+        await self.broker.publish(self._channel(session_id), json.dumps(envelope))
+
+    async def _on_broker_message(self, session_id: str, raw: str):
+        envelope = json.loads(raw)
+        self._deliver_local(session_id, envelope["payloads"], envelope["fallback"], envelope["published_at"])
+        self.fanout_latency.record(time.time() - envelope["published_at"])
+
+    def _deliver_local(self, session_id: str, payloads: Dict[str, str], fallback_lang: str, published_at: float):
+        for connection in list(self.rooms.get(session_id, {}).values()):
+            payload = payloads.get(connection.lang) or payloads[fallback_lang]
+            if not connection.enqueue(payload, published_at):
+                asyncio.create_task(self._disconnect_slow_consumer(connection))
+
+    async def _presence_heartbeat(self):
+        """Refreshes presence for local members so entries of crashed nodes expire."""
+        while True:
+            await asyncio.sleep(settings.CHAT_PRESENCE_TTL_SECONDS / 3)
+            for session_id, room in list(self.rooms.items()):
+                for uid in list(room):
+                    if uid not in room: continue
+                    try:
+                        await self.broker.add_presence(session_id, uid, {"node": settings.NODE_ID,
+                                                                         "lang": room[uid].lang})
+                    except Exception as e:
+                        logger.error(f"Presence heartbeat failed for chat session {session_id}: {e}")
+
+    async def _liveness_loop(self):
+        """Pings every local participant and evicts the ones that stopped answering."""
+        ping = json.dumps({"type": "ping"})
+        while True:
+            await asyncio.sleep(settings.CHAT_PING_INTERVAL_SECONDS)
+            now = time.monotonic()
+            for room in list(self.rooms.values()):
+                for connection in list(room.values()):
+                    if now - connection.last_seen > settings.CHAT_PING_TIMEOUT_SECONDS:
+                        self.counters["dead_connections_evicted"] += 1
+                        logger.info(f"Evicting unresponsive chat connection {connection.user_uid} "
+                                    f"in session {connection.session_id}")
+                        asyncio.create_task(self._evict(connection, status.WS_1001_GOING_AWAY, "Ping timeout."))
+                    elif not connection.enqueue(ping, time.time()):
+                        asyncio.create_task(self._disconnect_slow_consumer(connection))
+
+    async def _garbage_collection_loop(self):
+        while True:
+            await asyncio.sleep(settings.CHAT_GC_INTERVAL_SECONDS)
+            try:
+                await self.collect_garbage()
+            except Exception as e:
+                logger.error(f"Chat room garbage collection failed: {e}", exc_info=True)
+
+    async def collect_garbage(self):
+        """
+        Expires chat sessions past their TTL or idle for CHAT_ROOM_IDLE_TIMEOUT_SECONDS,
+        deleting their messages and closing any of their sockets on this node. Rooms with
+        local participants count as active, so every node keeps its own rooms alive.
+        """
+        now = datetime.datetime.utcnow()
+        if self.rooms:
+            await database.execute_many(
+                chat_sessions.update().where(chat_sessions.c.id == bindparam("session_id"))
+                .values(last_activity_at=bindparam("active_at")),
+                [{"session_id": session_id, "active_at": now} for session_id in self.rooms])
+
+        idle_cutoff = now - datetime.timedelta(seconds=settings.CHAT_ROOM_IDLE_TIMEOUT_SECONDS)
+        expired_rows = await database.fetch_all(
+            sqlalchemy.select(chat_sessions.c.id).where(
+                sqlalchemy.or_(chat_sessions.c.expires_at <= now, chat_sessions.c.last_activity_at <= idle_cutoff)))
+        expired_ids = [row['id'] for row in expired_rows]
+        if not expired_ids:
+            return
+
+        await database.execute(chat_messages.delete().where(chat_messages.c.session_id.in_(expired_ids)))
+        await database.execute(chat_sessions.delete().where(chat_sessions.c.id.in_(expired_ids)))
+        self.counters["rooms_expired"] += len(expired_ids)
+        for session_id in expired_ids:
+            for connection in list(self.rooms.get(session_id, {}).values()):
+                await self._evict(connection, status.WS_1001_GOING_AWAY, "Chat session expired.")
+        logger.info(f"Expired {len(expired_ids)} chat sessions.")
+
+    def stats(self) -> Dict[str, Any]:
+        return {"node_id": settings.NODE_ID, "rooms": len(self.rooms),
+                "connections": sum(len(room) for room in self.rooms.values()),
+                "queued_frames": sum(len(c.queue) for room in self.rooms.values() for c in room.values()),
+                "counters": dict(self.counters),
+                "fanout_latency": self.fanout_latency.snapshot(),
+                "room_delivery_latency": {sid: stats.snapshot() for sid, stats in self.room_latency.items()}}
 
 chat_manager = ChatConnectionManager()
 
@@ -1282,7 +5396,8 @@ chat_manager = ChatConnectionManager()
 async def chat_websocket_endpoint(
     websocket: WebSocket,
     session_id: str,
-    token: str = Query(...)
+    token: str = Query(...),
+    lang: Optional[str] = Query(None, max_length=10)
 ):
     try:
         fb_user = await get_current_user_from_token(token)
@@ -1291,38 +5406,83 @@ async def chat_websocket_endpoint(
         await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Authentication failed")
         return
 
-    await chat_manager.connect(websocket, session_id, user.firebase_uid)
-    ai_models = websocket.app.state.ai_model_manager
+    # Each participant reads the room in its own language (defaults to the interface language)
+    user_prefs = json.loads(user.preferences) if isinstance(user.preferences, str) else user.preferences
+    preferred_lang = lang or user_prefs.get('interface_language', 'ru')
+
+    chat_session = await database.fetch_one(chat_sessions.select().where(chat_sessions.c.id == session_id))
+    if not chat_session or chat_session['expires_at'] <= datetime.datetime.utcnow():
+        chat_manager.counters["rejected_unknown_room"] += 1
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Unknown or expired chat session")
+        return
+    participants = await chat_manager.participants(session_id)
+    if user.firebase_uid not in participants and len(participants) >= settings.CHAT_MAX_PARTICIPANTS_PER_ROOM:
+        chat_manager.counters["rejected_room_full"] += 1
+        await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER, reason="Chat session is full")
+        return
+
+    log_session_id.set(session_id)
+    connection = await chat_manager.connect(websocket, session_id, user.firebase_uid, preferred_lang)
+    inference: InferenceBackend = websocket.app.state.inference
 
     try:
         while True:
             data = await websocket.receive_json()
+            connection.touch()
+            if data.get("type") == "pong":
+                continue
             message = ChatMessage(**data)
-
-            # Determine translation direction based on sender's source language
             source_lang = message.source_lang
-            target_lang = 'en' if source_lang == 'ru' else 'ru'
 
-            translator = ai_models.get_model(f"translator_{source_lang}_{target_lang}")
-            if not translator:
-                # Handle unsupported language pair
-                logger.warning(f"Unsupported translation in chat: {source_lang} to {target_lang}")
-                continue
-
-            translated_text = translator(message.text)[0]['translation_text']
-
-            broadcast_message = ChatMessageBroadcast(
-                sender_uid=user.firebase_uid,
-                original_text=message.text,
-                original_lang=source_lang,
-                translated_text=translated_text,
-                translated_lang=target_lang
-            )
-
-            await chat_manager.broadcast(session_id, broadcast_message.model_dump(mode='json'))
+            # Translate once per distinct language present in the room, not once per recipient
+            # Without quota left, messages still go out, untranslated (readers get the original text)
+            room_langs = await chat_manager.room_languages(session_id)
+            allowed, _, _ = await quota_manager.check(user.id, user.is_superuser)
+            translations = (await translate_to_languages(inference, message.text, source_lang, room_langs)
+                            if allowed else {source_lang: message.text})
+
+            message_id, sent_at = str(uuid4()), datetime.datetime.utcnow()
+            messages_by_lang = {
+                target_lang: ChatMessageBroadcast(
+                    id=message_id,
+                    timestamp=sent_at,
+                    sender_uid=user.firebase_uid,
+                    original_text=message.text,
+                    original_lang=source_lang,
+                    translated_text=translated_text,
+                    translated_lang=target_lang
+                ).model_dump(mode='json')
+                for target_lang, translated_text in translations.items()
+            }
+
+            await chat_manager.broadcast(session_id, messages_by_lang, fallback_lang=source_lang)
+            chat_message_log.append({
+                "message_id": message_id, "session_id": session_id, "sender_uid": user.firebase_uid,
+                "original_text": message.text, "original_lang": source_lang,
+                "translations": translations, "timestamp": sent_at
+            })
+            translated_chars = len(message.text) * sum(1 for target_lang in translations if target_lang != source_lang)
+            usage_recorder.record(user.id, chat_messages=1, characters_translated=translated_chars)
+            await quota_manager.charge(user.id, user.is_superuser, characters_translated=translated_chars)
 
     except WebSocketDisconnect:
-        chat_manager.disconnect(session_id, user.firebase_uid)
+        await chat_manager.disconnect(session_id, user.firebase_uid, connection)
     except Exception as e:
         logger.error(f"Error in chat websocket for user {user.firebase_uid} in session {session_id}: {e}")
-        chat_manager.disconnect(session_id, user.firebase_uid)
\ No newline at end of file
+        await chat_manager.disconnect(session_id, user.firebase_uid, connection)
+
+
+# ==============================================================================
+# XII. ENTRY POINTS
+# ==============================================================================
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Volkovoice backend")
+    parser.add_argument("command", choices=["model-server"],
+                        help="'model-server' runs the shared inference server used when INFERENCE_MODE=remote")
+    parser.add_argument("--socket", default=settings.MODEL_SERVER_SOCKET, help="Unix socket path to listen on")
+    cli_args = parser.parse_args()
+
+    if cli_args.command == "model-server":
+        asyncio.run(ModelServer(cli_args.socket).serve_forever())
@@ -0,0 +1,171 @@
+"""
+Cost-based usage quotas: token buckets kept in-process or in any server speaking the Redis
+protocol, and the manager that prices work and enforces per-tier limits.
+"""
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from fastapi import HTTPException, status
+
+from chat_broker import RedisProtocolError, RespConnection
+
+logger = logging.getLogger("volkovoice")
+
+
+class QuotaStore:
+    """Token buckets shared by every worker. consume() returns (allowed, tokens left)."""
+
+    async def consume(self, key: str, cost: float, capacity: float, refill_per_second: float,
+                      allow_debt: bool) -> tuple:
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+def refill_token_bucket(tokens: Optional[float], updated_at: Optional[float], now: float, cost: float,
+                        capacity: float, refill_per_second: float, allow_debt: bool) -> tuple:
+    """
+    One token bucket step: refill since updated_at, then take cost. With allow_debt the
+    cost is always taken (work already done is always billed), leaving the bucket negative
+    until it refills, and `allowed` reports whether there was any balance left beforehand.
+    """
+    tokens = capacity if tokens is None else min(capacity, tokens + max(0.0, now - updated_at) * refill_per_second)
+    allowed = tokens > 0 if allow_debt else tokens >= cost
+    if allowed or allow_debt:
+        tokens -= cost
+    return allowed, tokens
+
+
+class InMemoryQuotaStore(QuotaStore):
+    """Single-process stand-in used when no QUOTA_STORE_URL is configured (development, tests)."""
+
+    def __init__(self):
+        self._buckets: Dict[str, tuple] = {}
+
+    async def consume(self, key: str, cost: float, capacity: float, refill_per_second: float,
+                      allow_debt: bool) -> tuple:
+        now = time.time()
+        tokens, updated_at = self._buckets.get(key, (None, None))
+        allowed, tokens = refill_token_bucket(tokens, updated_at, now, cost, capacity, refill_per_second, allow_debt)
+        self._buckets[key] = (tokens, now)
+        return allowed, tokens
+
+
+class RedisQuotaStore(QuotaStore):
+    """Token buckets in Redis hashes, updated atomically by a Lua script (same rules as refill_token_bucket)."""
+
+    SCRIPT = """
+    local capacity, rate, cost, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+    local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+    local tokens = capacity
+    if state[1] then tokens = math.min(capacity, tonumber(state[1]) + math.max(0, now - tonumber(state[2])) * rate) end
+    local debt = ARGV[5] == '1'
+    local allowed = 0
+    if (debt and tokens > 0) or (not debt and tokens >= cost) then allowed = 1 end
+    if allowed == 1 or debt then tokens = tokens - cost end
+    redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', ARGV[4])
+    redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 60)
+    return {allowed, tostring(tokens)}
+    """
+
+    def __init__(self, url: str):
+        self.url = url
+        self._connection: Optional[RespConnection] = None
+
+    async def _execute(self, *args) -> Any:
+        if self._connection is None:
+            self._connection = await RespConnection.open(self.url)
+        try:
+            return await self._connection.execute(*args)
+        except ConnectionError:
+            logger.warning("Redis quota connection lost; reconnecting.")
+            self._connection = await RespConnection.open(self.url)
+            return await self._connection.execute(*args)
+
+    async def consume(self, key: str, cost: float, capacity: float, refill_per_second: float,
+                      allow_debt: bool) -> tuple:
+        allowed, tokens = await self._execute("EVAL", self.SCRIPT, 1, f"volkovoice:quota:{key}", capacity,
+                                              refill_per_second, cost, time.time(), int(allow_debt))
+        return bool(allowed), float(tokens)
+
+    async def close(self):
+        if self._connection: self._connection.close()
+
+
+class QuotaManager:
+    """
+    Cost-based usage quotas. Work is priced in cost units (QUOTA_COST_WEIGHTS per audio
+    second, character, synthesized second or clone training) and drawn from a per-user
+    token bucket sized by the user's tier (QUOTA_TIERS; a tier without limits is
+    unlimited). Tiers default to QUOTA_DEFAULT_TIER, or QUOTA_SUPERUSER_TIER for
+    superusers, and can be overridden per user in user_quota_tiers. If the shared store
+    is unreachable, requests are allowed and the error is logged. `tier_lookup(user_id)`
+    returns a user's tier override, or None.
+    """
+
+    def __init__(self, cost_weights: Dict[str, float], tiers: Dict[str, Dict[str, float]], default_tier: str,
+                 superuser_tier: str, tier_cache_seconds: float,
+                 tier_lookup: Callable[[int], Awaitable[Optional[str]]]):
+        self.cost_weights = cost_weights
+        self.tiers = tiers
+        self.default_tier = default_tier
+        self.superuser_tier = superuser_tier
+        self.tier_cache_seconds = tier_cache_seconds
+        self.tier_lookup = tier_lookup
+        self.store: QuotaStore = InMemoryQuotaStore()
+        self._tiers: Dict[int, tuple] = {}  # user_id -> (tier, cached_at)
+
+    def start(self, store_url: Optional[str] = None):
+        self.store = RedisQuotaStore(store_url) if store_url else InMemoryQuotaStore()
+
+    async def close(self):
+        await self.store.close()
+
+    def cost(self, **amounts: float) -> float:
+        return sum(self.cost_weights.get(metric, 0.0) * amount for metric, amount in amounts.items())
+
+    async def tier_for(self, user_id: int, is_superuser: bool) -> str:
+        cached = self._tiers.get(user_id)
+        if cached and time.monotonic() - cached[1] < self.tier_cache_seconds:
+            return cached[0]
+        tier = await self.tier_lookup(user_id) or (self.superuser_tier if is_superuser else self.default_tier)
+        self._tiers[user_id] = (tier, time.monotonic())
+        return tier
+
+    def forget_tier(self, user_id: int):
+        self._tiers.pop(user_id, None)
+
+    async def _consume(self, user_id: int, is_superuser: bool, cost: float, allow_debt: bool) -> tuple:
+        """Returns (allowed, remaining units or None if unlimited, seconds until allowed)."""
+        tier = await self.tier_for(user_id, is_superuser)
+        limits = self.tiers.get(tier) or {}
+        if not limits:
+            return True, None, 0.0
+        capacity, rate = limits["capacity"], limits["refill_per_second"]
+        try:
+            allowed, tokens = await self.store.consume(f"user:{user_id}", cost, capacity, rate, allow_debt)
+        except (OSError, RedisProtocolError) as e:
+            logger.error(f"Quota store unavailable, allowing request for user {user_id}: {e}")
+            return True, None, 0.0
+        retry_after = 0.0 if allowed else (max(cost, 0.01) - tokens) / rate
+        return allowed, tokens, retry_after
+
+    async def check(self, user_id: int, is_superuser: bool) -> tuple:
+        """Whether the user has any balance left, without charging (for streaming work)."""
+        return await self._consume(user_id, is_superuser, 0.0, allow_debt=True)
+
+    async def charge(self, user_id: int, is_superuser: bool, **amounts: float):
+        """Bills work that has already been done; may leave the bucket in debt."""
+        cost = self.cost(**amounts)
+        if cost > 0:
+            await self._consume(user_id, is_superuser, cost, allow_debt=True)
+
+    async def require(self, user: Any, **amounts: float):
+        """Takes the (estimated) cost of a request up front, or raises 429 with Retry-After."""
+        allowed, _, retry_after = await self._consume(user.id, user.is_superuser, self.cost(**amounts),
+                                                      allow_debt=not amounts)
+        if not allowed:
+            raise HTTPException(status.HTTP_429_TOO_MANY_REQUESTS, "Usage quota exceeded. Please try again later.",
+                                headers={"Retry-After": str(int(retry_after) + 1)})
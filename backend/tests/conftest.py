@@ -0,0 +1,12 @@
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# main.py reads its settings and opens the database at import time; point it at a scratch
+# SQLite file so the endpoint tests never touch a developer database.
+_scratch_dir = tempfile.mkdtemp(prefix="volkovoice-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{_scratch_dir}/test.db")
+os.environ.setdefault("FIREBASE_SERVICE_ACCOUNT_KEY_JSON", "{}")
+os.environ.setdefault("SUPERUSER_EMAIL", "admin@example.com")
@@ -0,0 +1,45 @@
+import asyncio
+import datetime
+
+import pytest
+
+main = pytest.importorskip("main")
+httpx = pytest.importorskip("httpx")
+
+
+async def _list_users(params):
+    admin = main.UserInDB(id=0, firebase_uid="admin", email="admin@example.com", is_active=True,
+                          is_superuser=True, created_at=datetime.datetime.utcnow(),
+                          preferences=main.UserPreferences())
+    main.app.dependency_overrides[main.get_superuser] = lambda: admin
+    await main.database.connect()
+    try:
+        await main.database.execute(main.users.delete())
+        for i in range(3):
+            await main.database.execute(main.users.insert().values(
+                firebase_uid=f"uid-{i}", email=f"user{i}@example.com", full_name=f"User {i}",
+                is_active=i != 1, is_superuser=False, created_at=datetime.datetime.utcnow(),
+                preferences={"theme": "dark", "default_target_language": "en", "interface_language": "ru"}))
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.get("/api/admin/users", params=params)
+    finally:
+        await main.database.disconnect()
+        main.app.dependency_overrides.pop(main.get_superuser, None)
+
+
+def test_list_users_returns_a_page():
+    response = asyncio.run(_list_users({"limit": 2}))
+    assert response.status_code == 200
+    page = response.json()
+    assert [user["email"] for user in page["users"]] == ["user0@example.com", "user1@example.com"]
+    assert page["users"][0]["preferences"]["theme"] == "dark"
+    assert page["next_cursor"] == page["users"][-1]["id"]
+
+
+def test_list_users_filters_and_ends_pagination():
+    response = asyncio.run(_list_users({"is_active": "false"}))
+    assert response.status_code == 200
+    page = response.json()
+    assert [user["email"] for user in page["users"]] == ["user1@example.com"]
+    assert page["next_cursor"] is None
@@ -0,0 +1,148 @@
+import asyncio
+
+import pytest
+
+from chat_broker import InMemoryChatBroker, RedisChatBroker, RedisCommandError
+
+
+class StandInRedis:
+    """Just enough of a Redis server for the broker: pub/sub, hashes and ECHO (delayed for 'slow' payloads)."""
+
+    def __init__(self):
+        self.hashes = {}
+        self.subscribers = {}
+        self.server = None
+
+    async def start(self) -> str:
+        self.server = await asyncio.start_server(self._serve, "127.0.0.1", 0)
+        return f"redis://127.0.0.1:{self.server.sockets[0].getsockname()[1]}"
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    @staticmethod
+    def _encode(value) -> bytes:
+        if value is None:
+            return b"$-1\r\n"
+        if isinstance(value, int):
+            return b":%d\r\n" % value
+        if isinstance(value, list):
+            return b"*%d\r\n" % len(value) + b"".join(StandInRedis._encode(item) for item in value)
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+
+    async def _serve(self, reader, writer):
+        try:
+            while True:
+                header = await reader.readline()
+                if not header:
+                    break
+                args = []
+                for _ in range(int(header[1:-2])):
+                    length = int((await reader.readline())[1:-2])
+                    args.append((await reader.readexactly(length + 2))[:-2])
+                await self._handle(args, writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _handle(self, args, writer):
+        command = args[0].upper()
+        if command == b"ECHO":
+            if args[1].startswith(b"slow"):
+                await asyncio.sleep(0.2)
+            writer.write(self._encode(args[1]))
+        elif command == b"SUBSCRIBE":
+            for channel in args[1:]:
+                self.subscribers.setdefault(channel, []).append(writer)
+                writer.write(self._encode([b"subscribe", channel, 1]))
+        elif command == b"PUBLISH":
+            receivers = self.subscribers.get(args[1], [])
+            for receiver in receivers:
+                receiver.write(self._encode([b"message", args[1], args[2]]))
+            writer.write(self._encode(len(receivers)))
+        elif command == b"HSET":
+            self.hashes.setdefault(args[1], {})[args[2]] = args[3]
+            writer.write(self._encode(1))
+        elif command == b"HDEL":
+            writer.write(self._encode(int(self.hashes.get(args[1], {}).pop(args[2], None) is not None)))
+        elif command == b"HGETALL":
+            writer.write(self._encode([item for pair in self.hashes.get(args[1], {}).items() for item in pair]))
+        elif command == b"EXPIRE":
+            writer.write(self._encode(1))
+        else:
+            writer.write(b"-ERR unknown command '%s'\r\n" % command)
+        await writer.drain()
+
+
+async def _with_broker(scenario):
+    server = StandInRedis()
+    url = await server.start()
+    broker = RedisChatBroker(url, presence_ttl_seconds=30)
+    await broker.start()
+    try:
+        return await scenario(broker)
+    finally:
+        await broker.close()
+        await server.stop()
+
+
+def test_publish_reaches_subscribers():
+    async def scenario(broker):
+        received = asyncio.Queue()
+        await broker.subscribe("room-1", received.put)
+        await asyncio.sleep(0.05)  # Let the SUBSCRIBE land before publishing
+        await broker.publish("room-1", "hello")
+        return await asyncio.wait_for(received.get(), timeout=1)
+
+    assert asyncio.run(_with_broker(scenario)) == "hello"
+
+
+def test_presence_round_trip():
+    async def scenario(broker):
+        await broker.add_presence("room-1", "alice", {"lang": "ru"})
+        await broker.add_presence("room-1", "bob", {"lang": "en"})
+        await broker.remove_presence("room-1", "bob")
+        return await broker.presence("room-1")
+
+    members = asyncio.run(_with_broker(scenario))
+    assert list(members) == ["alice"]
+    assert members["alice"]["lang"] == "ru"
+
+
+def test_cancelled_command_does_not_leak_its_reply():
+    async def scenario(broker):
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(broker._execute("ECHO", "slow"), timeout=0.05)
+        return await broker._execute("ECHO", "fast")
+
+    assert asyncio.run(_with_broker(scenario)) == b"fast"
+
+
+def test_error_reply_keeps_the_connection():
+    async def scenario(broker):
+        connection = broker._commands
+        with pytest.raises(RedisCommandError):
+            await broker._execute("NOPE")
+        assert broker._commands is connection and not connection.closed
+        return await broker._execute("ECHO", "after")
+
+    assert asyncio.run(_with_broker(scenario)) == b"after"
+
+
+def test_in_memory_broker_delivers_and_tracks_presence():
+    async def scenario():
+        broker = InMemoryChatBroker()
+        received = []
+
+        async def handler(message):
+            received.append(message)
+
+        await broker.subscribe("room-1", handler)
+        await broker.publish("room-1", "hi")
+        await broker.add_presence("room-1", "alice", {})
+        await broker.remove_presence("room-1", "alice")
+        return received, await broker.presence("room-1")
+
+    assert asyncio.run(scenario()) == (["hi"], {})
@@ -0,0 +1,202 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+import quota
+from quota import InMemoryQuotaStore, QuotaManager, QuotaStore, refill_token_bucket
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Freezes quota.time.time() so bucket refills are deterministic; advance with clock.now += seconds."""
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(quota.time, "time", lambda: clock.now)
+    return clock
+
+
+def make_manager(overrides=None):
+    overrides = overrides if overrides is not None else {}
+
+    async def lookup(user_id):
+        return overrides.get(user_id)
+
+    return QuotaManager(cost_weights={"characters_translated": 1.0, "audio_seconds": 2.0},
+                        tiers={"standard": {"capacity": 10.0, "refill_per_second": 1.0}, "unlimited": {}},
+                        default_tier="standard", superuser_tier="unlimited", tier_cache_seconds=60.0,
+                        tier_lookup=lookup)
+
+
+def user(user_id=1, is_superuser=False):
+    return SimpleNamespace(id=user_id, is_superuser=is_superuser)
+
+
+# --- refill_token_bucket ---
+def test_debt_charge_on_empty_bucket_is_billed():
+    allowed, tokens = refill_token_bucket(0.0, 100.0, 100.0, cost=5.0, capacity=10.0,
+                                          refill_per_second=1.0, allow_debt=True)
+    assert not allowed
+    assert tokens == -5.0
+
+
+def test_debt_charge_on_negative_bucket_keeps_billing():
+    allowed, tokens = refill_token_bucket(-5.0, 100.0, 102.0, cost=5.0, capacity=10.0,
+                                          refill_per_second=1.0, allow_debt=True)
+    assert not allowed
+    assert tokens == -8.0
+
+
+def test_debt_charge_with_balance_is_allowed():
+    allowed, tokens = refill_token_bucket(2.0, 100.0, 100.0, cost=5.0, capacity=10.0,
+                                          refill_per_second=1.0, allow_debt=True)
+    assert allowed
+    assert tokens == -3.0
+
+
+def test_up_front_charge_without_enough_balance_takes_nothing():
+    allowed, tokens = refill_token_bucket(2.0, 100.0, 100.0, cost=5.0, capacity=10.0,
+                                          refill_per_second=1.0, allow_debt=False)
+    assert not allowed
+    assert tokens == 2.0
+
+
+def test_refill_is_capped_at_capacity():
+    allowed, tokens = refill_token_bucket(1.0, 100.0, 1000.0, cost=0.0, capacity=10.0,
+                                          refill_per_second=1.0, allow_debt=False)
+    assert allowed
+    assert tokens == 10.0
+
+
+# --- InMemoryQuotaStore ---
+def test_in_memory_store_starts_full_and_refills(clock):
+    store = InMemoryQuotaStore()
+
+    async def scenario():
+        first = await store.consume("user:1", 8.0, 10.0, 1.0, allow_debt=False)
+        refused = await store.consume("user:1", 8.0, 10.0, 1.0, allow_debt=False)
+        clock.now += 6
+        refilled = await store.consume("user:1", 8.0, 10.0, 1.0, allow_debt=False)
+        return first, refused, refilled
+
+    assert asyncio.run(scenario()) == ((True, 2.0), (False, 2.0), (True, 0.0))
+
+
+def test_in_memory_store_keeps_buckets_per_key(clock):
+    store = InMemoryQuotaStore()
+
+    async def scenario():
+        await store.consume("user:1", 10.0, 10.0, 1.0, allow_debt=False)
+        return await store.consume("user:2", 10.0, 10.0, 1.0, allow_debt=False)
+
+    assert asyncio.run(scenario()) == (True, 0.0)
+
+
+# --- QuotaManager ---
+def test_require_takes_the_cost_up_front(clock):
+    manager = make_manager()
+
+    async def scenario():
+        await manager.require(user(), characters_translated=7)
+        return await manager.check(1, False)
+
+    assert asyncio.run(scenario()) == (True, 3.0, 0.0)
+
+
+def test_require_over_balance_raises_429_with_retry_after(clock):
+    manager = make_manager()
+
+    async def scenario():
+        await manager.require(user(), characters_translated=7)
+        await manager.require(user(), characters_translated=7)
+
+    with pytest.raises(HTTPException) as raised:
+        asyncio.run(scenario())
+    assert raised.value.status_code == 429
+    assert raised.value.headers["Retry-After"] == "5"  # (7 - 3) / 1 per second, rounded up past 4
+
+
+def test_refused_require_takes_nothing(clock):
+    manager = make_manager()
+
+    async def scenario():
+        await manager.require(user(), characters_translated=7)
+        with pytest.raises(HTTPException):
+            await manager.require(user(), characters_translated=7)
+        return await manager.check(1, False)
+
+    assert asyncio.run(scenario())[1] == 3.0
+
+
+def test_require_without_amounts_only_needs_a_positive_balance(clock):
+    manager = make_manager()
+
+    async def scenario():
+        await manager.charge(1, False, audio_seconds=4)  # 8 units, leaves 2
+        await manager.require(user())
+        await manager.charge(1, False, audio_seconds=4)  # Into debt: -6
+        with pytest.raises(HTTPException) as raised:
+            await manager.require(user())
+        return raised.value
+
+    error = asyncio.run(scenario())
+    assert error.status_code == 429
+    assert error.headers["Retry-After"] == "7"  # Back above zero after 6 seconds
+
+
+def test_charge_bills_work_already_done_into_debt(clock):
+    manager = make_manager()
+
+    async def scenario():
+        await manager.charge(1, False, characters_translated=25)
+        return await manager.check(1, False)
+
+    allowed, remaining, retry_after = asyncio.run(scenario())
+    assert not allowed
+    assert remaining == -15.0
+    assert retry_after == pytest.approx(15.01)
+
+
+def test_check_does_not_charge(clock):
+    manager = make_manager()
+
+    async def scenario():
+        await manager.check(1, False)
+        return await manager.check(1, False)
+
+    assert asyncio.run(scenario()) == (True, 10.0, 0.0)
+
+
+def test_superusers_default_to_the_unlimited_tier(clock):
+    manager = make_manager()
+
+    async def scenario():
+        await manager.require(user(is_superuser=True), characters_translated=1000)
+        return await manager.tier_for(1, True), await manager.check(1, True)
+
+    assert asyncio.run(scenario()) == ("unlimited", (True, None, 0.0))
+
+
+def test_tier_overrides_are_cached_until_forgotten(clock):
+    overrides = {1: "unlimited"}
+    manager = make_manager(overrides)
+
+    async def scenario():
+        first = await manager.tier_for(1, False)
+        overrides[1] = None
+        cached = await manager.tier_for(1, False)
+        manager.forget_tier(1)
+        return first, cached, await manager.tier_for(1, False)
+
+    assert asyncio.run(scenario()) == ("unlimited", "unlimited", "standard")
+
+
+def test_unreachable_store_allows_requests(clock):
+    class DownStore(QuotaStore):
+        async def consume(self, *args, **kwargs):
+            raise ConnectionRefusedError("store is down")
+
+    manager = make_manager()
+    manager.store = DownStore()
+    assert asyncio.run(manager.check(1, False)) == (True, None, 0.0)
+    asyncio.run(manager.require(user(), characters_translated=1000))
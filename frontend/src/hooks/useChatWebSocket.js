@@ -43,6 +43,16 @@ export const useChatWebSocket = (sessionId) => {
       ws.onmessage = (event) => {
         try {
           const messageData = JSON.parse(event.data);
+          // Control frames carry a `type`; chat messages don't
+          if (messageData.type === 'ping') {
+            ws.send(JSON.stringify({ type: 'pong' }));
+            return;
+          }
+          if (messageData.type === 'messages_skipped') {
+            toast(`Your connection fell behind; ${messageData.data.count} message(s) were skipped.`);
+            return;
+          }
+          if (messageData.type) return;
           // Add the new message to the state, ensuring no duplicates
           setMessages(prev => {
             if (prev.some(m => m.id === messageData.id)) {
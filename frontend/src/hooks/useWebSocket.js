@@ -20,6 +20,11 @@ import toast from 'react-hot-toast';
 export const useWebSocket = (isConnected, formality, voiceCloneId, emotion) => {
   const { user, profile } = useAuth(); // Get user and profile for initial config
   const socketRef = useRef(null);
+  // Resume state: the server keeps a dropped session for a short grace period and replays
+  // every message after `lastSeq` when we reconnect with its resume token.
+  const resumeRef = useRef({ token: null, lastSeq: 0, lastAck: 0, attempts: 0 });
+  const closingRef = useRef(false);
+  const reconnectTimerRef = useRef(null);
 
   const [status, setStatus] = useState('disconnected'); // disconnected, connecting, connected, error
   const [conversation, setConversation] = useState([]);
@@ -77,16 +82,28 @@ export const useWebSocket = (isConnected, formality, voiceCloneId, emotion) => {
       setTopics([]);
       setStatus('connecting');
       setServerMessage('Connecting to Volkovoice...');
+      closingRef.current = false;
+      resumeRef.current = { token: null, lastSeq: 0, lastAck: 0, attempts: 0 };
 
-      user.getIdToken().then(token => {
+      const openSocket = (resuming) => user.getIdToken().then(token => {
+        if (closingRef.current) return;
         const wsUrl = (import.meta.env.VITE_API_BASE_URL || 'http://127.0.0.1:8080')
           .replace(/^http/, 'ws');
+        const resume = resumeRef.current;
+        const query = resuming
+          ? `&resume=${encodeURIComponent(resume.token)}&last_seq=${resume.lastSeq}`
+          : '';
 
-        const ws = new WebSocket(`${wsUrl}/ws/translate?token=${token}`);
+        const ws = new WebSocket(`${wsUrl}/ws/translate?token=${token}${query}`);
         socketRef.current = ws;
 
         ws.onopen = () => {
           setStatus('connected');
+          if (resuming) {
+            // The server kept our config and voice; it replays what we missed
+            setServerMessage('Reconnected.');
+            return;
+          }
           setServerMessage('Connection established. Start speaking.');
           // Send initial config based on user profile
           sendConfig({
@@ -107,10 +124,30 @@ export const useWebSocket = (isConnected, formality, voiceCloneId, emotion) => {
             try {
               const message = JSON.parse(event.data);
               const id = `${Date.now()}-${Math.random()}`; // More unique ID
+              if (typeof message.seq === 'number') {
+                const resume = resumeRef.current;
+                resume.lastSeq = message.seq;
+                if (message.seq - resume.lastAck >= 32) { // Lets the server trim its replay buffer
+                  ws.send(JSON.stringify({ type: 'ack', data: { seq: message.seq } }));
+                  resume.lastAck = message.seq;
+                }
+              }
               switch (message.type) {
                 case 'status':
                   setServerMessage(message.data);
                   break;
+                case 'queue':
+                  setServerMessage(message.data.message);
+                  break;
+                case 'session':
+                  resumeRef.current.token = message.data.resume_token;
+                  break;
+                case 'resumed':
+                  resumeRef.current.attempts = 0;
+                  if (message.data.missing_from !== null) {
+                    toast('Some translations were lost while reconnecting.', { id: 'resume' });
+                  }
+                  break;
                 case 'transcript':
                   setConversation(prev => [...prev, { ...message.data, type: 'transcript', id }]);
                   break;
@@ -124,13 +161,18 @@ export const useWebSocket = (isConnected, formality, voiceCloneId, emotion) => {
                     lang: message.data.target_lang || message.data.lang,
                   }]);
                   break;
-                  case 'keywords':
-                setTopics(prevTopics => {
-                  // Use a Set to ensure all topics are unique
-                  const newTopics = new Set([...prevTopics, ...message.data]);
-                  return Array.from(newTopics);
-                });
-                break;
+                case 'keywords':
+                  // The server sends the full current ranking; topics that faded out are dropped
+                  setTopics(message.data);
+                  break;
+                case 'quality':
+                  // Under heavy load the server lowers quality (e.g. text-only) and restores it later
+                  if (message.data.tier === 'full') toast.success('Full translation quality restored.', { id: 'quality' });
+                  else toast(`High server load: ${message.data.features.speech ? 'reduced quality' : 'text-only translation'} for now.`, { id: 'quality' });
+                  break;
+                case 'quota_exceeded':
+                  toast.error(`Usage quota reached. Speech is paused for about ${Math.ceil(message.data.retry_after_seconds)}s.`, { id: 'quota' });
+                  break;
                 case 'live_clone_success':
                   toast.success(message.data, { icon: '✨' });
                   setIsLiveCloneActive(true);
@@ -151,23 +193,38 @@ export const useWebSocket = (isConnected, formality, voiceCloneId, emotion) => {
 
         ws.onerror = (error) => {
           console.error('WebSocket Error:', error);
+          if (resumeRef.current.token) return; // onclose retries the session
           setStatus('error');
           setServerMessage('Connection error.');
           toast.error("Connection failed. Please refresh and try again.");
         };
 
         ws.onclose = () => {
+          if (socketRef.current === ws) socketRef.current = null;
+          const resume = resumeRef.current;
+          // Unexpected drop of an established session: retry within the server's grace period
+          if (!closingRef.current && resume.token && resume.attempts < 5) {
+            resume.attempts += 1;
+            setStatus('connecting');
+            setServerMessage('Connection lost. Reconnecting...');
+            reconnectTimerRef.current = setTimeout(() => openSocket(true), 1000 * resume.attempts);
+            return;
+          }
+          resume.token = null;
           setStatus('disconnected');
           setServerMessage('Connection closed.');
-          socketRef.current = null;
         };
       });
+
+      openSocket(false);
     }
 
     // Cleanup: close the socket when the component unmounts or `isConnected` becomes false
     return () => {
+      closingRef.current = true;
+      clearTimeout(reconnectTimerRef.current);
       if (socketRef.current) {
-        socketRef.current.close();
+        socketRef.current.close(1000, 'Session ended'); // A clean close tells the server not to hold the session for resume
         socketRef.current = null;
       }
     };
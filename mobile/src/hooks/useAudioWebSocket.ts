@@ -26,6 +26,11 @@ export const useAudioWebSocket = (
 ) => {
   const { user, profile } = useAuth();
   const socketRef = useRef<WebSocket | null>(null);
+  // Resume state: the server keeps a dropped session for a short grace period and replays
+  // every message after `lastSeq` when we reconnect with its resume token.
+  const resumeRef = useRef({ token: null as string | null, lastSeq: 0, lastAck: 0, attempts: 0 });
+  const closingRef = useRef(false);
+  const reconnectTimerRef = useRef<ReturnType<typeof setTimeout> | null>(null);
 
   // --- State Management ---
   const [status, setStatus] = useState<'connecting' | 'connected' | 'error' | 'disconnected'>('disconnected');
@@ -101,14 +106,25 @@ export const useAudioWebSocket = (
       setStatus('connecting');
       setServerMessage('Connecting...');
 
-      user.getIdToken().then(token => {
+      closingRef.current = false;
+      resumeRef.current = { token: null, lastSeq: 0, lastAck: 0, attempts: 0 };
+
+      const openSocket = (resuming: boolean) => user.getIdToken().then(token => {
+        if (closingRef.current) return;
         const wsUrl = ('http://10.0.2.2:8000' || 'http://localhost:8000').replace(/^http/, 'ws');
-        const ws = new WebSocket(`${wsUrl}/ws/translate?token=${token}`);
+        const resume = resumeRef.current;
+        const query = resuming ? `&resume=${encodeURIComponent(resume.token ?? '')}&last_seq=${resume.lastSeq}` : '';
+        const ws = new WebSocket(`${wsUrl}/ws/translate?token=${token}${query}`);
         socketRef.current = ws;
         ws.binaryType = 'blob'; // Important for receiving audio data
 
         ws.onopen = () => {
                 setStatus('connected');
+                if (resuming) {
+                    // The server kept our config and voice; it replays what we missed
+                    setServerMessage('Reconnected.');
+                    return;
+                }
                 sendConfig({
                     source_lang: profile?.preferences?.interface_language || 'ru',
                     target_lang: profile?.preferences?.default_target_language || 'en',
@@ -116,11 +132,23 @@ export const useAudioWebSocket = (
             };
         ws.onerror = (e) => {
             console.error('WebSocket Error:', e);
+            if (resumeRef.current.token) return; // onclose retries the session
             setStatus('error');
             setServerMessage('Connection Error');
             toast.error('Connection failed.');
         };
         ws.onclose = () => {
+            if (socketRef.current === ws) socketRef.current = null;
+            const resume = resumeRef.current;
+            // Unexpected drop of an established session: retry within the server's grace period
+            if (!closingRef.current && resume.token && resume.attempts < 5) {
+                resume.attempts += 1;
+                setStatus('connecting');
+                setServerMessage('Connection lost. Reconnecting...');
+                reconnectTimerRef.current = setTimeout(() => openSocket(true), 1000 * resume.attempts);
+                return;
+            }
+            resume.token = null;
             setStatus('disconnected');
             setServerMessage('Disconnected.');
             isPlayingRef.current = false;
@@ -132,11 +160,27 @@ export const useAudioWebSocket = (
           if (typeof event.data === 'string') {
             const message = JSON.parse(event.data);
             const id = `${Date.now()}-${Math.random()}`;
+            if (typeof message.seq === 'number') {
+              const resume = resumeRef.current;
+              resume.lastSeq = message.seq;
+              if (message.seq - resume.lastAck >= 32) { // Lets the server trim its replay buffer
+                ws.send(JSON.stringify({ type: 'ack', data: { seq: message.seq } }));
+                resume.lastAck = message.seq;
+              }
+            }
              switch (message.type) {
                 case 'status': setServerMessage(message.data); break;
+                case 'queue': setServerMessage(message.data.message); break;
+                case 'session': resumeRef.current.token = message.data.resume_token; break;
+                case 'resumed':
+                  resumeRef.current.attempts = 0;
+                  if (message.data.missing_from !== null) toast('Some translations were lost while reconnecting.', { id: 'resume' });
+                  break;
                 case 'transcript': setConversation(prev => [{ ...message.data, type: 'transcript', id }, ...prev]); break;
                 case 'translation': setConversation(prev => [{ ...message.data, type: 'translation', id }, ...prev]); break;
-                case 'keywords': setTopics(prev => Array.from(new Set([...prev, ...message.data]))); break;
+                case 'keywords': setTopics(message.data); break; // The server sends the full current ranking
+                case 'quality': toast(message.data.tier === 'full' ? 'Full translation quality restored.' : `High server load: ${message.data.features.speech ? 'reduced quality' : 'text-only translation'} for now.`, { id: 'quality' }); break;
+                case 'quota_exceeded': toast.error(`Usage quota reached. Speech is paused for about ${Math.ceil(message.data.retry_after_seconds)}s.`, { id: 'quota' }); break;
                 case 'live_clone_success': toast.success(message.data, {icon: '✨'}); setIsLiveCloneActive(true); break;
                 case 'error': toast.error(message.data); break;
             }
@@ -155,9 +199,18 @@ export const useAudioWebSocket = (
         };
       });
 
-      return () => { socketRef.current?.close(); socketRef.current = null; };
+      openSocket(false);
+
+      // A clean close (1000) tells the server not to hold the session for resume
+      return () => {
+        closingRef.current = true;
+        if (reconnectTimerRef.current) clearTimeout(reconnectTimerRef.current);
+        socketRef.current?.close(1000, 'Session ended');
+        socketRef.current = null;
+      };
     } else if (!isActive && socketRef.current) {
-        socketRef.current.close();
+        closingRef.current = true;
+        socketRef.current.close(1000, 'Session ended');
     }
   }, [isActive, user, profile, sendConfig, processAudioQueue]);
 
@@ -43,8 +43,21 @@ export const useChatWebSocket = (sessionId: string | undefined) => {
       ws.onclose = () => setStatus('disconnected');
       ws.onmessage = (event) => {
         try {
-          const messageData: ChatMessage = JSON.parse(event.data);
-          setMessages(prev => [messageData, ...prev]); // Prepend for inverted FlatList
+          const messageData = JSON.parse(event.data);
+          // Control frames carry a `type`; chat messages don't
+          if (messageData.type === 'ping') {
+            ws.send(JSON.stringify({ type: 'pong' }));
+            return;
+          }
+          if (messageData.type === 'messages_skipped') {
+            toast(`Your connection fell behind; ${messageData.data.count} message(s) were skipped.`);
+            return;
+          }
+          if (messageData.type) return;
+          // Replayed history may overlap with live messages; skip duplicates
+          setMessages(prev => prev.some(m => m.id === messageData.id)
+            ? prev
+            : [messageData, ...prev]); // Prepend for inverted FlatList
         } catch (e) {
           console.error('Failed to parse chat message:', e);
         }